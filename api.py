@@ -0,0 +1,292 @@
+"""
+HTTP API over the labelled dataset written by ``clustering_kmeans``.
+
+Endpoints (all GET):
+    /latest                                   every cell on the latest date
+    /cells?date=YYYY-MM-DD&bbox=W,S,E,N       cells of one date (default latest), optionally inside a bbox
+    /cell/<cell_id>/history?start=&end=       one cell's rows in date order
+
+Responses are JSON records, or an Arrow IPC stream with ``format=arrow`` or
+``Accept: application/vnd.apache.arrow.stream`` (needs pyarrow). Every
+response carries an ETag made of the dataset version and the normalised
+request, so ``If-None-Match`` is answered with 304 before any work is done,
+and bodies are gzip-compressed when the client accepts it. Encoded bodies are
+kept in a small LRU cache and ``/latest`` is encoded once per dataset.
+
+The dataset is held in a ``LabelIndex``: rows sorted by (date, cell) so a date
+is a contiguous slice, plus a (cell, date) permutation for histories. A
+watcher thread rebuilds the index when the CSV changes and swaps it in with a
+single reference assignment, so requests always see one complete version.
+
+Usage:
+    python api.py --data Final_Merged_Dataset_with_UHI_Labels.csv --port 8000
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from cadence import layers_version, read_dataset
+from regions import cell_id_from_index
+
+DATA_PATH = "Final_Merged_Dataset_with_UHI_Labels.csv"
+ARROW_TYPE = "application/vnd.apache.arrow.stream"
+MIN_GZIP_BYTES = 1024
+
+
+class UnknownEndpoint(LookupError):
+    """Request path that is not an API endpoint (unknown dates and cells raise KeyError)."""
+
+
+class LabelIndex:
+    """In-memory (date, cell) index over one version of the labelled dataset."""
+
+    def __init__(self, df, version):
+        df = df.copy()
+        if 'cell_id' not in df.columns:
+            df['cell_id'] = cell_id_from_index(df['system:index'].astype(str))
+        df = df.drop(columns=['system:index'], errors='ignore')
+        for column in df.columns:
+            if column != 'cell_id' and df[column].dtype.kind == 'f':
+                df[column] = df[column].where(df[column] != -999).astype(np.float32)
+        df = df.sort_values(['Date', 'cell_id'], kind='stable', ignore_index=True)
+
+        self.df = df
+        self.version = version
+        dates = df['Date'].to_numpy().astype(str)
+        self.dates = np.unique(dates)
+        self.date_bounds = np.append(np.searchsorted(dates, self.dates), len(df))
+        self.latitude = df['Latitude'].to_numpy()
+        self.longitude = df['Longitude'].to_numpy()
+
+        cell_id = df['cell_id'].to_numpy()
+        self.by_cell = np.lexsort((np.arange(len(df)), cell_id)).astype(np.int64)
+        self.cells, starts = np.unique(cell_id[self.by_cell], return_index=True)
+        self.cell_bounds = np.append(starts, len(df))
+        self.latest_date = self.dates[-1] if len(self.dates) else None
+
+    def _day_slice(self, date):
+        i = np.searchsorted(self.dates, date)
+        if i == len(self.dates) or self.dates[i] != date:
+            raise KeyError(f"no data for date {date}")
+        return slice(self.date_bounds[i], self.date_bounds[i + 1])
+
+    def cells_on(self, date=None, bbox=None):
+        """
+        Rows of one date, optionally limited to ``bbox = (west, south, east, north)``.
+        """
+        rows = self._day_slice(date or self.latest_date)
+        out = self.df.iloc[rows]
+        if bbox is not None:
+            west, south, east, north = bbox
+            lat, lon = self.latitude[rows], self.longitude[rows]
+            out = out[(lon >= west) & (lon <= east) & (lat >= south) & (lat <= north)]
+        return out
+
+    def history(self, cell_id, start=None, end=None):
+        """Rows of one cell in date order, optionally within [start, end]."""
+        i = np.searchsorted(self.cells, cell_id)
+        if i == len(self.cells) or self.cells[i] != cell_id:
+            raise KeyError(f"unknown cell {cell_id}")
+        out = self.df.iloc[self.by_cell[self.cell_bounds[i]:self.cell_bounds[i + 1]]]
+        if start or end:
+            dates = out['Date'].to_numpy().astype(str)
+            keep = np.ones(len(out), dtype=bool)
+            if start:
+                keep &= dates >= start
+            if end:
+                keep &= dates <= end
+            out = out[keep]
+        return out
+
+
+def load_index(path=DATA_PATH):
+    stat = os.stat(path)
+    # A rewritten NDVI_16day.csv changes the attached values too
+    key = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}:{layers_version()}"
+    version = hashlib.md5(key.encode()).hexdigest()[:12]
+    started = time.perf_counter()
+    index = LabelIndex(read_dataset(path), version)
+    print(f"Indexed {len(index.df)} rows, {len(index.cells)} cells, {len(index.dates)} dates "
+          f"(version {version}) in {time.perf_counter() - started:.1f} s")
+    return index
+
+
+def encode(df, fmt):
+    """Serialise rows as JSON records or an Arrow IPC stream."""
+    if fmt == "arrow":
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    return df.to_json(orient="records", double_precision=5).encode()
+
+
+class LabelService:
+    """Current index, response cache and dataset watcher shared by all request threads."""
+
+    def __init__(self, path=DATA_PATH, cache_size=256):
+        self.path = path
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.index = None
+        self.reload()
+
+    def reload(self):
+        """Build a new index off to the side, then swap it in atomically."""
+        index = load_index(self.path)
+        warm = {("/latest", (), "json"): self._encode(index.cells_on(), "json", compresslevel=6)}
+        with self._lock:
+            self.index = index
+            self._cache = OrderedDict(((index.version,) + key, body) for key, body in warm.items())
+
+    def watch(self, interval=30):
+        """Reload in a daemon thread when the dataset file changed and has been stable for one interval."""
+        def loop():
+            loaded = seen = os.stat(self.path).st_mtime_ns
+            while True:
+                time.sleep(interval)
+                try:
+                    mtime = os.stat(self.path).st_mtime_ns
+                    if mtime != loaded and mtime == seen:
+                        self.reload()
+                        loaded = mtime
+                    seen = mtime
+                except Exception as exc:  # keep serving the current index
+                    print(f"Reload failed: {exc}")
+
+        threading.Thread(target=loop, daemon=True, name="dataset-watcher").start()
+
+    @staticmethod
+    def _encode(df, fmt, compresslevel=1):
+        body = encode(df, fmt)
+        return body, gzip.compress(body, compresslevel=compresslevel) if len(body) >= MIN_GZIP_BYTES else None
+
+    def etag(self, index, path, query, fmt):
+        digest = hashlib.md5(repr((path, query, fmt)).encode()).hexdigest()[:12]
+        return f'W/"{index.version}-{digest}"'
+
+    def response(self, index, path, query, fmt):
+        """(body, gzipped body or None) for a request, from the cache when possible."""
+        key = (index.version, path, query, fmt)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        params = dict(query)
+        if path == "/latest":
+            rows = index.cells_on()
+        elif path == "/cells":
+            bbox = params.get("bbox")
+            rows = index.cells_on(params.get("date"), tuple(float(v) for v in bbox.split(",")) if bbox else None)
+        elif path.startswith("/cell/") and path.endswith("/history"):
+            rows = index.history(int(path.split("/")[2]), params.get("start"), params.get("end"))
+        else:
+            raise UnknownEndpoint(path)
+        bodies = self._encode(rows, fmt)
+        with self._lock:
+            self._cache[key] = bodies
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return bodies
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+        # Headers and body leave in one segment: no Nagle / delayed-ACK stall on keep-alive connections
+        disable_nagle_algorithm = True
+        wbufsize = 1 << 16
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body=b"", content_type="application/json", headers=None):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _error(self, status, message):
+            self._send(status, json.dumps({"error": message}).encode())
+
+        def do_GET(self):
+            index = service.index  # one consistent version for the whole request
+            url = urlsplit(self.path)
+            query = tuple(sorted((k, v[-1]) for k, v in parse_qs(url.query).items() if k != "format"))
+            wants_arrow = parse_qs(url.query).get("format", [""])[-1] == "arrow" \
+                or ARROW_TYPE in self.headers.get("Accept", "")
+            fmt = "arrow" if wants_arrow else "json"
+            path = url.path.rstrip("/") or "/"
+
+            etag = service.etag(index, path, query, fmt)
+            headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+            if etag in self.headers.get("If-None-Match", ""):
+                self.send_response(304)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            try:
+                body, gzipped = service.response(index, path, query, fmt)
+            except UnknownEndpoint:
+                return self._error(404, f"unknown endpoint {path}")
+            except KeyError as exc:
+                return self._error(404, exc.args[0])
+            except ValueError as exc:
+                return self._error(400, str(exc))
+            except ImportError:
+                return self._error(406, "Arrow output needs pyarrow installed on the server")
+            if gzipped is not None and "gzip" in self.headers.get("Accept-Encoding", ""):
+                body = gzipped
+                headers["Content-Encoding"] = "gzip"
+            self._send(200, body, ARROW_TYPE if fmt == "arrow" else "application/json", headers)
+
+    return Handler
+
+
+def serve(path=DATA_PATH, host="127.0.0.1", port=8000, watch_interval=30, workers=1):
+    """
+    Start the API and block.
+
+    With ``workers > 1`` the process forks after building the index; the
+    workers share the listening socket and, copy-on-write, the index pages.
+    Each worker watches the dataset and swaps its own index.
+    """
+    service = LabelService(path)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    for _ in range(workers - 1):
+        if os.fork() == 0:
+            break
+    service.watch(watch_interval)
+    print(f"Serving UHI labels on http://{host}:{port} (pid {os.getpid()})")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="HTTP API for UHI labels and cell features")
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--watch-interval", type=float, default=30)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+    serve(args.data, args.host, args.port, args.watch_interval, args.workers)
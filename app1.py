@@ -1,101 +1,83 @@
+import time
+_script_started = time.perf_counter()
+
+import calendar
 import streamlit as st
-import ee
-import geemap.foliumap as geemap
-import folium
-import numpy as np
-import requests
-import pandas as pd
-
-# Initialize Earth Engine
-ee.Initialize(project='heat-islands')
-
-# --- Define grid parameters and fix bounding box ---
-lat_min, lon_min = 18.847, 72.744
-lat_step = 5 / 111
-lon_step = 5 / 102
-
-lat_values = np.arange(lat_min, 19.797, lat_step)
-lon_values = np.arange(lon_min, 73.712, lon_step)
-
-lat_max = lat_values[-1] + lat_step
-lon_max = lon_values[-1] + lon_step
-
-bbox = ee.Geometry.BBox(lon_min, lat_min, lon_max, lat_max)
-roi = ee.Geometry.Rectangle([lon_min, lat_min, lon_max, lat_max])
-
-# Grid generation for other layers
-features = []
-for lat in lat_values:
-    for lon in lon_values:
-        box = ee.Geometry.Rectangle([lon, lat, lon + lon_step, lat + lat_step])
-        feature = ee.Feature(box, {
-            'lat_center': lat + lat_step / 2,
-            'lon_center': lon + lon_step / 2
-        })
-        features.append(feature)
+from regions import get_region, region_names
+from pyramid import available_levels, level_for_zoom, read_latest
+from composites import SEASONS, available_years
+from app_support import (UHI_COLORS, LayerView, earth_engine, ee_region, ee_map, folium_map, latest_rows,
+                         record_first_paint, show_history, show_hotspots, show_map, show_stability)
+from cell_raster import add_cells, render_mode
+from map_tiles import sampled_days
+
+# Earth Engine is initialised on first use by an EE-backed layer (app_support.earth_engine)
+
+st.set_page_config(layout="wide")
+st.title("Urban Heat Island (UHI) Visualiser")
 
-grid_fc = ee.FeatureCollection(features)
+# --- Region selection: grid parameters and bounding box from regions.json ---
+region_name = st.sidebar.selectbox("Region", region_names())
+region = get_region(region_name)
+zoom = st.sidebar.slider("Map zoom (sets grid resolution)", 6, 13, region['zoom'])
+
+@st.cache_resource
+def pyramid_latest(name, level_km):
+    return read_latest(name, level_km)
+
+
+def latest_region_rows(path):
+    """
+    Rows of the latest date for the selected region (all cells, whatever the grid size),
+    read-only and shared across sessions.
+    Below the base resolution's zoom, the matching coarser pyramid level is used instead.
+    """
+    level_km = level_for_zoom(zoom, available_levels(region_name))
+    if level_km != region['cell_km']:
+        return pyramid_latest(region_name, level_km)
+    return latest_rows(path, region_name)
+
+# Period: composites come from the precomputed store (composites.py), live EE otherwise
+years = available_years(region_name) or [2024]
+year = st.sidebar.selectbox("Year", years, index=len(years) - 1)
+period = st.sidebar.radio("Period", ("Annual", "Season", "Month"), horizontal=True)
+if period == "Season":
+    months = SEASONS[st.sidebar.selectbox("Season", list(SEASONS))]
+elif period == "Month":
+    months = [st.sidebar.selectbox("Month", range(1, 13), format_func=lambda m: calendar.month_name[m])]
+else:
+    months = list(range(1, 13))
+start_date = f'{year}-{months[0]:02d}-01'
+end_date = f'{year + months[-1] // 12}-{months[-1] % 12 + 1:02d}-01'
+# Slow ERA5 layers show a quick preview first, then the exact composite (map_tiles.py)
+progressive = st.sidebar.checkbox("Progressive EE layers (preview first)", value=True)
 
-# Year and date
-year = 2024
-start_date = f'{year}-01-01'
-end_date = f'{year}-12-31'
 
 # ------------------------- Layer Functions ----------------------------
 
-def get_lst():
-    dataset = ee.ImageCollection('ECMWF/ERA5_LAND/DAILY_AGGR') \
-        .filterDate(start_date, end_date).select('temperature_2m')
-    lst_celsius = dataset.mean().subtract(273.15).clip(bbox)
-    vis_params = {
+# Visualisation parameters and legend label of every layer
+LAYER_STYLES = {
+    'lst': ({
         'min': -10,
         'max': 50,
         'palette': ['000080', '0000d9', '4000ff', '8000ff', '0080ff', '00ffff',
                     '00ff80', '80ff00', 'daff00', 'ffff00', 'fff500', 'ffda00',
                     'ffb000', 'ffa400', 'ff4f00', 'ff2500', 'ff0a00', 'ff00ff']
-    }
-    return lst_celsius, vis_params, 'LST (°C)'
-
-def get_ndvi():
-    dataset = ee.ImageCollection("MODIS/061/MOD13Q1") \
-        .filterDate(start_date, end_date).select('NDVI') \
-        .map(lambda img: img.divide(10000)).mean().clip(bbox)
-    vis_params = {
+    }, 'LST (°C)'),
+    'ndvi': ({
         'min': 0,
         'max': 1,
         'palette': ['white', 'green']
-    }
-    return dataset, vis_params, 'NDVI'
-
-def get_rainfall():
-    dataset = ee.ImageCollection('ECMWF/ERA5_LAND/DAILY_AGGR') \
-        .filterDate(start_date, end_date).select('total_precipitation_sum')
-    rainfall_mm = dataset.sum().multiply(1000).clip(bbox)
-    vis_params = {
+    }, 'NDVI'),
+    'rainfall': ({
         'min': 0,
         'max': 2000,
         'palette': ['lightblue', 'blue', 'darkblue', 'purple']
-    }
-    return rainfall_mm, vis_params, 'Rainfall (mm)'
-
-def get_humidity():
-    dataset = ee.ImageCollection('ECMWF/ERA5_LAND/DAILY_AGGR') \
-        .filterDate(start_date, end_date) \
-        .select(['temperature_2m', 'dewpoint_temperature_2m'])
-
-    def compute_rh(image):
-        temp = image.select('temperature_2m').subtract(273.15)
-        dew = image.select('dewpoint_temperature_2m').subtract(273.15)
-        es = temp.expression('6.112 * exp((17.67 * T) / (T + 243.5))', {'T': temp})
-        ed = dew.expression('6.112 * exp((17.67 * Td) / (Td + 243.5))', {'Td': dew})
-        rh = ed.divide(es).multiply(100).rename('relative_humidity')
-        return rh.set('system:time_start', image.get('system:time_start'))
-
-    humidity = dataset.map(compute_rh).mean().clip(bbox)
-    vis_params = {
+    }, 'Rainfall (mm)'),
+    'humidity': ({
         'min': 0,
         'max': 100,
-        'pallette':[
+        'palette':[
             'white',         # Very Low
             'lightcyan',
             'lightskyblue',
@@ -110,24 +92,66 @@ def get_humidity():
             'darkviolet',
             'blueviolet'
         ]
+    }, 'Relative Humidity (%)'),
+    'isa': ({
+        'min': 0,
+        'max': 1,
+        'palette': ['red']
+    }, 'ISA (Built-up Area)'),
+    'wind': ({
+        'min': 0,
+        'max': 15,
+        'palette': ['white', 'skyblue', 'blue', 'navy']
+    }, 'Wind Speed (m/s)'),
+}
+
+def era5_days(bands, every=1):
+    """ERA5-Land daily images of the selected period; only every ``every``-th day for previews."""
+    ee = earth_engine()
+    dataset = ee.ImageCollection('ECMWF/ERA5_LAND/DAILY_AGGR').filterDate(start_date, end_date)
+    if every > 1:
+        dataset = dataset.filter(ee.Filter.inList('system:index', sampled_days(start_date, end_date, every)))
+    return dataset.select(bands)
+
+def get_lst(every=1):
+    bbox, _ = ee_region(region_name)
+    dataset = era5_days('temperature_2m', every)
+    return dataset.mean().subtract(273.15).clip(bbox)
 
-    }
-    return humidity, vis_params, 'Relative Humidity (%)'
+def get_ndvi():
+    ee, (bbox, _) = earth_engine(), ee_region(region_name)
+    return ee.ImageCollection("MODIS/061/MOD13Q1") \
+        .filterDate(start_date, end_date).select('NDVI') \
+        .map(lambda img: img.divide(10000)).mean().clip(bbox)
+
+def get_rainfall(every=1):
+    bbox, _ = ee_region(region_name)
+    dataset = era5_days('total_precipitation_sum', every)
+    # A sampled sum stands for ``every`` days each
+    return dataset.sum().multiply(1000 * every).clip(bbox)
+
+def get_humidity(every=1):
+    bbox, _ = ee_region(region_name)
+    dataset = era5_days(['temperature_2m', 'dewpoint_temperature_2m'], every)
+
+    def compute_rh(image):
+        temp = image.select('temperature_2m').subtract(273.15)
+        dew = image.select('dewpoint_temperature_2m').subtract(273.15)
+        es = temp.expression('6.112 * exp((17.67 * T) / (T + 243.5))', {'T': temp})
+        ed = dew.expression('6.112 * exp((17.67 * Td) / (Td + 243.5))', {'Td': dew})
+        rh = ed.divide(es).multiply(100).rename('relative_humidity')
+        return rh.set('system:time_start', image.get('system:time_start'))
+
+    return dataset.map(compute_rh).mean().clip(bbox)
 
 def get_isa():
+    ee, (bbox, _) = earth_engine(), ee_region(region_name)
     isa_img = ee.ImageCollection('ESA/WorldCover/v100').first().clip(bbox)
-    isa_builtup = isa_img.eq(50).selfMask()
-    vis_params = {
-        'min': 0,
-        'max': 1,
-        'palette': ['red']
-    }
-    return isa_builtup, vis_params, 'ISA (Built-up Area)'
+    return isa_img.eq(50).selfMask()
 
-def get_wind():
-    dataset = ee.ImageCollection("ECMWF/ERA5_LAND/DAILY_AGGR") \
-        .filterDate(start_date, end_date) \
-        .select(["u_component_of_wind_10m", "v_component_of_wind_10m"])
+def get_wind(every=1):
+    bbox, _ = ee_region(region_name)
+    dataset = era5_days(["u_component_of_wind_10m", "v_component_of_wind_10m"], every)
 
     def add_speed_dir(image):
         u = image.select("u_component_of_wind_10m")
@@ -138,57 +162,34 @@ def get_wind():
                     .select(["wind_speed", "wind_direction"]) \
                     .copyProperties(image, ["system:time_start"])
 
-    wind = dataset.map(add_speed_dir).select("wind_speed").mean().clip(bbox)
-    vis_params = {
-        'min': 0,
-        'max': 15,
-        'palette': ['white', 'skyblue', 'blue', 'navy']
-    }
-    return wind, vis_params, 'Wind Speed (m/s)'
+    return dataset.map(add_speed_dir).select("wind_speed").mean().clip(bbox)
+
+# Every EE-backed layer, prefetched together (LayerView.prefetch_layers)
+LAYER_FUNCTIONS = {'lst': get_lst, 'ndvi': get_ndvi, 'rainfall': get_rainfall, 'humidity': get_humidity,
+                   'isa': get_isa, 'wind': get_wind}
+# Annual aggregates of daily ERA5 images: drawn progressively (show_progressive)
+PREVIEW_LAYERS = ('lst', 'rainfall', 'humidity', 'wind')
+# Stored composite or EE layer for the selected region and period (app_support.LayerView)
+layers = LayerView(region_name, region['center'], zoom, year, months, (start_date, end_date), LAYER_STYLES,
+                   LAYER_FUNCTIONS, PREVIEW_LAYERS, progressive)
 
 # ------------------------- UHI Layer ----------------------------
 
 def get_uhi():
-    # Initialize Earth Engine
-    try:
-        ee.Initialize(project='heat-islands')
-    except Exception as e:
-        ee.Authenticate()
-        ee.Initialize(project='heat-islands')
-
-    # Load dataset
-    df = pd.read_csv("Final_Merged_Dataset_with_UHI_Labels.csv")
-
-    # Define grid parameters and bounding box
-    lat_min, lon_min = 18.847, 72.744
-    lat_step = 5 / 111
-    lon_step = 5 / 102
-
-    lat_values = np.arange(lat_min, 19.797, lat_step)
-    lon_values = np.arange(lon_min, 73.712, lon_step)
-
-    # Grid generation
-    features = []
-    for lat in lat_values:
-        for lon in lon_values:
-            box = ee.Geometry.Rectangle([lon, lat, lon + lon_step, lat + lat_step])
-            feature = ee.Feature(box, {
-                'lat_center': lat + lat_step / 2,
-                'lon_center': lon + lon_step / 2
-            })
-            features.append(feature)
-
-    grid_fc = ee.FeatureCollection(features)
-
-    # Create map
-    map_center=[19.2, 73.2]
-    Map = geemap.Map(center=map_center, zoom=10)
-
-    # Add grid to map
-    Map.addLayer(grid_fc.style(color='black', fillColor='00000000', width=1), {}, '5x5 km Grid Boxes')
+    df_subset = latest_region_rows("Final_Merged_Dataset_with_UHI_Labels.csv")[['Latitude', 'Longitude', 'Cluster', 'UHI_Label']]
+    if render_mode(len(df_subset)) == "image":
+        # Too many cells for one EE point feature each: one image overlay, no EE needed (cell_raster.py)
+        Map = folium_map(region_name, region['center'], zoom)
+        add_cells(Map, df_subset, 'UHI_Label', UHI_COLORS, 'UHI Labels')
+        show_map(Map)
+        return
+
+    ee = earth_engine()
+
+    # Create map with the grid boxes
+    Map = ee_map(region_name, region['center'], zoom)
 
     # Prepare UHI features
-    df_subset = df.tail(440)[['Latitude', 'Longitude', 'Cluster', 'UHI_Label']].copy()
     features_cluster = []
     for _, row in df_subset.iterrows():
         point = ee.Geometry.Point([row['Longitude'], row['Latitude']])
@@ -201,13 +202,7 @@ def get_uhi():
     fc = ee.FeatureCollection(features_cluster)
 
     # Define UHI color mapping
-    color_dict = ee.Dictionary({
-        'Low UHI': 'blue',
-        'Low-Moderate UHI': 'lightblue',
-        'Moderate UHI': 'orange',
-        'Moderate-High UHI': 'red',
-        'High UHI': 'yellow'
-    })
+    color_dict = ee.Dictionary(UHI_COLORS)
 
     def uhi_style(feature):
         label = feature.get('UHI_Label')
@@ -221,18 +216,18 @@ def get_uhi():
     styled_fc = fc.map(uhi_style)
     Map.addLayer(styled_fc.style(**{'styleProperty': 'style'}), {}, 'UHI Labels')
 
-    Map.to_streamlit(height=600)
+    show_map(Map)
 
 
 # ---------------------------- UI ----------------------------
 
-st.set_page_config(layout="wide")
-st.title("Urban Heat Island (UHI) Visualiser")
-
 layer_option = st.sidebar.selectbox(
     "Choose a layer to visualize",
     (
         "Final UHI",
+        "Hotspots (Gi*)",
+        "Cluster stability",
+        "Cell history",
         "NDVI (Vegetation Index)",
         "Rainfall (Precipitation)",
         "Impervious Surface Area (ISA)",
@@ -242,45 +237,25 @@ layer_option = st.sidebar.selectbox(
     )
 )
 
-Map = geemap.Map(center=[19.2, 73.2], zoom=9)
-
+record_first_paint(_script_started, "app1")
 
 if layer_option == "Final UHI":
     get_uhi()
+elif layer_option == "Hotspots (Gi*)":
+    show_hotspots("Final_Merged_Dataset_with_UHI_Labels.csv", region_name, region['center'], zoom)
+elif layer_option == "Cluster stability":
+    show_stability(region_name, region['center'], zoom)
+elif layer_option == "Cell history":
+    show_history(region_name, region['center'], zoom)
 elif layer_option == "Impervious Surface Area (ISA)":
-    image, vis_params, label = get_isa()
-    Map.addLayer(image, vis_params, label)
-    Map.addLayer(grid_fc.style(color='black', fillColor='00000000', width=1), {}, '5x5 km Grid Boxes')
-    Map.to_streamlit(height=600)
+    layers.show_layer('isa', get_isa)
 elif layer_option == "NDVI (Vegetation Index)":
-    image, vis_params, label = get_ndvi()
-    Map.addLayer(image, vis_params, label)
-    Map.addLayer(grid_fc.style(color='black', fillColor='00000000', width=1), {}, '5x5 km Grid Boxes')
-    Map.to_streamlit(height=600)
+    layers.show_layer('ndvi', get_ndvi)
 elif layer_option == "Rainfall (Precipitation)":
-    image, vis_params, label = get_rainfall()
-    Map.addLayer(image, vis_params, label)
-    Map.addLayer(grid_fc.style(color='black', fillColor='00000000', width=1), {}, '5x5 km Grid Boxes')
-    Map.to_streamlit(height=600)
+    layers.show_layer('rainfall', get_rainfall)
 elif layer_option == "Wind Speed":
-    image, vis_params, label = get_wind()
-    Map.addLayer(image, vis_params, label)
-    Map.addLayer(grid_fc.style(color='black', fillColor='00000000', width=1), {}, '5x5 km Grid Boxes')
-    Map.to_streamlit(height=600)
+    layers.show_layer('wind', get_wind)
 elif layer_option == "Relative Humidity":
-    image, vis_params, label = get_humidity()
-    Map.addLayer(image, vis_params, label)
-    Map.addLayer(grid_fc.style(color='black', fillColor='00000000', width=1), {}, '5x5 km Grid Boxes')
-    Map.to_streamlit(height=600)
+    layers.show_layer('humidity', get_humidity)
 elif layer_option == "Land Surface Temperature (LST)":
-    image, vis_params, label = get_lst()
-    Map.addLayer(image, vis_params, label)
-    Map.addLayer(grid_fc.style(color='black', fillColor='00000000', width=1), {}, '5x5 km Grid Boxes')
-    Map.to_streamlit(height=600)
-    
-
-# Always show grid overlay
-
-
-Map.addLayerControl()
-
+    layers.show_layer('lst', get_lst)
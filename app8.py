@@ -1,74 +1,104 @@
+import time
+_script_started = time.perf_counter()
+
+import calendar
 import streamlit as st
-import ee
-import geemap.foliumap as geemap
-import pandas as pd
 import numpy as np
-import folium
-
-
-
-# Initialize Earth Engine
-ee.Initialize(project='heat-islands')
-
-# --- Define grid parameters and fix bounding box ---
-lat_min, lon_min = 18.847, 72.744
-lat_step = 5 / 111
-lon_step = 5 / 102
+from regions import get_region, region_names
+from pyramid import available_levels, level_for_zoom, read_latest
+from composites import SEASONS, available_years
+from shared_data import apply_overlay, set_edit
+from app_support import (UHI_COLORS, LayerView, earth_engine, ee_region, ee_map, folium_map, history_store, latest_rows,
+                         record_first_paint, show_history, show_hotspots, show_map, show_stability)
+from cell_raster import add_cells, render_mode
+from map_tiles import sampled_days
 
-lat_values = np.arange(lat_min, 19.797, lat_step)
-lon_values = np.arange(lon_min, 73.712, lon_step)
 
-lat_max = lat_values[-1] + lat_step
-lon_max = lon_values[-1] + lon_step
 
-bbox = ee.Geometry.BBox(lon_min, lat_min, lon_max, lat_max)
-roi = ee.Geometry.Rectangle([lon_min, lat_min, lon_max, lat_max])
+# Earth Engine is initialised on first use by an EE-backed layer (app_support.earth_engine)
 
-# Grid generation
-features = []
-for lat in lat_values:
-    for lon in lon_values:
-        box = ee.Geometry.Rectangle([lon, lat, lon + lon_step, lat + lat_step])
-        feature = ee.Feature(box, {
-            'lat_center': lat + lat_step / 2,
-            'lon_center': lon + lon_step / 2
-        })
-        features.append(feature)
+st.set_page_config(layout="wide")
+st.title("Urban Heat Island (UHI) Visualiser")
 
-grid_fc = ee.FeatureCollection(features)
+# --- Region selection: grid parameters and bounding box from regions.json ---
+region_name = st.sidebar.selectbox("Region", region_names())
+region = get_region(region_name)
+zoom = st.sidebar.slider("Map zoom (sets grid resolution)", 6, 13, region['zoom'])
+
+@st.cache_resource
+def pyramid_latest(name, level_km):
+    return read_latest(name, level_km)
+
+
+def latest_region_rows(path):
+    """
+    Rows of the latest date for the selected region (all cells, whatever the grid size),
+    read-only and shared across sessions.
+    Below the base resolution's zoom, the matching coarser pyramid level is used instead.
+    """
+    level_km = level_for_zoom(zoom, available_levels(region_name))
+    if level_km != region['cell_km']:
+        return pyramid_latest(region_name, level_km)
+    return latest_rows(path, region_name)
+
+# Period: composites come from the precomputed store (composites.py), live EE otherwise
+years = available_years(region_name) or [2024]
+year = st.sidebar.selectbox("Year", years, index=len(years) - 1)
+period = st.sidebar.radio("Period", ("Annual", "Season", "Month"), horizontal=True)
+if period == "Season":
+    months = SEASONS[st.sidebar.selectbox("Season", list(SEASONS))]
+elif period == "Month":
+    months = [st.sidebar.selectbox("Month", range(1, 13), format_func=lambda m: calendar.month_name[m])]
+else:
+    months = list(range(1, 13))
+start_date = f'{year}-{months[0]:02d}-01'
+end_date = f'{year + months[-1] // 12}-{months[-1] % 12 + 1:02d}-01'
+# Slow ERA5 layers show a quick preview first, then the exact composite (map_tiles.py)
+progressive = st.sidebar.checkbox("Progressive EE layers (preview first)", value=True)
 
-# Year and date
-year = 2024
-start_date = f'{year}-01-01'
-end_date = f'{year}-12-31'
 
 # ------------------------- Layer Functions ----------------------------
 
-def get_lst():
-    dataset = ee.ImageCollection('ECMWF/ERA5_LAND/DAILY_AGGR') \
-        .filterDate(start_date, end_date).select('temperature_2m')
-    lst_celsius = dataset.mean().subtract(273.15).clip(bbox)
-    vis_params = {'min': -10, 'max': 50, 'palette': ['000080', '4000ff', '00ffff', '80ff00', 'ffff00', 'ff4f00', 'ff00ff']}
-    return lst_celsius, vis_params, 'LST (°C)'
+LAYER_STYLES = {
+    'lst': ({'min': -10, 'max': 50, 'palette': ['000080', '4000ff', '00ffff', '80ff00', 'ffff00', 'ff4f00', 'ff00ff']},
+            'LST (°C)'),
+    'ndvi': ({'min': 0, 'max': 1, 'palette': ['white', 'green']}, 'NDVI'),
+    'rainfall': ({'min': 0, 'max': 2000, 'palette': ['lightblue', 'blue', 'darkblue', 'purple']}, 'Rainfall (mm)'),
+    'humidity': ({'min': 0, 'max': 100, 'palette': ['white', 'lightcyan', 'lightskyblue', 'deepskyblue', 'cornflowerblue',
+                                                    'dodgerblue', 'blue', 'mediumblue', 'darkblue', 'indigo', 'purple',
+                                                    'darkviolet', 'blueviolet']}, 'Relative Humidity (%)'),
+    'isa': ({'min': 0, 'max': 1, 'palette': ['red']}, 'ISA (Built-up Area)'),
+    'wind': ({'min': 0, 'max': 15, 'palette': ['white', 'skyblue', 'blue', 'navy']}, 'Wind Speed (m/s)'),
+}
+
+def era5_days(bands, every=1):
+    """ERA5-Land daily images of the selected period; only every ``every``-th day for previews."""
+    ee = earth_engine()
+    dataset = ee.ImageCollection('ECMWF/ERA5_LAND/DAILY_AGGR').filterDate(start_date, end_date)
+    if every > 1:
+        dataset = dataset.filter(ee.Filter.inList('system:index', sampled_days(start_date, end_date, every)))
+    return dataset.select(bands)
+
+def get_lst(every=1):
+    bbox, _ = ee_region(region_name)
+    dataset = era5_days('temperature_2m', every)
+    return dataset.mean().subtract(273.15).clip(bbox)
 
 def get_ndvi():
-    dataset = ee.ImageCollection("MODIS/061/MOD13Q1") \
+    ee, (bbox, _) = earth_engine(), ee_region(region_name)
+    return ee.ImageCollection("MODIS/061/MOD13Q1") \
         .filterDate(start_date, end_date).select('NDVI') \
         .map(lambda img: img.divide(10000)).mean().clip(bbox)
-    vis_params = {'min': 0, 'max': 1, 'palette': ['white', 'green']}
-    return dataset, vis_params, 'NDVI'
 
-def get_rainfall():
-    dataset = ee.ImageCollection('ECMWF/ERA5_LAND/DAILY_AGGR') \
-        .filterDate(start_date, end_date).select('total_precipitation_sum')
-    rainfall_mm = dataset.sum().multiply(1000).clip(bbox)
-    vis_params = {'min': 0, 'max': 2000, 'palette': ['lightblue', 'blue', 'darkblue', 'purple']}
-    return rainfall_mm, vis_params, 'Rainfall (mm)'
+def get_rainfall(every=1):
+    bbox, _ = ee_region(region_name)
+    dataset = era5_days('total_precipitation_sum', every)
+    # A sampled sum stands for ``every`` days each
+    return dataset.sum().multiply(1000 * every).clip(bbox)
 
-def get_humidity():
-    dataset = ee.ImageCollection('ECMWF/ERA5_LAND/DAILY_AGGR') \
-        .filterDate(start_date, end_date) \
-        .select(['temperature_2m', 'dewpoint_temperature_2m'])
+def get_humidity(every=1):
+    bbox, _ = ee_region(region_name)
+    dataset = era5_days(['temperature_2m', 'dewpoint_temperature_2m'], every)
 
     def compute_rh(image):
         temp = image.select('temperature_2m').subtract(273.15)
@@ -78,22 +108,16 @@ def get_humidity():
         rh = ed.divide(es).multiply(100).rename('relative_humidity')
         return rh.set('system:time_start', image.get('system:time_start'))
 
-    humidity = dataset.map(compute_rh).mean().clip(bbox)
-    vis_params = {'min': 0, 'max': 100, 'palette': ['white', 'lightcyan', 'lightskyblue', 'deepskyblue', 'cornflowerblue',
-                                                    'dodgerblue', 'blue', 'mediumblue', 'darkblue', 'indigo', 'purple',
-                                                    'darkviolet', 'blueviolet']}
-    return humidity, vis_params, 'Relative Humidity (%)'
+    return dataset.map(compute_rh).mean().clip(bbox)
 
 def get_isa():
+    ee, (bbox, _) = earth_engine(), ee_region(region_name)
     isa_img = ee.ImageCollection('ESA/WorldCover/v100').first().clip(bbox)
-    isa_builtup = isa_img.eq(50).selfMask()
-    vis_params = {'min': 0, 'max': 1, 'palette': ['red']}
-    return isa_builtup, vis_params, 'ISA (Built-up Area)'
+    return isa_img.eq(50).selfMask()
 
-def get_wind():
-    dataset = ee.ImageCollection("ECMWF/ERA5_LAND/DAILY_AGGR") \
-        .filterDate(start_date, end_date) \
-        .select(["u_component_of_wind_10m", "v_component_of_wind_10m"])
+def get_wind(every=1):
+    bbox, _ = ee_region(region_name)
+    dataset = era5_days(["u_component_of_wind_10m", "v_component_of_wind_10m"], every)
 
     def add_speed_dir(image):
         u = image.select("u_component_of_wind_10m")
@@ -103,47 +127,35 @@ def get_wind():
         return image.addBands([speed, direction]).select(["wind_speed", "wind_direction"]) \
             .copyProperties(image, ["system:time_start"])
 
-    wind = dataset.map(add_speed_dir).select("wind_speed").mean().clip(bbox)
-    vis_params = {'min': 0, 'max': 15, 'palette': ['white', 'skyblue', 'blue', 'navy']}
-    return wind, vis_params, 'Wind Speed (m/s)'
+    return dataset.map(add_speed_dir).select("wind_speed").mean().clip(bbox)
+
+# Every EE-backed layer, prefetched together (LayerView.prefetch_layers)
+LAYER_FUNCTIONS = {'lst': get_lst, 'ndvi': get_ndvi, 'rainfall': get_rainfall, 'humidity': get_humidity,
+                   'isa': get_isa, 'wind': get_wind}
+# Annual aggregates of daily ERA5 images: drawn progressively (show_progressive)
+PREVIEW_LAYERS = ('lst', 'rainfall', 'humidity', 'wind')
+# Stored composite or EE layer for the selected region and period (app_support.LayerView)
+layers = LayerView(region_name, region['center'], zoom, year, months, (start_date, end_date), LAYER_STYLES,
+                   LAYER_FUNCTIONS, PREVIEW_LAYERS, progressive)
 
 # ------------------------- UHI Layer Functions ----------------------------
 
 # ------------------------- Static UHI Code Start ------------------------------
 def get_uhi():
-    # Load dataset
-    df = pd.read_csv("latest_data.csv")
-
-    # Define grid parameters and bounding box
-    lat_min, lon_min = 18.847, 72.744
-    lat_step = 5 / 111
-    lon_step = 5 / 102
-
-    lat_values = np.arange(lat_min, 19.797, lat_step)
-    lon_values = np.arange(lon_min, 73.712, lon_step)
-
-    # Grid generation
-    features = []
-    for lat in lat_values:
-        for lon in lon_values:
-            box = ee.Geometry.Rectangle([lon, lat, lon + lon_step, lat + lat_step])
-            feature = ee.Feature(box, {
-                'lat_center': lat + lat_step / 2,
-                'lon_center': lon + lon_step / 2
-            })
-            features.append(feature)
+    df_subset = latest_region_rows("latest_data.csv")[['Latitude', 'Longitude', 'Cluster', 'UHI_Label']]
+    if render_mode(len(df_subset)) == "image":
+        # Too many cells for one EE point feature each: one image overlay, no EE needed (cell_raster.py)
+        Map = folium_map(region_name, region['center'], zoom)
+        add_cells(Map, df_subset, 'UHI_Label', UHI_COLORS, 'UHI Labels')
+        show_map(Map)
+        return
 
-    grid_fc = ee.FeatureCollection(features)
+    ee = earth_engine()
 
-    # Create map
-    map_center=[19.2, 73.2]
-    Map = geemap.Map(center=map_center, zoom=9)
-
-    # Add grid to map
-    Map.addLayer(grid_fc.style(color='black', fillColor='00000000', width=1), {}, '5x5 km Grid Boxes')
+    # Create map with the grid boxes
+    Map = ee_map(region_name, region['center'], zoom)
 
     # Prepare UHI features
-    df_subset = df.tail(440)[['Latitude', 'Longitude', 'Cluster', 'UHI_Label']].copy()
     features_cluster = []
     for _, row in df_subset.iterrows():
         point = ee.Geometry.Point([row['Longitude'], row['Latitude']])
@@ -156,13 +168,7 @@ def get_uhi():
     fc = ee.FeatureCollection(features_cluster)
 
     # Define UHI color mapping
-    color_dict = ee.Dictionary({
-        'Low UHI': 'blue',
-        'Low-Moderate UHI': 'lightblue',
-        'Moderate UHI': 'orange',
-        'Moderate-High UHI': 'red',
-        'High UHI': 'yellow'
-    })
+    color_dict = ee.Dictionary(UHI_COLORS)
 
     def uhi_style(feature):
         label = feature.get('UHI_Label')
@@ -176,54 +182,44 @@ def get_uhi():
     styled_fc = fc.map(uhi_style)
     Map.addLayer(styled_fc.style(**{'styleProperty': 'style'}), {}, 'UHI Labels')
 
-    Map.to_streamlit(height=600)
+    show_map(Map)
 
 # ------------------------- Static UHI Code End ------------------------------
 
 # ----------------------- Dynamic UHI Code Start --------------------------------------------------
-import streamlit as st
-import pandas as pd
-import folium
-from folium import plugins
-import numpy as np
-
 def dynamic_uhi():
-    # Step 1: Load latest_data.csv into temp dataframe
-    temp = pd.read_csv("latest_data.csv")
-
-    # Step 2: Rename columns to standardized names
-    temp.rename(columns={
+    import folium
+
+    # Step 1: Shared, read-only rows of latest_data.csv (selected region only); this
+    # session's edits live in a small overlay in session_state
+    base = latest_region_rows("latest_data.csv")
+    level_km = level_for_zoom(zoom, available_levels(region_name))
+    overlay = st.session_state.setdefault('uhi_overlays', {}).setdefault((region_name, level_km), {})
+    if overlay and st.sidebar.button(f"Reset {len(overlay)} edited cell(s)"):
+        overlay.clear()
+
+    # Step 2: Rename columns to standardized names (a view, no copy)
+    base = base.rename(columns={
         'LST_Celsius': 'LST',
         'Relative_Humidity_%': 'Humidity',
         'WindSpeed': 'Wind',
         'Rainfall_mm': 'Rainfall',
         'impervious_percentage': 'ISA'
-    }, inplace=True)
-
-    # Convert ISA to fraction
-    temp['ISA'] = temp['ISA'] / 100.0
+    })
 
     # Step 3: Let user select a grid cell
-    grid_cell_index = st.sidebar.selectbox("Select Grid Cell Index", temp.index)
-    selected_row = temp.loc[grid_cell_index]
+    grid_cell_index = st.sidebar.selectbox("Select Grid Cell Index", base.index)
+    selected_row = apply_overlay(base.loc[[grid_cell_index]], overlay).loc[grid_cell_index]
 
-    # Step 4: Let user modify parameters
+    # Step 4: Let user modify parameters (ISA is shown as a fraction)
     new_lst = st.sidebar.slider("Modify LST (°C)", -10.0, 50.0, float(selected_row['LST']))
     new_ndvi = st.sidebar.slider("Modify NDVI", 0.0, 1.0, float(selected_row['NDVI']))
     new_rainfall = st.sidebar.slider("Modify Rainfall (mm)", 0.0, 2000.0, float(selected_row['Rainfall']))
     new_humidity = st.sidebar.slider("Modify Humidity (%)", 0.0, 100.0, float(selected_row['Humidity']))
     new_wind = st.sidebar.slider("Modify Wind Speed (m/s)", 0.0, 15.0, float(selected_row['Wind']))
-    new_isa = st.sidebar.slider("Modify ISA (fraction)", 0.0, 1.0, float(selected_row['ISA']))
-
-    # Step 5: Update temp dataframe only for selected cell
-    temp.loc[grid_cell_index, 'LST'] = new_lst
-    temp.loc[grid_cell_index, 'NDVI'] = new_ndvi
-    temp.loc[grid_cell_index, 'Rainfall'] = new_rainfall
-    temp.loc[grid_cell_index, 'Humidity'] = new_humidity
-    temp.loc[grid_cell_index, 'Wind'] = new_wind
-    temp.loc[grid_cell_index, 'ISA'] = new_isa
+    new_isa = st.sidebar.slider("Modify ISA (fraction)", 0.0, 1.0, float(selected_row['ISA']) / 100.0)
 
-    # Step 6: Recalculate UHI Label ONLY for the modified row
+    # Step 5: Recalculate UHI Label ONLY for the modified row
     if new_lst <= 30:
         new_label = 'Low UHI'
     elif 30 < new_lst <= 35:
@@ -237,50 +233,45 @@ def dynamic_uhi():
     else:
         new_label = 'Unknown'
 
-    temp.loc[grid_cell_index, 'UHI_Label'] = new_label
+    # Step 6: Record edits of the selected cell in the overlay
+    shared_row = base.loc[grid_cell_index]
+    for column, value in (('LST', new_lst), ('NDVI', new_ndvi), ('Rainfall', new_rainfall),
+                          ('Humidity', new_humidity), ('Wind', new_wind), ('ISA', new_isa * 100.0),
+                          ('UHI_Label', new_label)):
+        set_edit(overlay, grid_cell_index, column, value, shared_row[column])
 
-    # Color dictionary for UHI labels
-    color_dict = {
-        'Low UHI': 'blue',
-        'Low-Moderate UHI': 'lightblue',
-        'Moderate UHI': 'orange',
-        'Moderate-High UHI': 'red',
-        'High UHI': 'yellow'
-    }
+    # Displayed rows: shared rows plus this session's edits; only edited columns are copied
+    temp = apply_overlay(base, overlay)
+    temp = temp.assign(ISA=temp['ISA'] / 100.0)
 
     # Step 7: Map visualization
-    # Set up map centered on Mumbai or desired region
-    mumbai_lat, mumbai_lon = 19.0760, 72.8777  # Approximate center of Mumbai
-    map_obj = folium.Map(location=[mumbai_lat, mumbai_lon], zoom_start=9)
-
-    # Add grid cells as markers on the map
-    for _, row in temp.iterrows():
-        # Assuming each row has 'Latitude' and 'Longitude' columns for grid cell location
-        lat = row['Latitude']
-        lon = row['Longitude']
-        
-        # Get the color based on the UHI label
-        uhi_label = row['UHI_Label']
-        color = color_dict.get(uhi_label, 'gray')  # Default to gray if unknown label
-
-        # Add a marker for the grid cell
-        folium.CircleMarker(
-            location=[lat, lon],
-            radius=5,
-            color=color,
-            fill=True,
-            fill_opacity=0.6,
-            popup=f"Grid Cell {row.name}: {uhi_label}",
-        ).add_to(map_obj)
+    # Set up map centered on the selected region
+    map_obj = folium.Map(location=region['center'], zoom_start=zoom)
+
+    # Add grid cells as markers on the map, or as one image on large grids (cell_raster.py)
+    mode = add_cells(map_obj, temp, 'UHI_Label', UHI_COLORS, 'UHI Labels')
 
     # Display the map in Streamlit
     st.write("Map showing UHI Labels for Grid Cells:")
     st.components.v1.html(map_obj._repr_html_(), height=600)
+    if mode == "image":
+        st.caption(f"{len(temp)} cells drawn as one image; select a cell in the sidebar to inspect it.")
 
     # Optionally, display the modified dataframe in a table
     st.write("Updated DataFrame with Modified UHI Label:")
     st.dataframe(temp)
 
+    # History of the selected cell from the history store (base grid only)
+    store = history_store()
+    if store is not None and 'system:index' in base.columns:
+        from regions import cell_id_from_index
+
+        cell_id = int(cell_id_from_index([shared_row['system:index']])[0])
+        with st.expander(f"History of cell {cell_id}"):
+            history = store.cell_history(cell_id, columns=('LST_Celsius', 'NDVI'))
+            st.line_chart(history.set_index('Date'))
+            st.caption("Compare it with other cells under Choose Layer > Cell History.")
+
 # ----------------------- Dynamic UHI Code End --------------------------------------------------
 
 def compute_uhi(df):
@@ -291,6 +282,13 @@ def compute_uhi(df):
     return df
 
 def display_uhi(df, map_title='UHI Labels'):
+    if render_mode(len(df)) == "image":
+        Map = folium_map(region_name, region['center'], zoom)
+        add_cells(Map, df, 'UHI_Label', UHI_COLORS, map_title)
+        show_map(Map)
+        return
+
+    ee = earth_engine()
     features_cluster = []
     for _, row in df.iterrows():
         point = ee.Geometry.Point([row['Longitude'], row['Latitude']])
@@ -298,9 +296,7 @@ def display_uhi(df, map_title='UHI Labels'):
         features_cluster.append(ee.Feature(point, props))
 
     fc = ee.FeatureCollection(features_cluster)
-    color_dict = ee.Dictionary({
-        'Low UHI': 'blue', 'Moderate UHI': 'orange', 'High UHI': 'yellow'
-    })
+    color_dict = ee.Dictionary(UHI_COLORS)
 
     def uhi_style(feature):
         label = feature.get('UHI_Label')
@@ -309,36 +305,40 @@ def display_uhi(df, map_title='UHI Labels'):
 
     styled_fc = fc.map(uhi_style)
 
-    Map = geemap.Map(center=[19.2, 73.2], zoom=9)
+    Map = ee_map(region_name, region['center'], zoom)
     Map.addLayer(styled_fc.style(**{'styleProperty': 'style'}), {}, map_title)
-    Map.addLayer(grid_fc.style(color='black', fillColor='00000000', width=1), {}, '5x5 km Grid Boxes')
-    Map.to_streamlit(height=600)
+    show_map(Map)
 
 # ---------------------------- Streamlit UI ----------------------------
 
-st.set_page_config(layout="wide")
-st.title("Urban Heat Island (UHI) Visualiser")
-
 option = st.sidebar.selectbox("Choose Layer", 
-    ["LST", "NDVI", "Rainfall", "Humidity", "ISA", "Wind Speed", "Static UHI", "Dynamic UHI"])
+    ["LST", "NDVI", "Rainfall", "Humidity", "ISA", "Wind Speed", "Static UHI", "Dynamic UHI", "Hotspots", "Stability",
+     "Cell History"])
+
+record_first_paint(_script_started, "app8")
 
 if option in ["LST", "NDVI", "Rainfall", "Humidity", "ISA", "Wind Speed"]:
     layer_functions = {
-        "LST": get_lst,
-        "NDVI": get_ndvi,
-        "Rainfall": get_rainfall,
-        "Humidity": get_humidity,
-        "ISA": get_isa,
-        "Wind Speed": get_wind
+        "LST": ('lst', get_lst),
+        "NDVI": ('ndvi', get_ndvi),
+        "Rainfall": ('rainfall', get_rainfall),
+        "Humidity": ('humidity', get_humidity),
+        "ISA": ('isa', get_isa),
+        "Wind Speed": ('wind', get_wind)
     }
-    image, vis_params, layer_name = layer_functions[option]()
-    Map = geemap.Map(center=[19.2, 73.2], zoom=9)
-    Map.addLayer(image, vis_params, layer_name)
-    Map.addLayer(grid_fc.style(color='black', fillColor='00000000', width=1), {}, '5x5 km Grid Boxes')
-    Map.to_streamlit(height=600)
+    layers.show_layer(*layer_functions[option])
 
 elif option == "Static UHI":
     get_uhi()
 
 elif option == "Dynamic UHI":
-    dynamic_uhi()
\ No newline at end of file
+    dynamic_uhi()
+
+elif option == "Hotspots":
+    show_hotspots("latest_data.csv", region_name, region['center'], zoom)
+
+elif option == "Stability":
+    show_stability(region_name, region['center'], zoom)
+
+elif option == "Cell History":
+    show_history(region_name, region['center'], zoom)
@@ -0,0 +1,541 @@
+"""
+Startup helpers shared by the Streamlit apps.
+
+The apps draw their controls before importing any geospatial module.
+``earth_engine()`` imports and initialises Earth Engine only when a layer
+actually needs it, and ``st.cache_resource`` keeps the initialised module and
+the per-region EE grid across reruns and sessions. Layers that need no EE
+(stored composites, Dynamic UHI) are drawn on a plain folium map with the
+grid as GeoJSON.
+
+``shared_table`` and ``latest_rows`` load the app datasets once per process
+into read-only columnar frames (shared_data.py) that every session reads;
+sessions keep their own edits as small overlays. The 16-day NDVI is attached
+while loading (cadence.py), so the version key covers both files.
+
+``stability_results`` and ``add_cell_shares`` draw the per-cell label
+confidence and co-assignment shares written by stability.py.
+
+``map_tiles`` holds the EE tile URLs of the process (map_tiles.py): once a
+selected layer has started Earth Engine (``ee_started``), the apps prefetch
+every other layer's ``getMapId`` in a thread pool, and identical requests
+from concurrent sessions share one call. Views without EE never prefetch.
+``LayerView`` draws an app's layers for the selected period: the stored
+composite when there is one, the EE layer otherwise.
+``show_progressive`` draws a sampled, coarse preview of a slow layer first and
+swaps in the exact layer once EE has rendered it, reporting both times.
+
+``history_store`` opens the SQLite store of every labelled cell-day
+(history_store.py) once per process for per-cell histories and comparisons.
+
+Cell layers switch from one map feature per cell to a single image overlay
+on large grids (cell_raster.py); ``folium_map`` then leaves out the grid
+lines as well.
+
+Views shared by both apps take the region, map centre and zoom (and the
+dataset path where the apps differ): ``show_hotspots``, ``show_stability``,
+``show_history``.
+
+``record_first_paint`` logs the time from script start to the first drawn
+controls so cold starts and reruns can be compared.
+"""
+import os
+import threading
+import time
+
+import streamlit as st
+
+from cadence import layers_version, read_dataset
+from cell_raster import render_mode
+from composites import LAYERS, composite_overlay, load_composite
+from hotspots import hotspot_geojson, region_hotspots
+from land_mask import active_cells, keep_active
+from regions import get_region, grid_cells, region_axes, region_grid
+from shared_data import dataset_version, frozen, load_table, table_nbytes
+
+GRID_STYLE = {'color': 'black', 'fillColor': '00000000', 'width': 1}
+GRID_LABEL = '5x5 km Grid Boxes'
+# Gi* confidence bins -3..3 (cold to hot spots)
+HOTSPOT_COLORS = {-3: '#4575b4', -2: '#91bfdb', -1: '#e0f3f8', 1: '#fee090', 2: '#fc8d59', 3: '#d73027'}
+UHI_COLORS = {'Low UHI': 'blue', 'Low-Moderate UHI': 'lightblue', 'Moderate UHI': 'orange',
+              'Moderate-High UHI': 'red', 'High UHI': 'yellow'}
+# Variables of the history charts: label -> dataset column
+HISTORY_COLUMNS = {'LST (°C)': 'LST_Celsius', 'NDVI': 'NDVI', 'Air temperature (°C)': 'Air_Temperature_C',
+                   'Relative humidity (%)': 'Relative_Humidity_%', 'Wind speed (m/s)': 'WindSpeed',
+                   'Rainfall (mm)': 'Rainfall_mm'}
+# Shares of runs (stability confidence, co-assignment) in fifths, from 0-20 % (red) to 80-100 % (green)
+SHARE_COLORS = ['#d73027', '#fc8d59', '#fee08b', '#91cf60', '#1a9850']
+
+# Set once earth_engine() has initialised EE in this process
+_ee_ready = threading.Event()
+
+
+@st.cache_resource(show_spinner="Connecting to Earth Engine...")
+def earth_engine(project='heat-islands'):
+    """The ``ee`` module, imported and initialised once per server process."""
+    started = time.perf_counter()
+    import ee
+
+    try:
+        ee.Initialize(project=project)
+    except Exception:
+        ee.Authenticate()
+        ee.Initialize(project=project)
+    print(f"Earth Engine ready in {time.perf_counter() - started:.2f} s")
+    _ee_ready.set()
+    return ee
+
+
+def ee_started():
+    """Whether Earth Engine is already initialised, i.e. background EE requests cannot block on it."""
+    return _ee_ready.is_set()
+
+
+@st.cache_data
+def region_cells(region_name):
+    """Active (land) cells of a region: the grid boxes the apps draw (see land_mask.py)."""
+    region = get_region(region_name)
+    return active_cells(grid_cells(region_grid(region), region_name, region['id']))
+
+
+@st.cache_resource
+def ee_region(region_name):
+    """EE bounding box and grid-box FeatureCollection of a region's active cells, built once."""
+    ee = earth_engine()
+    region = get_region(region_name)
+    lat_step, lon_step = region['lat_step'], region['lon_step']
+    _, _, (lat_min, lon_min, lat_max, lon_max) = region_axes(region)
+    bbox = ee.Geometry.BBox(lon_min, lat_min, lon_max, lat_max)
+    features = [
+        ee.Feature(ee.Geometry.Rectangle([lon - lon_step / 2, lat - lat_step / 2, lon + lon_step / 2, lat + lat_step / 2]),
+                   {'lat_center': lat, 'lon_center': lon})
+        for lat, lon in region_cells(region_name)[['Latitude', 'Longitude']].itertuples(index=False)
+    ]
+    return bbox, ee.FeatureCollection(features)
+
+
+@st.cache_data
+def grid_geojson(region_name):
+    """Active grid boxes of a region as GeoJSON, for maps drawn without EE."""
+    region = get_region(region_name)
+    lat_step, lon_step = region['lat_step'], region['lon_step']
+    features = []
+    for lat, lon in region_cells(region_name)[['Latitude', 'Longitude']].itertuples(index=False):
+        south, west = lat - lat_step / 2, lon - lon_step / 2
+        features.append({"type": "Feature", "properties": {}, "geometry": {"type": "Polygon", "coordinates": [[
+            [west, south], [west + lon_step, south], [west + lon_step, south + lat_step],
+            [west, south + lat_step], [west, south]]]}})
+    return {"type": "FeatureCollection", "features": features}
+
+
+@st.cache_resource
+def map_tiles():
+    """EE tile URLs shared by every session of the server process (map_tiles.py)."""
+    from map_tiles import MapTiles
+
+    return MapTiles()
+
+
+def grid_request(region_name):
+    """Tile request of the region's EE grid, for ``map_tiles().prefetch`` / ``url``."""
+    return map_tiles().key(region_name, 'grid'), (lambda: ee_region(region_name)[1].style(**GRID_STYLE), {})
+
+
+def add_tiles(Map, url, name):
+    """Add an XYZ tile layer (e.g. an EE layer from ``map_tiles``) to a folium or geemap map."""
+    import folium
+
+    folium.TileLayer(tiles=url, attr='Google Earth Engine', name=name, overlay=True, control=True).add_to(Map)
+    return Map
+
+
+def ee_map(region_name, center, zoom):
+    """geemap map with the region's EE grid; starts Earth Engine on first use."""
+    earth_engine()
+    import geemap.foliumap as geemap
+
+    Map = geemap.Map(center=center, zoom=zoom)
+    key, (build_grid, vis_params) = grid_request(region_name)
+    add_tiles(Map, map_tiles().url(key, build_grid, vis_params), GRID_LABEL)
+    return Map
+
+
+def show_progressive(region_name, center, zoom, label, preview, exact):
+    """
+    Draw an EE layer progressively: the preview's tiles first, replaced by the exact layer's
+    once EE has rendered its tile at the map centre (``MapTiles.render``).
+
+    :param preview: (key, (build_image, vis_params)) tile request of the preview
+    :param exact: Same for the exact layer
+    :return: Seconds to the first image (None when the exact layer was ready at once) and to the exact layer
+    """
+    tiles, at = map_tiles(), (*center, zoom)
+    started = time.perf_counter()
+    key, (build_image, vis_params) = exact
+    final = tiles.render(key, build_image, vis_params, at)
+    slot, note = st.empty(), st.empty()
+    first_image = None
+    if not final.done():
+        key, (build_image, vis_params) = preview
+        url = tiles.render(key, build_image, vis_params, at).result()
+        first_image = time.perf_counter() - started
+        with slot.container():
+            show_map(add_tiles(ee_map(region_name, center, zoom), url, f"{label} (preview)"))
+        note.caption(f"Preview from sampled days at coarse scale: first image in {first_image:.1f} s; "
+                     f"computing the exact composite...")
+    url = final.result()
+    total = time.perf_counter() - started
+    with slot.container():
+        show_map(add_tiles(ee_map(region_name, center, zoom), url, label))
+    if first_image is None:
+        note.caption(f"Exact composite in {total:.1f} s")
+    else:
+        note.caption(f"Preview: first image in {first_image:.1f} s; exact composite in {total:.1f} s")
+    print(f"{label}: preview {'-' if first_image is None else f'{first_image:.2f} s'}, exact {total:.2f} s")
+    return first_image, total
+
+
+def folium_map(region_name, center, zoom):
+    """Plain folium map with the region's grid (left out on grids drawn as an image); no Earth Engine involved."""
+    import folium
+
+    Map = folium.Map(location=center, zoom_start=zoom)
+    if render_mode(len(region_cells(region_name))) == "image":
+        return Map
+    folium.GeoJson(grid_geojson(region_name), name=GRID_LABEL,
+                   style_function=lambda _: {'color': 'black', 'weight': 1, 'fillOpacity': 0}).add_to(Map)
+    return Map
+
+
+def show_map(Map, height=600):
+    if hasattr(Map, 'to_streamlit'):
+        Map.to_streamlit(height=height)
+    else:
+        st.components.v1.html(Map._repr_html_(), height=height)
+
+
+@st.cache_data
+def stored_composite(name, layer, year, months):
+    return load_composite(name, layer, year, list(months))
+
+
+class LayerView:
+    """
+    The EE-backed layers of an app for the selected region and period. Stored composites
+    (composites.py) are drawn on a plain folium map; only layers missing from the store
+    start Earth Engine, and their tiles come from ``map_tiles``.
+
+    :param period: (start date, end date) of the selected months, as used by the layer functions
+    :param styles: {layer: (vis_params, legend label)}
+    :param functions: {layer: get_layer} of every EE-backed layer, prefetched together
+    :param preview_layers: Layers drawn progressively (preview first) when ``progressive`` is set;
+        their ``get_layer`` takes ``every``
+    """
+
+    def __init__(self, region_name, center, zoom, year, months, period, styles, functions, preview_layers=(),
+                 progressive=False):
+        self.region_name, self.center, self.zoom = region_name, center, zoom
+        self.year, self.months, self.period = year, tuple(months), period
+        self.styles, self.functions = styles, functions
+        self.preview_layers, self.progressive = preview_layers, progressive
+
+    def composite(self, layer):
+        return stored_composite(self.region_name, layer, self.year, self.months)
+
+    def layer_style(self, layer):
+        """Visualisation parameters and label of a layer for the selected period."""
+        vis_params, label = self.styles[layer]
+        if LAYERS[layer]['reducer'] == 'sum':
+            # Colour scale is for annual totals
+            vis_params = dict(vis_params, max=vis_params['max'] * len(self.months) / 12)
+        return vis_params, label
+
+    def layer_request(self, layer, get_layer, preview=False):
+        """
+        Tile request of an EE layer for the selected region and period (map_tiles.py).
+
+        :param preview: Request the sampled, coarse preview of the layer instead
+        """
+        from map_tiles import preview_image
+
+        vis_params, _ = self.layer_style(layer)
+        if preview:
+            return (map_tiles().key(self.region_name, layer, 'preview', *self.period, vis_params=vis_params),
+                    (lambda: preview_image(get_layer), vis_params))
+        return map_tiles().key(self.region_name, layer, *self.period, vis_params=vis_params), (get_layer, vis_params)
+
+    def prefetch_layers(self):
+        """
+        Start the tile requests of every layer missing from the composite store, and of the
+        EE grid, in the background; switching to any of them afterwards needs no EE round trip.
+        Only once a selected layer has started Earth Engine, so no other view waits for it.
+        """
+        if not ee_started():
+            return
+        missing = {layer: get_layer for layer, get_layer in self.functions.items() if self.composite(layer) is None}
+        if missing:
+            map_tiles().prefetch(dict([grid_request(self.region_name)] +
+                                      [self.layer_request(layer, get_layer) for layer, get_layer in missing.items()]))
+
+    def show_layer(self, layer, get_layer):
+        """
+        Draw a layer for the selected period: the stored composite if there is one, the EE
+        layer otherwise, progressively (preview first) for ``preview_layers`` when enabled.
+        """
+        vis_params, label = self.layer_style(layer)
+        composite = self.composite(layer)
+        if composite is None and self.progressive and layer in self.preview_layers:
+            show_progressive(self.region_name, self.center, self.zoom, label,
+                             self.layer_request(layer, get_layer, preview=True), self.layer_request(layer, get_layer))
+        elif composite is None:
+            Map = ee_map(self.region_name, self.center, self.zoom)
+            key, (build_image, vis_params) = self.layer_request(layer, get_layer)
+            # Usually prefetched already (prefetch_layers); otherwise joins or starts the request
+            add_tiles(Map, map_tiles().url(key, build_image, vis_params), label)
+            show_map(Map)
+        else:
+            Map = folium_map(self.region_name, self.center, self.zoom)
+            composite_overlay(composite, vis_params, label).add_to(Map)
+            show_map(Map)
+        # With EE started by this or an earlier layer, the other layers' requests run in the background
+        self.prefetch_layers()
+
+
+@st.cache_resource(max_entries=4)
+def _shared_table(path, version):
+    started = time.perf_counter()
+    df = load_table(path, os.environ.get("UHI_SHARED_CACHE"), read_dataset, version)
+    print(f"Loaded shared {path} ({len(df)} rows, {table_nbytes(df) / 2 ** 20:.1f} MB) "
+          f"in {time.perf_counter() - started:.2f} s")
+    return df
+
+
+def shared_table(path):
+    """
+    Read-only frame of a dataset, loaded once per process and per file version.
+
+    Set ``UHI_SHARED_CACHE`` to a directory to memory-map the columns so that
+    several app processes share one copy.
+    """
+    return _shared_table(path, _version(path))
+
+
+def _version(path):
+    """Version of a dataset as the apps see it: the file and the coarse layers attached to it."""
+    return f"{dataset_version(path)}-{layers_version()}"
+
+
+@st.cache_resource(max_entries=32)
+def _latest_rows(path, version, region_name):
+    df = _shared_table(path, version)
+    latest = df[df['Date'] == df['Date'].max()]
+    if 'Region' in latest.columns:
+        latest = latest[latest['Region'] == region_name]
+    # Older datasets still hold the sea cells dropped by the land mask
+    return frozen(keep_active(latest))
+
+
+def latest_rows(path, region_name):
+    """Read-only rows of the latest date for one region, shared by all sessions."""
+    return _latest_rows(path, _version(path), region_name)
+
+
+@st.cache_resource(max_entries=8)
+def _hotspots(path, version, region_name, column, radius):
+    df = _shared_table(path, version)
+    if 'Region' in df.columns:
+        df = df[df['Region'] == region_name]
+    started = time.perf_counter()
+    table = region_hotspots(df, get_region(region_name), column, radius)
+    print(f"Gi* of {column} for {region_name}: {len(table)} cell-days in {time.perf_counter() - started:.2f} s")
+    return table
+
+
+def hotspot_table(path, region_name, column='LST_Celsius', radius=1):
+    """Gi* z-scores and bins of every day of a region, computed once per dataset version."""
+    return _hotspots(path, _version(path), region_name, column, radius)
+
+
+def show_hotspots(path, region_name, center, zoom):
+    """Getis-Ord Gi* hot and cold spots of the selected day (hotspots.py); no Earth Engine needed."""
+    column = st.sidebar.radio("Hotspots of", ("LST_Celsius", "UHI_Label"), horizontal=True,
+                              format_func=lambda c: "LST" if c == "LST_Celsius" else "UHI class")
+    radius = st.sidebar.slider("Neighbourhood radius (cells)", 1, 3, 1)
+    table = hotspot_table(path, region_name, column, radius)
+    dates = sorted(table['Date'].unique(), reverse=True)
+    day = st.sidebar.selectbox("Hotspot date", dates)
+    day_table = table[table['Date'] == day]
+
+    Map = folium_map(region_name, center, zoom)
+    add_hotspots(Map, day_table, region_name)
+    show_map(Map)
+    hot, cold = (day_table['Gi_Bin'] >= 2).sum(), (day_table['Gi_Bin'] <= -2).sum()
+    st.caption(f"{hot} hot and {cold} cold spot cells at 95 % confidence on {day} "
+               f"(red: hot, blue: cold; darker is more significant).")
+
+
+def add_hotspots(Map, day_table, region_name):
+    """Draw the significant hot and cold spots of one day on a folium map."""
+    import folium
+
+    folium.GeoJson(
+        hotspot_geojson(day_table, get_region(region_name)), name='Hotspots (Gi*)',
+        style_function=lambda f: {'color': HOTSPOT_COLORS[f['properties']['Gi_Bin']], 'weight': 0,
+                                  'fillColor': HOTSPOT_COLORS[f['properties']['Gi_Bin']], 'fillOpacity': 0.7},
+        tooltip=folium.GeoJsonTooltip(fields=['Gi_z', 'Gi_Bin']),
+    ).add_to(Map)
+    return Map
+
+
+@st.cache_resource(max_entries=2)
+def _stability(path, version, runs_path, runs_version):
+    import pandas as pd
+    from stability import load_runs
+
+    return pd.read_csv(path), load_runs(runs_path)
+
+
+def stability_results(path="UHI_Stability.csv", runs_path="UHI_Stability_Runs.npz"):
+    """
+    Per-cell stability table and (cell ids, run classes, run kinds) from stability.py,
+    or None when it has not been run yet.
+    """
+    if not (os.path.exists(path) and os.path.exists(runs_path)):
+        return None
+    return _stability(path, dataset_version(path), runs_path, dataset_version(runs_path))
+
+
+@st.cache_resource
+def _history_store(path):
+    from history_store import HistoryStore
+
+    return HistoryStore(path)
+
+
+def history_store(path="uhi_history.sqlite"):
+    """Per-cell history store (history_store.py) shared by all sessions, or None before it is built."""
+    if not os.path.exists(path):
+        return None
+    return _history_store(path)
+
+
+def add_cell_shares(Map, table, region_name, column, name):
+    """Draw the cells of ``table`` coloured by a 0-1 share column, with a tooltip."""
+    import folium
+    import pandas as pd
+
+    region = get_region(region_name)
+    lat_step, lon_step = region['lat_step'], region['lon_step']
+    labels = table['Consensus_Label'] if 'Consensus_Label' in table.columns else pd.Series('', index=table.index)
+    features = []
+    for lat, lon, cell_id, share, label in zip(table['Latitude'], table['Longitude'], table['cell_id'],
+                                               table[column], labels):
+        south, west = lat - lat_step / 2, lon - lon_step / 2
+        features.append({"type": "Feature",
+                         "properties": {'cell_id': int(cell_id), column: round(float(share), 3), 'label': label},
+                         "geometry": {"type": "Polygon", "coordinates": [[
+                             [west, south], [west + lon_step, south], [west + lon_step, south + lat_step],
+                             [west, south + lat_step], [west, south]]]}})
+
+    def style(feature):
+        share = feature['properties'][column]
+        color = SHARE_COLORS[min(int(share * len(SHARE_COLORS)), len(SHARE_COLORS) - 1)]
+        return {'color': color, 'weight': 0, 'fillColor': color, 'fillOpacity': 0.7}
+
+    folium.GeoJson({"type": "FeatureCollection", "features": features}, name=name, style_function=style,
+                   tooltip=folium.GeoJsonTooltip(fields=['cell_id', column, 'label'])).add_to(Map)
+    return Map
+
+
+def show_stability(region_name, center, zoom):
+    """Per-cell UHI label confidence and co-assignment over bootstrap / reseeded refits (stability.py)."""
+    results = stability_results()
+    if results is None:
+        st.warning("No stability results yet: run `python stability.py` after the pipeline.")
+        return
+    table, (cell_ids, classes, _) = results
+    if 'Region' in table.columns:
+        table = table[table['Region'] == region_name]
+    view = st.sidebar.radio("Stability view", ("Label confidence", "Co-assignment"), horizontal=True)
+
+    Map = folium_map(region_name, center, zoom)
+    if view == "Label confidence":
+        add_cell_shares(Map, table, region_name, 'Confidence', 'Label confidence')
+        show_map(Map)
+        st.caption(f"Share of {len(classes)} refits giving each cell its consensus class: mean "
+                   f"{table['Confidence'].mean():.0%}, {(table['Confidence'] >= 0.9).mean():.0%} of cells at 90 % or more "
+                   f"(green: stable, red: unstable).")
+    else:
+        import numpy as np
+        from stability import coassignment
+
+        cell = st.sidebar.selectbox("Cell", table['cell_id'])
+        shares = coassignment(classes, int(np.searchsorted(cell_ids, cell)))
+        table = table.assign(Coassignment=shares[np.searchsorted(cell_ids, table['cell_id'])])
+        add_cell_shares(Map, table, region_name, 'Coassignment', f'Co-assignment with cell {cell}')
+        show_map(Map)
+        st.caption(f"Share of {len(classes)} refits putting each cell in the same class as cell {cell} "
+                   f"(green: almost always together, red: rarely).")
+
+
+def show_history(region_name, center, zoom):
+    """Per-cell time series, cell comparisons and label frequencies from the history store (history_store.py)."""
+    from datetime import date
+
+    import pandas as pd
+    from clustering import UHI_CLASSES
+
+    store = history_store()
+    if store is None:
+        st.warning("No history store yet: run `python history_store.py` after the pipeline.")
+        return
+    first, last = store.dates()
+    if first is None:
+        st.warning("The history store is empty: run `python history_store.py` after the pipeline.")
+        return
+    grid = region_cells(region_name)
+    cells = grid['cell_id'].tolist()
+    view = st.sidebar.radio("History view", ("Cells over time", "Label frequency map"), horizontal=True)
+    period = st.sidebar.date_input("Period", (date.fromisoformat(first), date.fromisoformat(last)),
+                                   min_value=date.fromisoformat(first), max_value=date.fromisoformat(last))
+    start, end = (tuple(period) * 2)[:2] if isinstance(period, (tuple, list)) else (period, period)
+
+    if view == "Label frequency map":
+        label = st.sidebar.selectbox("UHI class", UHI_CLASSES)
+        shares = store.label_frequencies(region=region_name, start=start, end=end, share=True)
+        share = shares[label] if label in shares.columns else pd.Series(dtype=float)
+        table = grid.assign(Share=grid['cell_id'].map(share).fillna(0.0))
+        Map = folium_map(region_name, center, zoom)
+        add_cell_shares(Map, table, region_name, 'Share', f'Days in {label}')
+        show_map(Map)
+        st.caption(f"Share of the labelled days from {start} to {end} each cell spent in {label} "
+                   f"(green: most days, red: few).")
+        return
+
+    selected = st.sidebar.multiselect("Cells", cells, default=cells[:1], max_selections=8)
+    variable = st.sidebar.selectbox("Variable", list(HISTORY_COLUMNS))
+    if not selected:
+        st.info("Select one or more cells in the sidebar.")
+        return
+    series = store.compare_cells(selected, HISTORY_COLUMNS[variable], start, end)
+    series.columns = [f"cell {c}" for c in series.columns]
+    st.write(f"{variable} from {start} to {end}:")
+    st.line_chart(series)
+    frequencies = store.label_frequencies(selected, start=start, end=end, share=True)
+    frequencies = frequencies.reindex(columns=[c for c in UHI_CLASSES if c in frequencies.columns])
+    frequencies.index = [f"cell {c}" for c in frequencies.index]
+    st.write("Share of days in each UHI class:")
+    st.bar_chart(frequencies)
+    st.dataframe((frequencies * 100).round(1).rename(columns=lambda c: f"{c} (%)"))
+
+
+
+def record_first_paint(started, app_name):
+    """Log the time since ``started`` (script start) once the controls are drawn, and show it in the sidebar."""
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    runs = st.session_state.setdefault('first_paint_ms', [])
+    runs.append(elapsed_ms)
+    kind = "cold start" if len(runs) == 1 else f"rerun {len(runs) - 1}"
+    print(f"{app_name}: first paint {elapsed_ms:.0f} ms ({kind})")
+    st.sidebar.caption(f"First paint: {elapsed_ms:.0f} ms ({kind})")
+    return elapsed_ms
@@ -0,0 +1,218 @@
+"""
+Coarse-cadence layers kept at their native time step and aligned to daily rows on demand.
+
+MOD13Q1 NDVI is a 16-day composite. Instead of forward-filling it into every
+daily row (and every later CSV), it is stored once per composite in its own
+table (``NDVI_16day.csv``: cell_id, Date, NDVI) and attached to daily rows
+only when a consumer reads them (``attach`` / ``read_dataset``).
+
+Alignment is an index lookup, vectorised over all rows at once: composites
+are sorted by (cell, day) into one int64 key array and every daily row finds
+its composite with a single ``np.searchsorted``:
+
+- step (default): the latest composite on or before the day, or the cell's
+  first composite for days before it, which is what the old row-wise
+  ``merge_lst_ndvi`` did;
+- ``interpolate=True``: linear interpolation between the composites around
+  the day (step value at the ends or next to a missing -999 composite).
+
+Any other coarse layer works the same way: add its column and native table
+to ``COARSE_LAYERS``.
+
+Usage:
+    python cadence.py --check      # vectorised lookup equals the old row-wise merge, with timings
+"""
+import hashlib
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from regions import cell_id_from_index
+
+# Column -> native-cadence table (cell_id, Date, <column>) attached to daily rows on read
+COARSE_LAYERS = {"NDVI": "NDVI_16day.csv"}
+MISSING = -999
+
+
+def _cell_ids(df):
+    if 'system:index' in df.columns:
+        return cell_id_from_index(df['system:index'].astype(str))
+    return df['cell_id'].to_numpy(np.int64)
+
+
+def day_numbers(dates):
+    """Days since 1970-01-01 of 'YYYY-MM-DD' strings (or datetimes); parses each distinct date once."""
+    codes, uniques = pd.factorize(pd.Series(dates), sort=False)
+    days = pd.to_datetime(pd.Series(uniques), format='ISO8601').to_numpy().astype('datetime64[D]').astype(np.int64)
+    return days[codes]
+
+
+def native_table(df, column, dates=None):
+    """
+    One row per (cell, composite) of an export: cell_id, Date, ``column``, sorted by cell and date.
+
+    :param df: Export rows with ``system:index`` (``<image id>_<cell id>``) and ``column``
+    :param dates: Composite dates of the rows (default: the ``Date`` column)
+    """
+    table = pd.DataFrame({
+        'cell_id': _cell_ids(df),
+        'Date': pd.to_datetime(pd.Series(df['Date'] if dates is None else dates).to_numpy()).strftime('%Y-%m-%d'),
+        column: df[column].to_numpy(),
+    })
+    return table.drop_duplicates(['cell_id', 'Date'], keep='last').sort_values(['cell_id', 'Date'], ignore_index=True)
+
+
+class IntervalLookup:
+    """Sorted (cell, day) keys of a native table, for vectorised alignment of daily rows."""
+
+    def __init__(self, table, column):
+        days = day_numbers(table['Date'])
+        self.offset = int(days.min()) if len(days) else 0
+        self.span = int(days.max()) - self.offset + 2 if len(days) else 1  # keys of one cell never overlap the next
+        cells = table['cell_id'].to_numpy(np.int64)
+        self.keys = cells * self.span + (days - self.offset)
+        order = np.argsort(self.keys, kind='stable')
+        self.keys, self.cells, self.days = self.keys[order], cells[order], days[order]
+        self.values = table[column].to_numpy(np.float64)[order]
+
+    def align(self, cell_ids, days, interpolate=False):
+        """
+        Layer value of every (cell, day) row.
+
+        :param cell_ids: int64 cell ids of the daily rows
+        :param days: Day numbers of the rows (see ``day_numbers``)
+        :param interpolate: Interpolate linearly between composites instead of holding the latest one
+        :return: float64 array, NaN for cells without any composite
+        """
+        cell_ids = np.asarray(cell_ids, dtype=np.int64)
+        days = np.clip(np.asarray(days, dtype=np.int64) - self.offset, -1, self.span - 2)
+        out = np.full(len(cell_ids), np.nan)
+        if not len(self.keys):
+            return out
+        # Latest composite on or before the day; the cell's first one for earlier days
+        i = np.searchsorted(self.keys, cell_ids * self.span + days, side='right') - 1
+        before = (i < 0) | (self.cells[np.maximum(i, 0)] != cell_ids)
+        i[before] += 1
+        i = np.minimum(i, len(self.keys) - 1)
+        found = self.cells[i] == cell_ids
+        out[found] = self.values[i[found]]
+        if interpolate:
+            j = np.minimum(i + 1, len(self.keys) - 1)
+            lo, hi = self.values[i], self.values[j]
+            inner = (found & ~before & (self.cells[j] == cell_ids) & (j > i)
+                     & (lo != MISSING) & (hi != MISSING))
+            span = (self.days[j] - self.days[i]).astype(np.float64)
+            weight = np.divide(days + self.offset - self.days[i], span, out=np.zeros(len(span)), where=span > 0)
+            out[inner] = lo[inner] + weight[inner] * (hi[inner] - lo[inner])
+        return out
+
+
+_lookups = {}
+
+
+def layer_lookup(column, path=None):
+    """``IntervalLookup`` of a registered layer, loaded once per table version; None without a table."""
+    path = path or COARSE_LAYERS[column]
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    version = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if _lookups.get(column, (None,))[0] != version:
+        _lookups[column] = (version, IntervalLookup(pd.read_csv(path), column))
+    return _lookups[column][1]
+
+
+def layers_version(layers=None):
+    """Key that changes whenever a registered layer table is rewritten (for caches of attached frames)."""
+    parts = []
+    for column, path in (layers or COARSE_LAYERS).items():
+        if os.path.exists(path):
+            stat = os.stat(path)
+            parts.append(f"{column}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.md5(";".join(parts).encode()).hexdigest()[:12]
+
+
+def attach(df, columns=None, interpolate=False):
+    """
+    ``df`` with the coarse layers it lacks aligned to its (cell, Date) rows.
+
+    :param columns: Layer columns to attach (default: every registered layer with a table)
+    :return: New frame; ``df`` itself when nothing is missing
+    """
+    missing = [c for c in (columns or COARSE_LAYERS) if c not in df.columns and layer_lookup(c) is not None]
+    if not missing:
+        return df
+    cell_ids, days = _cell_ids(df), day_numbers(df['Date'])
+    return df.assign(**{c: layer_lookup(c).align(cell_ids, days, interpolate) for c in missing})
+
+
+def read_dataset(path, interpolate=False, **kwargs):
+    """``pd.read_csv(path, **kwargs)`` with the coarse layers attached."""
+    return attach(pd.read_csv(path, **kwargs), interpolate=interpolate)
+
+
+def _rowwise_reference(lst_df, ndvi_df):
+    """The old merge_lst_ndvi lookup, one row at a time (for ``check_alignment``)."""
+    lookup = {grid: df.sort_values('Date') for grid, df in ndvi_df.groupby('grid_number')}
+
+    def find_ndvi_value(row):
+        if row['grid_number'] not in lookup:
+            return None
+        df = lookup[row['grid_number']]
+        match = df[df['Date'] == row['Date']]
+        if not match.empty:
+            return match['NDVI'].values[0]
+        prev = df[df['Date'] < row['Date']]
+        if not prev.empty:
+            return prev.iloc[-1]['NDVI']
+        return df.iloc[0]['NDVI']
+
+    return lst_df.apply(find_ndvi_value, axis=1).astype(float).to_numpy()
+
+
+def check_alignment(lst_path="AREA_LST.csv", ndvi_path="AREA_NDVI.csv", sample=5000, seed=0):
+    """Self-test: the vectorised step lookup equals the old row-wise merge on a sample of rows."""
+    lst = pd.read_csv(lst_path)
+    ndvi = pd.read_csv(ndvi_path)
+    ndvi_dates = pd.to_datetime(ndvi['system:index'].str.rsplit('_', n=1).str[0], format='%Y_%m_%d')
+    table = native_table(ndvi, 'NDVI', ndvi_dates)
+
+    started = time.perf_counter()
+    lookup = IntervalLookup(table, 'NDVI')
+    cell_ids, days = _cell_ids(lst), day_numbers(lst['Date'])
+    step = lookup.align(cell_ids, days)
+    interpolated = lookup.align(cell_ids, days, interpolate=True)
+    vectorised = time.perf_counter() - started
+
+    rows = lst.sample(min(sample, len(lst)), random_state=seed)
+    reference_lst = pd.DataFrame({'Date': pd.to_datetime(rows['Date']),
+                                  'grid_number': cell_id_from_index(rows['system:index'].astype(str))})
+    reference_ndvi = pd.DataFrame({'Date': ndvi_dates, 'grid_number': _cell_ids(ndvi), 'NDVI': ndvi['NDVI']})
+    started = time.perf_counter()
+    expected = _rowwise_reference(reference_lst, reference_ndvi)
+    rowwise = (time.perf_counter() - started) / len(rows) * len(lst)
+
+    assert np.allclose(step[lst.index.get_indexer(rows.index)], expected, equal_nan=True)
+    # Interpolation passes through the composites themselves
+    on_composite = np.isin(cell_ids * lookup.span + days - lookup.offset, lookup.keys)
+    assert np.allclose(interpolated[on_composite], step[on_composite], equal_nan=True)
+    print(f"Alignment check passed on {len(rows)} rows. {len(lst)} daily rows from {len(table)} composites: "
+          f"vectorised {vectorised:.2f} s (step + interpolated), row-wise ~{rowwise:.0f} s (extrapolated)")
+    changed = np.nanmean(np.abs(interpolated - step) > 1e-9)
+    print(f"Interpolation changes {changed:.0%} of the daily values; daily rows would store "
+          f"{len(lst) / max(len(table), 1):.1f}x the native NDVI values")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Native-cadence coarse layers aligned to daily rows")
+    parser.add_argument("--check", action="store_true", help="Compare with the old row-wise NDVI merge")
+    parser.add_argument("--lst", default="AREA_LST.csv")
+    parser.add_argument("--ndvi", default="AREA_NDVI.csv")
+    args = parser.parse_args()
+
+    if args.check:
+        check_alignment(args.lst, args.ndvi)
@@ -0,0 +1,201 @@
+"""
+Grid cells drawn as one image overlay instead of one map feature per cell.
+
+The UHI maps drew one folium marker (Dynamic UHI) or one EE point feature
+(static UHI) per cell. That is fine for the 440 cells of the 5 km grids, but
+every marker adds about 1 KB of HTML and a DOM element. At the 10k-100k cells
+of finer grids or more cities the page grows to tens of MB and the browser
+stalls. ``add_cells`` picks the rendering by cell count:
+
+- up to ``FEATURE_CELL_LIMIT`` cells, one marker per cell with a popup, as before;
+- above it, ``cell_overlay`` rasterises the cells: one pixel per cell
+  (columns) and a few Web Mercator rows per cell, coloured by a category
+  column and sent as a single PNG ``ImageOverlay`` drawn with crisp
+  (pixelated) edges. The rows per cell are reduced until the image fits
+  ``HTML_BUDGET``.
+
+``render_mode`` lets other maps (e.g. the EE-drawn static UHI, whose point
+features all go into the ``getMapId`` request) make the same choice.
+
+Usage:
+    python cell_raster.py --bench                   # payload and render time at 440, 11k and 110k cells
+    python cell_raster.py --bench --cells 440 11000 --feature-cells 11000
+"""
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+# Cells drawn as individual markers up to this count; one image overlay above it
+FEATURE_CELL_LIMIT = 2000
+# Budget of the cell layer in the map HTML (bytes)
+HTML_BUDGET = 1_000_000
+# Web Mercator rows per cell row when they fit the budget (cell edges within 1/4 cell)
+ROWS_PER_CELL = 4
+
+
+def render_mode(n_cells, limit=FEATURE_CELL_LIMIT):
+    """'features' (one map feature per cell) or 'image' (one overlay for all cells)."""
+    return "features" if n_cells <= limit else "image"
+
+
+def _rgba(color):
+    from branca.colormap import LinearColormap
+
+    return LinearColormap([color, color]).rgba_bytes_tuple(0)
+
+
+def category_rgba(values, colors, default='gray'):
+    """RGBA uint8 colour of every value; values missing from ``colors`` (or NaN) get ``default``."""
+    codes, uniques = pd.factorize(pd.Series(values), use_na_sentinel=True)
+    # The default colour goes last, where the NaN code -1 points
+    lut = np.array([_rgba(colors.get(u, default)) for u in uniques] + [_rgba(default)], dtype=np.uint8)
+    return lut[codes]
+
+
+def _axis(values):
+    """Grid index of every coordinate along one axis, and the axis' (first centre, spacing, length)."""
+    values = np.round(np.asarray(values, dtype=float), 9)
+    unique = np.unique(values)
+    step = float(np.diff(unique).min()) if len(unique) > 1 else None
+    index = np.rint((values - unique[0]) / step).astype(int) if step else np.zeros(len(values), dtype=int)
+    return index, unique[0], step, int(index.max()) + 1
+
+
+def rasterize(lat, lon, rgba):
+    """
+    One pixel per grid cell, north row first; cells missing from the table are transparent.
+
+    :param lat: Cell centre latitudes (a regular grid, any resolution)
+    :param rgba: (n, 4) uint8 colours of the cells
+    :return: (image (rows, cols, 4), [[south, west], [north, east]] of the outer cell edges)
+    """
+    rows, lat0, lat_step, n_rows = _axis(lat)
+    cols, lon0, lon_step, n_cols = _axis(lon)
+    # A single row or column has no spacing of its own; borrow the other axis'
+    lat_step = lat_step or lon_step or 0.045
+    lon_step = lon_step or lat_step
+    image = np.zeros((n_rows, n_cols, 4), dtype=np.uint8)
+    image[n_rows - 1 - rows, cols] = rgba
+    bounds = [[float(lat0 - lat_step / 2), float(lon0 - lon_step / 2)],
+              [float(lat0 + (n_rows - 0.5) * lat_step), float(lon0 + (n_cols - 0.5) * lon_step)]]
+    return image, bounds
+
+
+def mercator_rows(image, south, north, height):
+    """Resample the rows of a lat/lon image to ``height`` Web Mercator rows (nearest cell, no blending)."""
+    def y(lat):
+        return np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+    top, bottom = y(north), y(south)
+    centres = top - (np.arange(height) + 0.5) / height * (top - bottom)
+    lats = np.degrees(2 * np.arctan(np.exp(centres)) - np.pi / 2)
+    source = ((north - lats) / (north - south) * len(image)).astype(int)
+    return image[np.clip(source, 0, len(image) - 1)]
+
+
+def cell_overlay(table, column, colors, name, budget=HTML_BUDGET, opacity=0.7):
+    """
+    Folium image overlay of the cells of ``table`` coloured by a category column.
+
+    :param table: Rows with Latitude, Longitude and ``column``
+    :param colors: {category: colour name or hex}
+    :param budget: Largest PNG data URL in bytes; fewer rows per cell are used above it
+    """
+    import folium
+
+    image, bounds = rasterize(table['Latitude'], table['Longitude'], category_rgba(table[column], colors))
+    (south, _), (north, _) = bounds
+    for rows_per_cell in range(ROWS_PER_CELL, 0, -1):
+        overlay = folium.raster_layers.ImageOverlay(
+            image=mercator_rows(image, south, north, len(image) * rows_per_cell), bounds=bounds, name=name,
+            opacity=opacity, pixelated=True)
+        if len(overlay.url) <= budget:
+            break
+    else:
+        print(f"{name}: image of {len(table)} cells is {len(overlay.url) / 1e6:.1f} MB, over the "
+              f"{budget / 1e6:.1f} MB budget")
+    return overlay
+
+
+def add_cells(Map, table, column, colors, name, limit=FEATURE_CELL_LIMIT, budget=HTML_BUDGET):
+    """
+    Draw the cells of ``table`` coloured by a category column: one marker per cell up to
+    ``limit`` cells, one image overlay above it (``render_mode``).
+
+    :return: The mode used, 'features' or 'image'
+    """
+    import folium
+
+    mode = render_mode(len(table), limit)
+    if mode == "image":
+        cell_overlay(table, column, colors, name, budget).add_to(Map)
+        return mode
+    layer = folium.FeatureGroup(name=name)
+    for index, lat, lon, label in zip(table.index, table['Latitude'], table['Longitude'], table[column]):
+        color = colors.get(label, 'gray')
+        folium.CircleMarker(location=[lat, lon], radius=5, color=color, fill=True, fill_opacity=0.6,
+                            popup=f"Grid Cell {index}: {label}").add_to(layer)
+    layer.add_to(Map)
+    return mode
+
+
+def payload_bytes(Map):
+    """Size of the map's HTML as sent to the browser."""
+    return len(Map.get_root().render().encode())
+
+
+# ------------------------- Benchmark ----------------------------
+
+def synthetic_cells(n_cells, bounds=((18.847, 72.744), (19.797, 73.712)), seed=0):
+    """A regular grid of about ``n_cells`` cells over ``bounds`` with random UHI labels (worst case for PNG)."""
+    (south, west), (north, east) = bounds
+    rows = max(1, round(math.sqrt(n_cells * (north - south) / (east - west))))
+    cols = max(1, round(n_cells / rows))
+    lat_step, lon_step = (north - south) / rows, (east - west) / cols
+    lat, lon = np.meshgrid(south + (np.arange(rows) + 0.5) * lat_step, west + (np.arange(cols) + 0.5) * lon_step,
+                           indexing='ij')
+    labels = np.array(['Low UHI', 'Low-Moderate UHI', 'Moderate UHI', 'Moderate-High UHI', 'High UHI'])
+    return pd.DataFrame({'Latitude': lat.ravel(), 'Longitude': lon.ravel(),
+                         'UHI_Label': labels[np.random.default_rng(seed).integers(0, 5, rows * cols)]})
+
+
+def benchmark(cells=(440, 11_000, 110_000), feature_cells=110_000):
+    """
+    HTML payload and server-side render time (build the layer and render the page) of the
+    marker and image renderings, and which one ``add_cells`` picks.
+
+    :param feature_cells: Largest grid to also draw with markers (slow at 100k cells)
+    """
+    import folium
+
+    colors = {'Low UHI': 'blue', 'Low-Moderate UHI': 'lightblue', 'Moderate UHI': 'orange',
+              'Moderate-High UHI': 'red', 'High UHI': 'yellow'}
+    print(f"{'cells':>8} {'mode':>9} {'payload':>10} {'render':>9}")
+    for n_cells in cells:
+        table = synthetic_cells(n_cells)
+        for limit, mode in ((len(table), "features"), (0, "image")):
+            if mode == "features" and len(table) > feature_cells:
+                continue
+            started = time.perf_counter()
+            Map = folium.Map(location=[19.2, 73.2], zoom_start=9)
+            add_cells(Map, table, 'UHI_Label', colors, 'UHI Labels', limit=limit)
+            size = payload_bytes(Map)
+            elapsed = time.perf_counter() - started
+            chosen = " <- auto" if render_mode(len(table)) == mode else ""
+            print(f"{len(table):>8} {mode:>9} {size / 1e3:>7.0f} KB {elapsed:>7.2f} s{chosen}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Marker or image-overlay rendering of grid cells")
+    parser.add_argument("--bench", action="store_true", help="Measure payload and render time per cell count")
+    parser.add_argument("--cells", type=int, nargs="+", default=[440, 11_000, 110_000])
+    parser.add_argument("--feature-cells", type=int, default=110_000,
+                        help="Largest grid also drawn with one marker per cell")
+    args = parser.parse_args()
+
+    if args.bench:
+        benchmark(args.cells, args.feature_cells)
@@ -1,16 +1,77 @@
+import json
+import time
+
 from sklearn.preprocessing import StandardScaler
 import pandas as pd
 import numpy as np
+from cadence import read_dataset
+from instrumentation import instrumented, stage
+from land_mask import keep_active
+from regions import cell_id_from_index
 
+CLUSTER_MODEL_PATH = "cluster_model.json"
+FEATURE_COLUMNS = ['LST_Celsius', 'NDVI', 'Air_Temperature_C', 'Dew_Point_Temperature_C',
+                   'Relative_Humidity_%', 'WindDirection', 'WindSpeed', 'Rainfall_mm', 'impervious_percentage']
+# Cluster labels from the hottest to the coolest cluster (by mean LST)
+UHI_CLASSES = ['High UHI', 'Moderate-High UHI', 'Moderate UHI', 'Low-Moderate UHI', 'Low UHI']
+# Temporal-profile mode: one seasonal profile per cell instead of one row per cell-day
+PROFILE_COLUMNS = ['LST_Celsius', 'NDVI', 'Relative_Humidity_%', 'WindSpeed', 'Rainfall_mm']
+PROFILE_LABELS_PATH = "UHI_Profile_Labels.csv"
+PROFILE_COMPONENTS = 10
 
-def clustering_kmeans():
-    df = pd.read_csv('Final_Merged_Dataset.csv')
+
+def save_cluster_model(path, fill_values, scaler, kmeans, cluster_labels):
+    """Persist what ``classify`` needs to label new rows exactly like the fitted clustering."""
+    model = {
+        "columns": FEATURE_COLUMNS,
+        "fill": [float(fill_values[c]) for c in FEATURE_COLUMNS],
+        "scale_mean": scaler.mean_.tolist(),
+        "scale_std": scaler.scale_.tolist(),
+        "centers": kmeans.cluster_centers_.tolist(),
+        "labels": {str(int(c)): label for c, label in cluster_labels.items()},
+    }
+    with open(path, "w") as fh:
+        json.dump(model, fh, indent=2)
+    return path
+
+
+def load_cluster_model(path=CLUSTER_MODEL_PATH):
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def classify(features, model):
+    """
+    Cluster and UHI label of rows with the model's feature columns.
+
+    Applies the clustering preprocessing (-999 and NaN -> training means,
+    standardisation) and assigns each row to the nearest cluster centre.
+
+    :param features: DataFrame (or dict of arrays) with ``model["columns"]``
+    :return: (cluster ids, UHI labels) arrays
+    """
+    x = np.column_stack([np.asarray(features[c], dtype=np.float64) for c in model["columns"]])
+    x = np.where((x == -999) | np.isnan(x), np.asarray(model["fill"]), x)
+    x = (x - np.asarray(model["scale_mean"])) / np.asarray(model["scale_std"])
+    centers = np.asarray(model["centers"])
+    distances = (x ** 2).sum(axis=1)[:, None] - 2 * x @ centers.T + (centers ** 2).sum(axis=1)[None, :]
+    cluster = distances.argmin(axis=1)
+    labels = np.array([model["labels"][str(c)] for c in range(len(centers))], dtype=object)
+    return cluster, labels[cluster]
+
+
+def scale_features(df):
+    """
+    Clustering preprocessing: -999 and NaN -> column means, then standardisation.
+
+    :return: (df with scaled ``FEATURE_COLUMNS``, fill values, fitted scaler)
+    """
     # Drop rows with missing values or interpolate
     df = df.replace(-999, np.nan)
     # Select relevant columns for clustering
-    features = df[['LST_Celsius', 'NDVI', 'Air_Temperature_C', 'Dew_Point_Temperature_C',
-                'Relative_Humidity_%', 'WindDirection', 'WindSpeed', 'Rainfall_mm', 'impervious_percentage']]
-    df[features.columns] = df[features.columns].fillna(df[features.columns].mean())
+    features = df[FEATURE_COLUMNS]
+    fill_values = df[features.columns].mean()
+    df[features.columns] = df[features.columns].fillna(fill_values)
     # Scale the features
     scaler = StandardScaler()
     scaled_features = scaler.fit_transform(features)
@@ -24,38 +85,239 @@ def clustering_kmeans():
 
     # Replace NaNs with mean of each column
     df[features.columns] = df[features.columns].fillna(df[features.columns].mean())
+    return df, fill_values, scaler
 
+
+def fit_clusters(df, k=5):
+    """
+    K-means over the scaled ``FEATURE_COLUMNS`` rows of ``df``, labelled from the hottest cluster down.
+
+    :return: (df with Cluster and UHI_Label, kmeans, {cluster: label})
+    """
     from sklearn.cluster import KMeans
 
-    # Choose number of clusters (we can optimize this later)
-    k = 5  # Start with 5, can use elbow method to find optimal k
+    features = df[FEATURE_COLUMNS]
 
-    # Perform clustering
+    # Perform clustering (k = 5 UHI classes; the elbow method could tune it)
     kmeans = KMeans(n_clusters=k, random_state=42)
-    df['Cluster'] = kmeans.fit_predict(df[features.columns])
+    with stage("clustering_kmeans.fit") as rec:
+        df['Cluster'] = kmeans.fit_predict(df[features.columns])
+        rec["rows_in"] = rec["rows_out"] = len(df)
     cluster_summary = df.groupby('Cluster')[features.columns].mean().sort_values(by='LST_Celsius', ascending=False)
 
     # Sort the cluster summary by LST_Celsius in descending order
     sorted_clusters = cluster_summary.sort_values(by='LST_Celsius', ascending=False)
-    # Create labels based on the sorted order
-    uh_labels = ['High UHI', 'Moderate-High UHI', 'Moderate UHI', 'Low-Moderate UHI', 'Low UHI']
-
     # Map the clusters to labels based on sorted LST
-    dynamic_cluster_labels = {sorted_clusters.index[i]: uh_labels[i] for i in range(len(sorted_clusters))}
+    dynamic_cluster_labels = {sorted_clusters.index[i]: UHI_CLASSES[i] for i in range(len(sorted_clusters))}
 
     # Apply the dynamic mapping to the DataFrame
     df['UHI_Label'] = df['Cluster'].map(dynamic_cluster_labels)
+    return df, kmeans, dynamic_cluster_labels
+
+
+def cluster_cell_days(df, k=5):
+    """
+    K-means over individual cell-day rows (the pipeline's default mode).
+
+    :param df: Merged dataset rows with ``FEATURE_COLUMNS``
+    :param k: Number of clusters (5 UHI classes)
+    :return: (df with scaled features, Cluster and UHI_Label, fill values, scaler, kmeans, {cluster: label})
+    """
+    df, fill_values, scaler = scale_features(df)
+    df, kmeans, dynamic_cluster_labels = fit_clusters(df, k)
+    return df, fill_values, scaler, kmeans, dynamic_cluster_labels
+
+
+@instrumented("clustering_kmeans", inputs=["Final_Merged_Dataset.csv", "NDVI_16day.csv"],
+              outputs=["Final_Merged_Dataset_with_UHI_Labels.csv", "Cluster_Summary.csv", CLUSTER_MODEL_PATH])
+def clustering_kmeans():
+    # Sea cells (land mask) would only add imputed rows that pull the cluster centres
+    df = keep_active(read_dataset('Final_Merged_Dataset.csv'))
+    df, fill_values, scaler, kmeans, dynamic_cluster_labels = cluster_cell_days(df)
+    # Keep the fitted model so forecasts (forecast.py) are labelled the same way
+    save_cluster_model(CLUSTER_MODEL_PATH, fill_values, scaler, kmeans, dynamic_cluster_labels)
     # Verify the result
     print(df[['Cluster', 'UHI_Label']].value_counts())
     temp_df = df[['Cluster', 'UHI_Label']].value_counts()
     # Save the cluster summary to a CSV file
     temp_df.to_csv('Cluster_Summary.csv')
 
-    original_df = pd.read_csv('Final_Merged_Dataset.csv')
+    # NDVI is not written back: readers attach it from NDVI_16day.csv (cadence.py)
+    original_df = keep_active(pd.read_csv('Final_Merged_Dataset.csv'))
     # Merge the original DataFrame with the clustering results
     original_df['Cluster'] = df['Cluster']
     original_df['UHI_Label'] = df['UHI_Label']
     # Save the merged DataFrame to a new CSV file
     original_df.to_csv('Final_Merged_Dataset_with_UHI_Labels.csv', index=False)
 
-    print("Clustering completed and saved to Final_Merged_Dataset_with_UHI_Labels.csv")
\ No newline at end of file
+    print("Clustering completed and saved to Final_Merged_Dataset_with_UHI_Labels.csv")
+
+# ------------------------- Temporal-profile mode ----------------------------
+
+def cell_profiles(df, columns=PROFILE_COLUMNS):
+    """
+    Seasonal profile of every cell: monthly means and amplitudes (daily max - min) of ``columns``.
+
+    -999 and missing days are ignored, except for rainfall where the extractor writes -999 for
+    dry days (a zero mean); months without any value take the mean of the other cells.
+
+    :param df: Cell-day rows with Date, Latitude, Longitude and ``cell_id`` or ``system:index``
+    :return: (cells table, (cells, 24 * len(columns)) profile array, feature names)
+    """
+    cell_id = df['cell_id'].to_numpy() if 'cell_id' in df.columns else cell_id_from_index(df['system:index'].astype(str))
+    month = pd.to_datetime(df['Date'], format='ISO8601').dt.month.to_numpy()
+    values = df[columns].replace(-999, np.nan)
+    if 'Rainfall_mm' in columns:
+        values['Rainfall_mm'] = df['Rainfall_mm'].replace(-999, 0.0)
+    grouped = values.groupby([cell_id, month]).agg(['mean', 'max', 'min'])
+    grouped.index.names = ['cell_id', 'month']
+
+    months = list(range(1, 13))
+    means = grouped.xs('mean', axis=1, level=1).unstack('month').reindex(columns=months, level='month')
+    amplitude = (grouped.xs('max', axis=1, level=1) - grouped.xs('min', axis=1, level=1)).unstack('month') \
+        .reindex(columns=months, level='month')
+    profiles = np.hstack([means.to_numpy(), amplitude.to_numpy()])
+    names = [f"{c}_mean_m{m}" for c, m in means.columns] + [f"{c}_amp_m{m}" for c, m in amplitude.columns]
+
+    known = ~np.isnan(profiles)
+    fill = np.where(known, profiles, 0).sum(axis=0) / np.maximum(known.sum(axis=0), 1)
+    profiles = np.where(np.isnan(profiles), fill, profiles)
+    keys = ['Region', 'Latitude', 'Longitude'] if 'Region' in df.columns else ['Latitude', 'Longitude']
+    cells = df[keys].groupby(cell_id).first().reindex(means.index).rename_axis('cell_id').reset_index()
+    return cells, profiles, names
+
+
+def cluster_profiles(profiles, k=5, components=PROFILE_COMPONENTS, seed=42):
+    """
+    Randomized PCA of the standardised profiles, then k-means on the component scores.
+
+    :return: (cluster per cell, explained variance share of the kept components)
+    """
+    from sklearn.cluster import KMeans
+    from sklearn.decomposition import PCA
+
+    x = StandardScaler().fit_transform(profiles)
+    pca = PCA(n_components=min(components, x.shape[0] - 1, x.shape[1]), svd_solver='randomized', random_state=seed)
+    scores = pca.fit_transform(x)
+    clusters = KMeans(n_clusters=k, random_state=seed).fit_predict(scores)
+    return clusters, float(pca.explained_variance_ratio_.sum())
+
+
+def profile_labels(df, k=5):
+    """
+    Stable per-cell UHI class from the cells' full-year profiles.
+
+    :return: (cells table with Profile_Cluster, Profile_UHI_Label and Mean_LST, explained variance share)
+    """
+    cells, profiles, names = cell_profiles(df)
+    clusters, explained = cluster_profiles(profiles, k)
+    lst_columns = [i for i, name in enumerate(names) if name.startswith('LST_Celsius_mean')]
+    mean_lst = profiles[:, lst_columns].mean(axis=1)
+    # Hottest cluster first, as in the cell-day mode
+    ranking = pd.Series(mean_lst).groupby(clusters).mean().sort_values(ascending=False).index
+    labels = {cluster: UHI_CLASSES[i] for i, cluster in enumerate(ranking)}
+    cells['Profile_Cluster'] = clusters
+    cells['Profile_UHI_Label'] = pd.Series(clusters).map(labels).to_numpy()
+    cells['Mean_LST'] = mean_lst.round(3)
+    return cells, explained
+
+
+@instrumented("clustering_profiles", inputs=["Final_Merged_Dataset.csv", "NDVI_16day.csv"], outputs=[PROFILE_LABELS_PATH])
+def clustering_profiles(source='Final_Merged_Dataset.csv', output=PROFILE_LABELS_PATH):
+    """Cluster cells by their full-year temporal profiles and save one UHI class per cell."""
+    df = keep_active(read_dataset(source))
+    with stage("clustering_profiles.fit") as rec:
+        cells, explained = profile_labels(df)
+        rec["rows_in"], rec["rows_out"] = len(df), len(cells)
+    print(f"Profile clustering of {len(cells)} cells ({len(PROFILE_COLUMNS)} variables x 12 months x mean/amplitude, "
+          f"PCA keeps {explained:.0%} of the variance)")
+    print(cells['Profile_UHI_Label'].value_counts().to_string())
+    cells.to_csv(output, index=False)
+    print(f"Per-cell UHI classes saved to {output}")
+
+
+def scaled_dataset(df, scale, seed=0):
+    """``df`` with every cell replicated ``scale`` times under new cell ids and a little noise."""
+    rng = np.random.default_rng(seed)
+    cell_id = df['cell_id'].to_numpy() if 'cell_id' in df.columns else cell_id_from_index(df['system:index'].astype(str))
+    n_cells = int(cell_id.max()) + 1
+    parts = []
+    for copy in range(scale):
+        part = df[['Date', 'Latitude', 'Longitude', *FEATURE_COLUMNS]].copy()
+        part['cell_id'] = cell_id + copy * n_cells
+        for column in FEATURE_COLUMNS:
+            values = part[column].to_numpy()
+            part[column] = np.where(values == -999, values, values * rng.normal(1, 0.02, len(values)))
+        parts.append(part)
+    return pd.concat(parts, ignore_index=True)
+
+
+def compare_modes(df, max_rows=2_000_000, seed=0):
+    """
+    Fit both modes on ``df`` and report their timings and labels side by side.
+
+    Beyond ``max_rows`` the cell-day mode is fitted on a random subset of whole cells (all
+    their days, at most ``max_rows`` rows): its time is extrapolated linearly and its per-cell
+    statistics come from those cells.
+
+    :return: DataFrame with one column per mode
+    """
+    if 'cell_id' not in df.columns:
+        df = df.assign(cell_id=cell_id_from_index(df['system:index'].astype(str)))
+    sample = df
+    if len(df) > max_rows:
+        ids = df['cell_id'].unique()
+        keep = np.random.default_rng(seed).permutation(ids)[:max(1, len(ids) * max_rows // len(df))]
+        sample = df[df['cell_id'].isin(keep)].reset_index(drop=True)
+
+    started = time.perf_counter()
+    labelled = cluster_cell_days(sample.copy())[0]
+    cell_day_time = (time.perf_counter() - started) * len(df) / len(sample)
+
+    started = time.perf_counter()
+    cells, explained = profile_labels(df)
+    profile_time = time.perf_counter() - started
+
+    # Per-cell view of the cell-day labels: modal class, number of classes and day-to-day flips
+    labelled = labelled.assign(cell_id=sample['cell_id'].to_numpy(), Date=sample['Date'].to_numpy()).sort_values(['cell_id', 'Date'])
+    by_cell = labelled.groupby('cell_id')['UHI_Label']
+    modal = by_cell.agg(lambda labels: labels.value_counts().index[0])
+    same_cell = labelled['cell_id'].to_numpy()[1:] == labelled['cell_id'].to_numpy()[:-1]
+    flips = pd.Series((labelled['UHI_Label'].to_numpy()[1:] != labelled['UHI_Label'].to_numpy()[:-1]) & same_cell)
+    flips_per_cell = flips.groupby(labelled['cell_id'].to_numpy()[1:]).sum().reindex(modal.index, fill_value=0)
+    agreement = (cells.set_index('cell_id')['Profile_UHI_Label'].reindex(modal.index) == modal).mean()
+
+    extrapolated = " (extrapolated)" if len(sample) < len(df) else ""
+    rows = {
+        "samples clustered": (f"{len(df):,} cell-days", f"{len(cells):,} cells"),
+        "features": (f"{len(FEATURE_COLUMNS)}", f"{24 * len(PROFILE_COLUMNS)} -> {min(PROFILE_COMPONENTS, len(cells) - 1)} PCA ({explained:.0%})"),
+        "fit time s": (f"{cell_day_time:.2f}{extrapolated}", f"{profile_time:.2f}"),
+        "classes per cell (mean)": (f"{by_cell.nunique().mean():.2f}", "1.00"),
+        "label flips per cell-year": (f"{flips_per_cell.mean():.1f}", "0.0"),
+        "cells agreeing with modal cell-day class": ("-", f"{agreement:.0%}"),
+    }
+    for label in UHI_CLASSES:
+        rows[f"cells: {label}"] = (f"{(modal == label).sum()} (modal)", f"{(cells['Profile_UHI_Label'] == label).sum()}")
+    return pd.DataFrame(rows, index=["cell-day k-means", "profile PCA + k-means"]).T
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="UHI clustering of cell-days or of per-cell temporal profiles")
+    parser.add_argument("--mode", choices=["cell-day", "profile"], default="cell-day")
+    parser.add_argument("--compare", action="store_true", help="Fit both modes and report them side by side")
+    parser.add_argument("--data", default="Final_Merged_Dataset.csv")
+    parser.add_argument("--scale", type=int, default=1, help="Replicate the cells this many times for --compare")
+    parser.add_argument("--max-rows", type=int, default=2_000_000, help="Cell-day rows timed before extrapolating")
+    args = parser.parse_args()
+
+    if args.compare:
+        data = keep_active(read_dataset(args.data))
+        if args.scale > 1:
+            data = scaled_dataset(data, args.scale)
+        print(compare_modes(data, args.max_rows).to_string())
+    elif args.mode == "profile":
+        clustering_profiles(args.data)
+    else:
+        clustering_kmeans()
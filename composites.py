@@ -0,0 +1,310 @@
+"""
+Precomputed monthly composite rasters for the app layers.
+
+``build_composites`` computes the monthly composite of every layer (LST,
+NDVI, rainfall, humidity, wind) for every region, year and month, plus the
+static ISA layer. Jobs run in a process pool; each one evaluates the composite
+with ``ee.data.computePixels`` on a fixed lat/lon grid over the region and
+writes a DEFLATE-compressed Cloud Optimized GeoTIFF with averaged overviews to
+``composites/<region>/<layer>/<YYYY>-<MM>.tif``. Existing months are skipped
+unless ``force`` is set.
+
+The apps read annual, seasonal or monthly composites from the store with
+``load_composite``: seasonal and annual values are combined locally from the
+monthly rasters (day-weighted means, or sums for rainfall) so any period is
+available without an Earth Engine request.
+
+Usage:
+    python composites.py --years 2024 2025 --regions mumbai pune
+"""
+import calendar
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from regions import get_region, region_axes, region_names
+
+COMPOSITE_DIR = "composites"
+NODATA = -9999
+
+# India Meteorological Department seasons
+SEASONS = {
+    "Winter (Jan-Feb)": [1, 2],
+    "Pre-monsoon (Mar-May)": [3, 4, 5],
+    "Monsoon (Jun-Sep)": [6, 7, 8, 9],
+    "Post-monsoon (Oct-Dec)": [10, 11, 12],
+}
+
+
+# ------------------------- Layer images ----------------------------
+
+def _era5(start, end, bands):
+    import ee
+    return ee.ImageCollection('ECMWF/ERA5_LAND/DAILY_AGGR').filterDate(start, end).select(bands)
+
+
+def lst_image(start, end):
+    return _era5(start, end, 'temperature_2m').mean().subtract(273.15)
+
+
+def ndvi_image(start, end):
+    import ee
+    return ee.ImageCollection("MODIS/061/MOD13Q1").filterDate(start, end).select('NDVI') \
+        .map(lambda img: img.divide(10000)).mean()
+
+
+def rainfall_image(start, end):
+    return _era5(start, end, 'total_precipitation_sum').sum().multiply(1000)
+
+
+def humidity_image(start, end):
+    def compute_rh(image):
+        temp = image.select('temperature_2m').subtract(273.15)
+        dew = image.select('dewpoint_temperature_2m').subtract(273.15)
+        es = temp.expression('6.112 * exp((17.67 * T) / (T + 243.5))', {'T': temp})
+        ed = dew.expression('6.112 * exp((17.67 * Td) / (Td + 243.5))', {'Td': dew})
+        return ed.divide(es).multiply(100).rename('relative_humidity')
+
+    return _era5(start, end, ['temperature_2m', 'dewpoint_temperature_2m']).map(compute_rh).mean()
+
+
+def wind_image(start, end):
+    def speed(image):
+        return image.select("u_component_of_wind_10m").hypot(image.select("v_component_of_wind_10m")) \
+            .rename("wind_speed")
+
+    return _era5(start, end, ["u_component_of_wind_10m", "v_component_of_wind_10m"]).map(speed).mean()
+
+
+def isa_image(start=None, end=None):
+    import ee
+    return ee.ImageCollection('ESA/WorldCover/v100').first().eq(50).selfMask()
+
+
+# reducer: how monthly composites combine into longer periods ("static" layers have one raster)
+LAYERS = {
+    'lst': {'image': lst_image, 'reducer': 'mean', 'scale_deg': 0.01},
+    'ndvi': {'image': ndvi_image, 'reducer': 'mean', 'scale_deg': 0.0025},
+    'rainfall': {'image': rainfall_image, 'reducer': 'sum', 'scale_deg': 0.01},
+    'humidity': {'image': humidity_image, 'reducer': 'mean', 'scale_deg': 0.01},
+    'wind': {'image': wind_image, 'reducer': 'mean', 'scale_deg': 0.01},
+    'isa': {'image': isa_image, 'reducer': 'static', 'scale_deg': 0.001},
+}
+
+
+# ------------------------- Store ----------------------------
+
+def composite_path(region_name, layer, year=None, month=None, out_dir=COMPOSITE_DIR):
+    name = "static" if LAYERS[layer]['reducer'] == 'static' else f"{year}-{month:02d}"
+    return os.path.join(out_dir, region_name, layer, f"{name}.tif")
+
+
+def write_cog(path, array, bounds):
+    """
+    Write a float32 array as a DEFLATE-compressed Cloud Optimized GeoTIFF with overviews.
+
+    :param bounds: (lat_min, lon_min, lat_max, lon_max) of the array's outer edges
+    """
+    from rasterio.io import MemoryFile
+    from rasterio.shutil import copy as copy_dataset
+    from rasterio.transform import from_bounds
+
+    lat_min, lon_min, lat_max, lon_max = bounds
+    height, width = array.shape
+    profile = {'driver': 'GTiff', 'height': height, 'width': width, 'count': 1, 'dtype': 'float32',
+               'crs': 'EPSG:4326', 'nodata': np.nan,
+               'transform': from_bounds(lon_min, lat_min, lon_max, lat_max, width, height)}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with MemoryFile() as memfile:
+        with memfile.open(**profile) as dst:
+            dst.write(array.astype('float32'), 1)
+        with memfile.open() as src:
+            copy_dataset(src, tmp, driver='COG', compress='DEFLATE', predictor=3,
+                         overviews='AUTO', overview_resampling='AVERAGE', blocksize=256)
+    os.replace(tmp, path)
+
+
+def read_cog(path, max_size=None):
+    """
+    Read a composite raster, from the smallest overview that is still at least ``max_size`` pixels wide.
+
+    :return: (array, (lat_min, lon_min, lat_max, lon_max))
+    """
+    import rasterio
+    from rasterio.enums import Resampling
+
+    with rasterio.open(path) as src:
+        factor = max(1, src.width // max_size) if max_size else 1
+        array = src.read(1, out_shape=(max(1, src.height // factor), max(1, src.width // factor)),
+                         resampling=Resampling.average)
+        bounds = src.bounds
+    return array, (bounds.bottom, bounds.left, bounds.top, bounds.right)
+
+
+def available_years(region_name, layer='lst', out_dir=COMPOSITE_DIR):
+    directory = os.path.join(out_dir, region_name, layer)
+    if not os.path.isdir(directory):
+        return []
+    return sorted({int(name[:4]) for name in os.listdir(directory) if name.endswith(".tif") and name[:4].isdigit()})
+
+
+def load_composite(region_name, layer, year, months, out_dir=COMPOSITE_DIR, max_size=None):
+    """
+    Composite of ``layer`` over the given months of ``year``, combined from the monthly rasters.
+
+    :param months: Months (1-12) to combine, e.g. ``range(1, 13)`` for the annual composite
+    :return: (array, bounds), or None if any month is missing from the store
+    """
+    if LAYERS[layer]['reducer'] == 'static':
+        path = composite_path(region_name, layer, out_dir=out_dir)
+        return read_cog(path, max_size) if os.path.exists(path) else None
+
+    paths = [composite_path(region_name, layer, year, month, out_dir) for month in months]
+    if not paths or not all(os.path.exists(p) for p in paths):
+        return None
+    rasters = [read_cog(p, max_size) for p in paths]
+    stack = np.stack([array for array, _ in rasters])
+    valid = ~np.isnan(stack)
+    if LAYERS[layer]['reducer'] == 'sum':
+        combined = np.where(valid.any(axis=0), np.nansum(stack, axis=0), np.nan)
+    else:
+        days = np.array([calendar.monthrange(year, m)[1] for m in months], dtype=float)[:, None, None]
+        weight = np.where(valid, days, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            combined = np.nansum(stack * weight, axis=0) / weight.sum(axis=0)
+    return combined, rasters[0][1]
+
+
+def colorize(array, vis_params):
+    """RGBA uint8 image of ``array`` using EE-style ``min``/``max``/``palette`` vis params; NaN is transparent."""
+    from branca.colormap import LinearColormap
+
+    palette = [f"#{c}" if len(c) == 6 and all(ch in "0123456789abcdefABCDEF" for ch in c) else c
+               for c in vis_params.get('palette') or ['white', 'black']]
+    colormap = LinearColormap(palette * 2 if len(palette) == 1 else palette, vmin=0, vmax=1)
+    lut = np.array([colormap.rgba_bytes_tuple(x) for x in np.linspace(0, 1, 256)], dtype=np.uint8)
+    low, high = vis_params.get('min', np.nanmin(array)), vis_params.get('max', np.nanmax(array))
+    scaled = np.clip((array - low) / ((high - low) or 1), 0, 1)
+    rgba = lut[np.nan_to_num(scaled * 255).astype(int)]
+    rgba[np.isnan(array), 3] = 0
+    return rgba
+
+
+def composite_overlay(composite, vis_params, name, opacity=0.7):
+    """Folium image overlay of a ``load_composite`` result."""
+    import folium
+
+    array, (lat_min, lon_min, lat_max, lon_max) = composite
+    return folium.raster_layers.ImageOverlay(image=colorize(array, vis_params), name=name, opacity=opacity,
+                                             bounds=[[lat_min, lon_min], [lat_max, lon_max]],
+                                             mercator_project=True)
+
+
+# ------------------------- Batch job ----------------------------
+
+def _init_worker():
+    import ee
+    ee.Initialize(project='heat-islands')
+
+
+def compute_composite(job):
+    """
+    Compute one composite raster with ``ee.data.computePixels`` and store it as a COG.
+
+    :param job: (region name, layer, year, month, out dir); year/month are None for static layers
+    :return: (path, seconds)
+    """
+    import ee
+
+    region_name, layer, year, month, out_dir = job
+    started = time.perf_counter()
+    spec = LAYERS[layer]
+    if year is None:
+        image = spec['image']()
+    else:
+        start = datetime(year, month, 1)
+        end = datetime(year + month // 12, month % 12 + 1, 1)
+        image = spec['image'](start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"))
+
+    _, _, (lat_min, lon_min, lat_max, lon_max) = region_axes(get_region(region_name))
+    step = spec['scale_deg']
+    width = int(np.ceil((lon_max - lon_min) / step))
+    height = int(np.ceil((lat_max - lat_min) / step))
+    pixels = ee.data.computePixels({
+        'expression': image.rename('value').unmask(NODATA),
+        'fileFormat': 'NUMPY_NDARRAY',
+        'grid': {
+            'dimensions': {'width': width, 'height': height},
+            'affineTransform': {'scaleX': step, 'shearX': 0, 'translateX': lon_min,
+                                'shearY': 0, 'scaleY': -step, 'translateY': lat_max},
+            'crsCode': 'EPSG:4326',
+        },
+    })
+    array = np.asarray(pixels['value'], dtype=float)
+    array[array == NODATA] = np.nan
+
+    path = composite_path(region_name, layer, year, month, out_dir)
+    write_cog(path, array, (lat_max - height * step, lon_min, lat_max, lon_min + width * step))
+    return path, time.perf_counter() - started
+
+
+def composite_jobs(regions=None, years=None, layers=None, out_dir=COMPOSITE_DIR, force=False):
+    """
+    Every missing (region, layer, year, month) composite, limited to complete months of available data.
+    """
+    latest = datetime.utcnow() - timedelta(days=10)  # same lag as the extractors
+    years = years or [latest.year - 1]
+    jobs = []
+    for region_name in regions or region_names():
+        for layer in layers or LAYERS:
+            if LAYERS[layer]['reducer'] == 'static':
+                periods = [(None, None)]
+            else:
+                periods = [(y, m) for y in years for m in range(1, 13)
+                           if datetime(y + m // 12, m % 12 + 1, 1) <= latest]
+            for year, month in periods:
+                if force or not os.path.exists(composite_path(region_name, layer, year, month, out_dir)):
+                    jobs.append((region_name, layer, year, month, out_dir))
+    return jobs
+
+
+def build_composites(regions=None, years=None, layers=None, out_dir=COMPOSITE_DIR, force=False,
+                     max_workers=None):
+    """
+    Precompute monthly composites for every region x layer x year x month in a process pool.
+
+    :param regions: Region names (default: all configured regions)
+    :param years: Years to build (default: last year)
+    :param layers: Layer keys from ``LAYERS`` (default: all)
+    :param force: Recompute composites that already exist
+    :return: List of written paths
+    """
+    jobs = composite_jobs(regions, years, layers, out_dir, force)
+    print(f"Building {len(jobs)} composites...")
+    started = time.perf_counter()
+    written = []
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker) as pool:
+        futures = [pool.submit(compute_composite, job) for job in jobs]
+        for future in as_completed(futures):
+            path, seconds = future.result()
+            written.append(path)
+            print(f"  {path} ({seconds:.1f} s)")
+    print(f"Built {len(written)} composites in {time.perf_counter() - started:.1f} s.")
+    return written
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--years", type=int, nargs="+")
+    parser.add_argument("--regions", nargs="+")
+    parser.add_argument("--layers", nargs="+", choices=list(LAYERS))
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+    build_composites(args.regions, args.years, args.layers, force=args.force, max_workers=args.workers)
@@ -1,60 +1,77 @@
+import os
+
 import pandas as pd
 from datetime import datetime
-from pydrive.auth import GoogleAuth
-from pydrive.drive import GoogleDrive
+from instrumentation import instrumented, stage
+from exports import download_stitched
+from storage import get_storage
+from partitions import upload_partitions
+from regions import cell_id_from_index, region_of
+from land_mask import keep_active
 
-def download_datasets():
-    # --- Authenticate Google Drive ---
-    gauth = GoogleAuth()
-    gauth.LocalWebserverAuth()
-    drive = GoogleDrive(gauth)
-
-    # --- Download files by filename ---
-    def download_file(file_name, local_path):
-        file_list = drive.ListFile({'q': f"title='{file_name}' and trashed=false"}).GetList()
-        if not file_list:
-            raise FileNotFoundError(f"{file_name} not found on Google Drive")
-        file = file_list[0]
-        file.GetContentFile(local_path)
-        print(f"Downloaded: {file_name}")
-
-    download_file("AREA_HUMIDITY.csv", "AREA_HUMIDITY.csv")
-    download_file("AREA_WIND.csv", "AREA_WIND.csv")
-    download_file("AREA_RAINFALL.csv", "AREA_RAINFALL.csv")
-
-    lst_ndvi_df = pd.read_csv("AREA_LST_with_NDVI.csv")
-    humidity_df = pd.read_csv("AREA_HUMIDITY.csv")
-    wind_df = pd.read_csv("AREA_WIND.csv")
-    rainfall_df = pd.read_csv("AREA_RAINFALL.csv")
-    isa_df = pd.read_csv("AREA_ISA.csv")
-
-    lst_ndvi_df = lst_ndvi_df[['system:index','Date','Latitude','Longitude','LST_Celsius','NDVI']]
-    humidity_df = humidity_df[['system:index','Air_Temperature_C','Dew_Point_Temperature_C','Relative_Humidity_%']]
-    wind_df = wind_df[['system:index','WindDirection','WindSpeed']]
-    rainfall_df = rainfall_df[['system:index','Rainfall_mm']]
-    isa_df = isa_df[['impervious_percentage']]
-
-    final_df = lst_ndvi_df.merge(humidity_df, on=['system:index'], how='left')
+# Columns taken from each daily layer, joined onto the LST rows on system:index
+LAYER_COLUMNS = {
+    "AREA_LST.csv": ['system:index','Date','Latitude','Longitude','LST_Celsius'],
+    "AREA_HUMIDITY.csv": ['system:index','Air_Temperature_C','Dew_Point_Temperature_C','Relative_Humidity_%'],
+    "AREA_WIND.csv": ['system:index','WindDirection','WindSpeed'],
+    "AREA_RAINFALL.csv": ['system:index','Rainfall_mm'],
+}
+
+
+def merge_layers(directory=".", index=None):
+    """
+    Merge the local layer exports into the daily dataset (pandas path; lazy_chain.py is the polars one).
+
+    :param directory: Folder holding the AREA_*.csv exports
+    :param index: Active cell index (``land_mask.active_index``; the saved mask by default)
+    :return: One row per active LST cell-day with the weather layers, ISA and Region
+    """
+    path = lambda name: os.path.join(directory, name)
+    # Every other table is left-joined onto the LST rows, so these decide the active cells.
+    # NDVI stays at its native cadence (NDVI_16day.csv) and is attached on read (cadence.py)
+    lst_df = keep_active(pd.read_csv(path("AREA_LST.csv")), index)
+    humidity_df = pd.read_csv(path("AREA_HUMIDITY.csv"))
+    wind_df = pd.read_csv(path("AREA_WIND.csv"))
+    rainfall_df = pd.read_csv(path("AREA_RAINFALL.csv"))
+    isa_df = pd.read_csv(path("AREA_ISA.csv"))
+
+    lst_df = lst_df[LAYER_COLUMNS["AREA_LST.csv"]]
+    humidity_df = humidity_df[LAYER_COLUMNS["AREA_HUMIDITY.csv"]]
+    wind_df = wind_df[LAYER_COLUMNS["AREA_WIND.csv"]]
+    rainfall_df = rainfall_df[LAYER_COLUMNS["AREA_RAINFALL.csv"]]
+    isa_df = isa_df[['grid_number', 'impervious_percentage']].drop_duplicates('grid_number')
+
+    final_df = lst_df.merge(humidity_df, on=['system:index'], how='left')
     final_df = final_df.merge(wind_df,on=['system:index'], how='left')
     final_df = final_df.merge(rainfall_df, on=['system:index'], how='left')
-    final_df['impervious_percentage'] = isa_df['impervious_percentage'].values
+    # ISA is static per cell: join on the global cell id rather than by row position,
+    # which breaks once exports are stitched from several tiles
+    final_df['grid_number'] = cell_id_from_index(final_df['system:index'])
+    final_df = final_df.merge(isa_df, on='grid_number', how='left').drop(columns='grid_number')
+    final_df['Region'] = region_of(cell_id_from_index(final_df['system:index']))
+    return final_df
+
+
+@instrumented("download_datasets",
+              inputs=["AREA_LST.csv", "AREA_HUMIDITY.csv", "AREA_WIND.csv",
+                      "AREA_RAINFALL.csv", "AREA_ISA.csv"],
+              outputs=["Final_Merged_Dataset.csv"])
+def download_datasets():
+    # --- Google Drive client (authenticated once per process) ---
+    storage = get_storage()
+
+    # --- Download changed files concurrently (tiled exports are stitched back together) ---
+    with stage("download_datasets.download", outputs=["AREA_HUMIDITY.csv", "AREA_WIND.csv", "AREA_RAINFALL.csv"]):
+        download_stitched(storage, ["AREA_HUMIDITY.csv", "AREA_WIND.csv", "AREA_RAINFALL.csv"])
+
+    final_df = merge_layers()
 
 
     output_file = "Final_Merged_Dataset.csv"
     final_df.to_csv("Final_Merged_Dataset.csv",index=False)
     print("Final Dataset Merged !!!!")
 
-    folder_list = drive.ListFile({'q': "mimeType='application/vnd.google-apps.folder' and trashed=false"}).GetList()
-    earthengine_folder = next((f for f in folder_list if f['title'] == 'EarthEngine'), None)
-
-    if not earthengine_folder:
-        raise Exception(" 'EarthEngine' folder not found in your Drive!")
-
     # --- Upload the CSV into 'EarthEngine' folder ---
-    uploaded_file = drive.CreateFile({
-        'title': output_file,
-        'parents': [{'id': earthengine_folder['id']}]
-    })
-    uploaded_file.SetContentFile(output_file)
-    uploaded_file.Upload()
-    print(f"Uploaded to Google Drive > EarthEngine > {output_file}")
+    with stage("download_datasets.upload", inputs=[output_file]):
+        upload_partitions(storage, output_file)
+    print(f"Uploaded to Google Drive > EarthEngine > {output_file} (monthly partitions)")
@@ -0,0 +1,298 @@
+"""
+Tiled, time-sharded Earth Engine table exports and stitching of the exported parts.
+
+Large grids are split into compact spatial tiles of at most ``max_tile_cells``
+cells so each ``reduceRegions`` request stays within EE limits, and the date
+range is split into calendar-month shards (``export_shard_months`` in
+regions.json). Every tile and shard is exported as its own task
+(``<prefix>_sYYYYMM_tNNN.csv``); tasks are built and started from a thread
+pool so the client-side graph building and the ``start`` round trips overlap.
+Exports that fit in a single tile and shard keep the original export name.
+
+Task states are tracked per shard in ``.export_status.json``: failed shards are
+resubmitted, and a rerun skips shards that already completed for the same
+date range, so a failure late in a long backfill only costs that shard.
+
+Exported features carry a ``cell_id`` property; ``download_stitched`` joins the
+parts back together in date order and rewrites ``system:index`` as
+``<image id>_<cell_id>`` so downstream code sees globally unique cell ids.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import ee
+import pandas as pd
+
+from regions import as_cells, get_region, load_config
+
+PART_SUFFIX = re.compile(r"(_s\d{6})?(_t\d{3})?\.csv$", re.IGNORECASE)
+PARTS_DIR = ".drive_parts"
+STATUS_PATH = ".export_status.json"
+
+
+def grid_features(cells):
+    """Point features for a cells table, tagged with their global ``cell_id``."""
+    return [
+        ee.Feature(ee.Geometry.Point(lon, lat), {'Latitude': lat, 'Longitude': lon, 'cell_id': int(cell_id)})
+        for cell_id, lat, lon in cells[['cell_id', 'Latitude', 'Longitude']].itertuples(index=False)
+    ]
+
+
+def tile_cells(cells, max_tile_cells=None):
+    """
+    Split a cells table into spatially compact tiles.
+
+    Tiles are rectangular blocks of grid rows/columns within one region, about
+    square, holding at most ``max_tile_cells`` cells.
+
+    :param cells: Cells table from ``regions.study_cells``
+    :param max_tile_cells: Tile size limit (defaults to ``max_tile_cells`` in regions.json)
+    :return: List of cells tables
+    """
+    cells = as_cells(cells)
+    max_tile_cells = max_tile_cells or load_config()["max_tile_cells"]
+    tiles = []
+    for _, region_cells in cells.groupby("Region", sort=False):
+        rows = region_cells["row"].max() + 1
+        cols = region_cells["col"].max() + 1
+        side = max(1, int(max_tile_cells ** 0.5))
+        tile_rows = min(rows, side)
+        tile_cols = min(cols, max(1, max_tile_cells // tile_rows))
+        block = (region_cells["row"] // tile_rows) * cols + region_cells["col"] // tile_cols
+        tiles.extend(t for _, t in region_cells.groupby(block, sort=True))
+    return tiles
+
+
+def reduce_tiles(cells, reduce, max_workers=8, max_tile_cells=None):
+    """
+    Reduce the grid boxes of a cells table on Earth Engine and fetch the results with ``getInfo``.
+
+    ``getInfo`` is limited to a few thousand features, so large grids are fetched
+    per tile (``tile_cells``), several tiles at a time.
+
+    :param cells: Cells table from ``regions.study_cells``
+    :param reduce: Function of a FeatureCollection of grid boxes to the FeatureCollection to fetch;
+                   the boxes carry ``cell_id``, ``lat_center``, ``lon_center`` and ``cell_area_m2``
+    :return: Properties of every fetched feature
+    """
+    steps = {name: get_region(name) for name in cells['Region'].unique()}
+
+    def fetch(tile):
+        features = []
+        for cell_id, region, lat, lon in tile[['cell_id', 'Region', 'Latitude', 'Longitude']].itertuples(index=False):
+            lat_step, lon_step = steps[region]['lat_step'], steps[region]['lon_step']
+            box = ee.Geometry.Rectangle([lon - lon_step / 2, lat - lat_step / 2, lon + lon_step / 2, lat + lat_step / 2])
+            features.append(ee.Feature(box, {'cell_id': int(cell_id), 'lat_center': lat, 'lon_center': lon,
+                                             'cell_area_m2': steps[region]['cell_km'] ** 2 * 1e6}))
+        return [f['properties'] for f in reduce(ee.FeatureCollection(features)).getInfo()['features']]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return [row for rows in pool.map(fetch, tile_cells(cells, max_tile_cells)) for row in rows]
+
+
+def time_shards(start, end, months=1):
+    """
+    Split the date range ``[start, end)`` at calendar month boundaries.
+
+    :param start: "YYYY-MM-DD"
+    :param end: "YYYY-MM-DD" (exclusive)
+    :param months: Months per shard; 0 keeps the whole range in one shard
+    :return: List of ("YYYY-MM-DD", "YYYY-MM-DD") ranges in date order
+    """
+    lo, end = datetime.strptime(start, "%Y-%m-%d"), datetime.strptime(end, "%Y-%m-%d")
+    if not months:
+        return [(start, end.strftime("%Y-%m-%d"))]
+    shards = []
+    while lo < end:
+        month = lo.year * 12 + lo.month - 1 + months
+        hi = min(datetime(month // 12, month % 12 + 1, 1), end)
+        shards.append((lo.strftime("%Y-%m-%d"), hi.strftime("%Y-%m-%d")))
+        lo = hi
+    return shards
+
+
+def load_status(path=STATUS_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def _save_status(status, path=STATUS_PATH):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as fh:
+        json.dump(status, fh, indent=2)
+    os.replace(tmp, path)
+
+
+def export_tiled(build, grid_centers, export_desc, start, end, selectors=None, description=None,
+                 folder='EarthEngine', max_tile_cells=None, shard_months=None, max_workers=8,
+                 wait=True, max_retries=2, poll_seconds=30):
+    """
+    Export ``build(feature_collection, shard_start, shard_end)`` for every tile and time shard to Google Drive.
+
+    Shards whose last export completed with the same date range and cells are
+    skipped, so a rerun only redoes failed or changed shards. Per-shard state is
+    kept in ``.export_status.json``.
+
+    :param build: Function mapping a grid FeatureCollection and a date range to the table to export
+    :param grid_centers: Cells table or legacy (rows, cols, 2) grid array
+    :param export_desc: File name prefix; shards get a ``_sYYYYMM`` and tiles a ``_tNNN`` suffix
+    :param start: First date, "YYYY-MM-DD"
+    :param end: End date (exclusive), "YYYY-MM-DD"
+    :param selectors: Properties to keep (``cell_id`` is always kept)
+    :param description: Task description (defaults to the file name)
+    :param shard_months: Months per time shard (defaults to ``export_shard_months`` in regions.json)
+    :param wait: Wait for the tasks and retry failed shards up to ``max_retries`` times
+    :return: {part name: shard status}
+    """
+    tiles = tile_cells(grid_centers, max_tile_cells)
+    if shard_months is None:
+        shard_months = load_config().get("export_shard_months", 0)
+    shards = time_shards(start, end, shard_months)
+
+    jobs = []
+    for shard_start, shard_end in shards:
+        for index, tile in enumerate(tiles):
+            name = export_desc
+            if len(shards) > 1:
+                name += "_s" + shard_start[:7].replace("-", "")
+            if len(tiles) > 1:
+                name += f"_t{index:03d}"
+            cells_key = hashlib.md5(tile['cell_id'].to_numpy().tobytes()).hexdigest()
+            spec = {"start": shard_start, "end": shard_end, "cells": cells_key, "selectors": selectors}
+            jobs.append((name, tile, spec))
+
+    status = load_status()
+    previous = status.get(export_desc, {}).get("shards", {})
+    shard_status = {}
+    pending = []
+    for name, tile, spec in jobs:
+        old = previous.get(name, {})
+        if old.get("state") == "COMPLETED" and old.get("spec") == spec:
+            shard_status[name] = old
+        else:
+            shard_status[name] = {"spec": spec, "state": "UNSUBMITTED", "attempts": 0}
+            pending.append((name, tile, spec))
+    status[export_desc] = {"parts": [name for name, _, _ in jobs], "shards": shard_status}
+
+    def submit(job):
+        name, tile, spec = job
+        collection = build(ee.FeatureCollection(grid_features(tile)), spec["start"], spec["end"])
+        if selectors:
+            collection = collection.select(list(selectors) + ['cell_id'])
+        task = ee.batch.Export.table.toDrive(
+            collection=collection,
+            description=description if len(jobs) == 1 and description else name,
+            folder=folder,
+            fileNamePrefix=name,
+            fileFormat='CSV'
+        )
+        task.start()
+        return task
+
+    def launch(batch):
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            tasks = dict(zip([name for name, _, _ in batch], pool.map(submit, batch)))
+        for name in tasks:
+            shard_status[name].update(state="SUBMITTED", attempts=shard_status[name]["attempts"] + 1,
+                                      task_id=getattr(tasks[name], 'id', None), error=None)
+        _save_status(status)
+        return tasks
+
+    tasks = launch(pending)
+    print(f"Started {len(pending)}/{len(jobs)} exports for {export_desc} "
+          f"({len(shards)} time shards x {len(tiles)} tiles, {sum(len(t) for t in tiles)} cells).")
+    if not wait:
+        return shard_status
+
+    by_name = {name: (name, tile, spec) for name, tile, spec in pending}
+    while tasks:
+        retry = []
+        for name, task in list(tasks.items()):
+            task_status = task.status()
+            state = task_status.get("state")
+            if state in ("READY", "RUNNING", "UNSUBMITTED"):
+                continue
+            del tasks[name]
+            shard_status[name].update(state=state, error=task_status.get("error_message"))
+            if state != "COMPLETED" and shard_status[name]["attempts"] <= max_retries:
+                print(f"Export {name} {state.lower()} ({shard_status[name]['error']}); retrying.")
+                retry.append(by_name[name])
+        _save_status(status)
+        if retry:
+            tasks.update(launch(retry))
+        elif tasks:
+            time.sleep(poll_seconds)
+
+    failed = sorted(name for name, shard in shard_status.items() if shard["state"] != "COMPLETED")
+    if failed:
+        raise RuntimeError(f"{len(failed)} export shards of {export_desc} failed: {', '.join(failed)}. "
+                           f"Rerun to retry only these shards.")
+    return shard_status
+
+
+def stitch(frames):
+    """Concatenate exported parts in date order and key ``system:index`` by global cell id."""
+    df = pd.concat(frames, ignore_index=True)
+    if len(frames) > 1 and 'Date' in df.columns:
+        df = df.sort_values('Date', kind='stable', ignore_index=True)
+    if 'cell_id' in df.columns:
+        image_id = df['system:index'].astype(str).str.rsplit('_', n=1).str[0]
+        df['system:index'] = image_id + '_' + df['cell_id'].astype('int64').astype(str)
+    return df
+
+
+def download_stitched(storage, file_names, parts_dir=PARTS_DIR):
+    """
+    Download exported files, stitching the ``_sYYYYMM``/``_tNNN`` parts of sharded or tiled exports.
+
+    The parts of the last export are taken from ``.export_status.json`` so
+    stale shards outside the current date range are ignored; without a status
+    entry all parts on Drive are used. Remote files are fetched concurrently into
+    ``parts_dir``, skipping any that are unchanged since the last run; a file is
+    re-stitched only when one of its parts changed.
+
+    :param storage: Storage client from ``storage.get_storage``
+    :param file_names: Exported file names, e.g. ``["AREA_LST.csv"]``; each is written to the same local name
+    """
+    os.makedirs(parts_dir, exist_ok=True)
+    exported = {desc.lower(): entry["parts"] for desc, entry in load_status().items()}
+    plan = {}
+    for file_name in file_names:
+        stem = os.path.splitext(file_name)[0]
+        candidates = {f['title'].lower(): f for f in storage.list(stem)}
+        expected = exported.get(stem.lower())
+        if expected:
+            missing = [name for name in expected if name.lower() + '.csv' not in candidates]
+            if missing:
+                raise FileNotFoundError(f"Export parts not found on Google Drive: {', '.join(missing)}")
+            parts = [candidates[name.lower() + '.csv'] for name in expected]
+        else:
+            parts = [candidates[title] for title in sorted(candidates)
+                     if title.startswith(stem.lower() + '_')
+                     and PART_SUFFIX.fullmatch(title[len(stem):]) and title[len(stem):] != '.csv']
+            parts = [candidates[file_name.lower()]] if file_name.lower() in candidates else parts
+        if not parts:
+            raise FileNotFoundError(f"{file_name} not found on Google Drive")
+        plan[file_name] = [(meta, os.path.join(parts_dir, meta['title'])) for meta in parts]
+
+    changed = storage.download_many([pair for pairs in plan.values() for pair in pairs])
+    for file_name, pairs in plan.items():
+        part_paths = [path for _, path in pairs]
+        if os.path.exists(file_name) and not any(changed[path] for path in part_paths):
+            print(f"Up to date: {file_name}")
+            continue
+        with open(part_paths[0]) as fh:
+            has_cell_id = 'cell_id' in fh.readline().strip().split(',')
+        if len(part_paths) == 1 and not has_cell_id:
+            shutil.copyfile(part_paths[0], file_name)
+        else:
+            stitch([pd.read_csv(path) for path in part_paths]).to_csv(file_name, index=False)
+        print(f"Downloaded: {file_name}" + (f" ({len(part_paths)} parts)" if len(part_paths) > 1 else ""))
@@ -2,46 +2,26 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import ee
+from instrumentation import instrumented
+from exports import reduce_tiles
+from land_mask import active_cells
+from regions import as_cells, study_cells
 
-ee.Authenticate()
-ee.Initialize(project='heat-islands')
-    
-def extract_isa():   
-    # Define region of interest (ROI) and grid
-    lat_min, lon_min = 18.847, 72.744
-    lat_max, lon_max = 19.797, 73.712
-    lat_step = 5 / 111  # ~0.045°
-    lon_step = 5 / 102  # ~0.049°
-
-    # Generate grid (5x5 km blocks)
-    lat_values = np.arange(lat_min, lat_max, lat_step)
-    lon_values = np.arange(lon_min, lon_max, lon_step)
-
-    features = []
-    grid_number = 0
-
-    for lat in lat_values:
-        for lon in lon_values:
-            lat1 = lat
-            lat2 = lat + lat_step
-            lon1 = lon
-            lon2 = lon + lon_step
-
-            box = ee.Geometry.Rectangle([lon1, lat1, lon2, lat2])
-            feature = ee.Feature(box, {
-                'grid_number': grid_number,
-                'lat_center': lat + lat_step / 2,
-                'lon_center': lon + lon_step / 2
-            })
-            features.append(feature)
-            grid_number += 1
-
-    # Create FeatureCollection of grid boxes
-    grid_fc = ee.FeatureCollection(features)
-
-    # Load ESA WorldCover dataset and clip it to ROI
-    roi = ee.Geometry.Rectangle([lon_min, lat_min, lon_max, lat_max + lat_step])
-    dataset = ee.ImageCollection('ESA/WorldCover/v100').first().clip(roi)
+# Earth Engine is initialised by the caller (main.py does it before the first EE stage)
+
+@instrumented("extract_isa", outputs=["AREA_ISA.csv"])
+def extract_isa(grid_centers=None):
+    """
+    Computes the built-up (impervious) percentage of each grid cell from ESA WorldCover
+    and saves it for every day of the year to AREA_ISA.csv.
+
+    :param grid_centers: Cells table from regions.study_cells or 2D NumPy array of grid centers
+                         (defaults to the active cells of the default region in regions.json)
+    """
+    cells = active_cells(study_cells()) if grid_centers is None else as_cells(grid_centers)
+
+    # Load ESA WorldCover dataset
+    dataset = ee.ImageCollection('ESA/WorldCover/v100').first()
 
     # Create a mask for the built-up area (class 50 - Built-up area)
     built_up_area = dataset.eq(50)
@@ -58,28 +38,17 @@ def extract_isa():
             maxPixels=1e8
         ).get('Map')  # ESA WorldCover has band name 'Map'
 
-        grid_area_m2 = 25 * 1e6  # 25 km² = 25,000,000 m²
+        grid_area_m2 = grid.get('cell_area_m2')  # e.g. 25 km² = 25,000,000 m² for 5 km cells
         impervious_percentage = ee.Number(built_up_area_m2).divide(grid_area_m2).multiply(100)
         return grid.set('impervious_percentage', impervious_percentage)
 
-    # Apply function to each grid
-    grid_with_impervious = grid_fc.map(calculate_impervious_percentage)
-
-    # Extract the results
-    grid_data = []
-
-    for grid in grid_with_impervious.getInfo()['features']:
-        grid_number = grid['properties']['grid_number']
-        lat_center = grid['properties']['lat_center']
-        lon_center = grid['properties']['lon_center']
-        impervious_percentage = grid['properties']['impervious_percentage']
-
-        grid_data.append({
-            'grid_number': grid_number,
-            'lat_center': lat_center,
-            'lon_center': lon_center,
-            'impervious_percentage': impervious_percentage
-        })
+    # Apply function to each grid box (keyed by the global cell id) and extract the results
+    grid_data = [{
+        'grid_number': grid['cell_id'],
+        'lat_center': grid['lat_center'],
+        'lon_center': grid['lon_center'],
+        'impervious_percentage': grid['impervious_percentage']
+    } for grid in reduce_tiles(cells, lambda boxes: boxes.map(calculate_impervious_percentage))]
 
     # Convert to DataFrame
     df = pd.DataFrame(grid_data)
@@ -89,20 +58,10 @@ def extract_isa():
     start_date = end_date - timedelta(days=365)
     date_list = [start_date + timedelta(days=i) for i in range(365)]
 
-    # Create the final dataset
-    expanded_data = []
-
-    for date in date_list:
-        for _, row in df.iterrows():
-            expanded_data.append({
-                'date': date.strftime('%Y-%m-%d'),
-                'grid_number': row['grid_number'],
-                'lat_center': row['lat_center'],
-                'lon_center': row['lon_center'],
-                'impervious_percentage': row['impervious_percentage']
-            })
-
-    final_df = pd.DataFrame(expanded_data)
+    # Create the final dataset: every cell repeated for every date
+    final_df = pd.DataFrame({'date': np.repeat([d.strftime('%Y-%m-%d') for d in date_list], len(df))})
+    for column in df.columns:
+        final_df[column] = np.tile(df[column].to_numpy(), len(date_list))
 
     # Save to CSV
     final_df.to_csv('AREA_ISA.csv', index=False)
@@ -1,45 +1,36 @@
 import ee
 from datetime import datetime, timedelta
+from instrumentation import instrumented
+from exports import export_tiled
 
+@instrumented("extract_rainfall")
 def extract_rainfall(grid_centers, export_desc="Mumbai_RAINFALL_Export"):
 
     end_date = datetime.utcnow() - timedelta(days=10)  # 10 days before today
     start_date = end_date - timedelta(days=365)
+    start, end = start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")
 
     # Load ERA5-Land Daily Aggregated dataset
     dataset = ee.ImageCollection("ECMWF/ERA5_LAND/DAILY_AGGR") \
-        .filterDate(start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")) \
+        .filterDate(start, end) \
         .select("total_precipitation_sum")  # Daily total precipitation (meters)
 
-    # Create FeatureCollection from grid centers
-    features = [
-        ee.Feature(ee.Geometry.Point(lon, lat), {'Latitude': lat, 'Longitude': lon})
-        for lat, lon in grid_centers.reshape(-1, 2)
-    ]
-    fc = ee.FeatureCollection(features)
+    def build(fc, start, end):
+        def extract(image):
+            date = ee.Date(image.get("system:time_start")).format("YYYY-MM-dd")
+            reduced = image.multiply(1000).reduceRegions(  # Convert m ➝ mm
+                collection=fc,
+                reducer=ee.Reducer.mean(),
+                scale=1000,
+                tileScale=2
+            )
+            return reduced.map(lambda f: f.set({
+                "Date": date,
+                "Rainfall_mm": ee.Algorithms.If(f.get("mean"), f.get("mean"), -999)
+            }))
 
-    def extract(image):
-        date = ee.Date(image.get("system:time_start")).format("YYYY-MM-dd")
-        reduced = image.multiply(1000).reduceRegions(  # Convert m ➝ mm
-            collection=fc,
-            reducer=ee.Reducer.mean(),
-            scale=1000,
-            tileScale=2
-        )
-        return reduced.map(lambda f: f.set({
-            "Date": date,
-            "Rainfall_mm": ee.Algorithms.If(f.get("mean"), f.get("mean"), -999)
-        }))
+        return dataset.filterDate(start, end).map(extract).flatten()
 
-    result = dataset.map(extract).flatten()
-
-    # Export to Google Drive
-    task = ee.batch.Export.table.toDrive(
-        collection=result.select(["Rainfall_mm"]),
-        description="Rainfall_Export",
-        folder="EarthEngine",
-        fileNamePrefix=export_desc,
-        fileFormat="CSV"
-    )
-    task.start()
+    # Export to Google Drive, one task per spatial tile and time shard
+    export_tiled(build, grid_centers, export_desc, start, end, selectors=["Rainfall_mm"], description="Rainfall_Export")
     print(f"Rainfall export started. Check Earth Engine Tasks tab or your Google Drive ({export_desc}.csv) once completed.")
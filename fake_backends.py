@@ -0,0 +1,872 @@
+"""
+In-process fake Earth Engine and Google Drive backends for offline pipeline runs.
+
+Only the subset of the ``ee`` and pydrive APIs used by this project is
+implemented. Images are evaluated eagerly from deterministic synthetic fields,
+table exports are written as CSVs into a local "Drive" directory and Drive
+lookups are answered from that same directory, so the whole DAG in ``main.py``
+can run without credentials or network access.
+
+Usage:
+    python fake_backends.py --workdir offline_run
+
+or, from Python, call ``install(drive_root)`` before importing any pipeline
+module. Every API call is counted in ``calls``. Export tasks whose description
+contains one of the comma-separated patterns in ``UHI_FAKE_FAIL_TASKS`` fail
+on their first attempt, to exercise retries.
+"""
+import collections
+import csv
+import hashlib
+import itertools
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import types
+from datetime import datetime, timedelta, timezone
+
+calls = collections.Counter()
+
+DRIVE_ROOT = os.path.abspath("offline_drive")
+_failed_once = set()
+
+
+def _api(name):
+    """Decorator counting every call to a fake API method under ``name``."""
+    def wrap(fn):
+        def inner(*args, **kwargs):
+            calls[name] += 1
+            return fn(*args, **kwargs)
+        inner.__name__ = fn.__name__
+        inner.__doc__ = fn.__doc__
+        return inner
+    return wrap
+
+
+# ------------------------- Synthetic fields ----------------------------
+
+CITY_CENTER = (19.07, 72.88)  # (lat, lon) of the synthetic urban core
+
+
+def _noise(*key):
+    """Deterministic pseudo-random float in [0, 1) for the given key."""
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64
+
+
+def _is_sea(lat, lon):
+    """Rough Arabian Sea coastline west of Mumbai."""
+    return lon < 72.80 + 0.08 * (19.8 - lat)
+
+
+def _urban(lat, lon):
+    """Urban intensity in [0, 1], peaking at the city centre."""
+    d2 = (lat - CITY_CENTER[0]) ** 2 + (lon - CITY_CENTER[1]) ** 2
+    return math.exp(-d2 / 0.03)
+
+
+def _era5(band, day, lat, lon):
+    if _is_sea(lat, lon):
+        return None  # ERA5-Land is masked over the ocean
+    doy = day.timetuple().tm_yday
+    season = math.sin(2 * math.pi * (doy - 80) / 365)
+    monsoon = max(0.0, math.sin(2 * math.pi * (doy - 150) / 365))
+    jitter = _noise(band, day.toordinal(), round(lat, 4), round(lon, 4)) - 0.5
+    temp = 273.15 + 27 + 4 * season + 3 * _urban(lat, lon) - 2 * (lat - 18.8) + jitter
+    if band == "temperature_2m":
+        return temp
+    if band == "dewpoint_temperature_2m":
+        return temp - 9 + 6 * monsoon + jitter
+    if band == "total_precipitation_sum":
+        return max(0.0, monsoon * 0.04 * (jitter + 0.5) - 0.005)
+    if band == "u_component_of_wind_10m":
+        return 2 + 3 * monsoon + jitter
+    if band == "v_component_of_wind_10m":
+        return 1 - 2 * season + jitter
+    raise KeyError(band)
+
+
+def _modis_ndvi(day, lat, lon):
+    if _is_sea(lat, lon):
+        return None
+    doy = day.timetuple().tm_yday
+    monsoon = max(0.0, math.sin(2 * math.pi * (doy - 180) / 365))
+    jitter = _noise("NDVI", day.toordinal(), round(lat, 4), round(lon, 4))
+    ndvi = 0.15 + 0.45 * (1 - _urban(lat, lon)) + 0.2 * monsoon + 0.05 * jitter
+    return ndvi * 10000  # MOD13Q1 scale factor
+
+
+def _worldcover(lat, lon):
+    if _is_sea(lat, lon):
+        return 80  # permanent water bodies
+    if _noise("WorldCover", round(lat, 3), round(lon, 3)) < 0.9 * _urban(lat, lon):
+        return 50  # built-up
+    return 10  # tree cover
+
+
+DATASETS = {
+    "ECMWF/ERA5_LAND/DAILY_AGGR": {
+        "bands": ["temperature_2m", "dewpoint_temperature_2m", "total_precipitation_sum",
+                  "u_component_of_wind_10m", "v_component_of_wind_10m"],
+        "cadence": 1,
+        "id_format": "%Y%m%d",
+        "value": _era5,
+    },
+    "MODIS/061/MOD13Q1": {
+        "bands": ["NDVI"],
+        "cadence": 16,
+        "id_format": "%Y_%m_%d",
+        "value": lambda band, day, lat, lon: _modis_ndvi(day, lat, lon),
+    },
+}
+
+
+# ------------------------- Fake ee objects ----------------------------
+
+def _resolve(value):
+    """Unwrap fake computed objects into plain Python values."""
+    if isinstance(value, (Number, String)):
+        return value.value
+    if isinstance(value, dict):
+        return {k: _resolve(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_resolve(v) for v in value]
+    return value
+
+
+def _parse_date(value):
+    if isinstance(value, Date):
+        return value.dt
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000, tz=timezone.utc).replace(tzinfo=None)
+    return datetime.strptime(str(_resolve(value))[:10], "%Y-%m-%d")
+
+
+class Number:
+    def __init__(self, value):
+        self.value = _resolve(value)
+
+    def _op(self, other, fn):
+        a, b = self.value, _resolve(other)
+        return Number(None if a is None or b is None else fn(a, b))
+
+    def add(self, other):
+        return self._op(other, lambda a, b: a + b)
+
+    def subtract(self, other):
+        return self._op(other, lambda a, b: a - b)
+
+    def multiply(self, other):
+        return self._op(other, lambda a, b: a * b)
+
+    def divide(self, other):
+        return self._op(other, lambda a, b: a / b if b else None)
+
+    @_api("Number.getInfo")
+    def getInfo(self):
+        return self.value
+
+
+class String:
+    def __init__(self, value):
+        self.value = _resolve(value)
+
+    @_api("String.getInfo")
+    def getInfo(self):
+        return self.value
+
+
+class Date:
+    @_api("Date")
+    def __init__(self, value):
+        self.dt = _parse_date(value)
+
+    def format(self, pattern="YYYY-MM-dd'T'HH:mm:ss"):
+        py = pattern.replace("YYYY", "%Y").replace("MM", "%m").replace("dd", "%d") \
+            .replace("'T'", "T").replace("HH", "%H").replace("mm", "%M").replace("ss", "%S")
+        return String(self.dt.strftime(py))
+
+    def millis(self):
+        return Number(self.dt.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+class Dictionary:
+    def __init__(self, values=None):
+        self.values = dict(_resolve(values or {}))
+
+    def get(self, key, default=None):
+        return self.values.get(_resolve(key), default)
+
+    @_api("Dictionary.getInfo")
+    def getInfo(self):
+        return dict(self.values)
+
+
+class Algorithms:
+    @staticmethod
+    @_api("Algorithms.If")
+    def If(condition, true_case, false_case):
+        # Earth Engine treats null, 0 and NaN conditions as false.
+        cond = _resolve(condition)
+        if cond is None or cond is False or cond == 0 or (isinstance(cond, float) and math.isnan(cond)):
+            return false_case
+        return true_case
+
+
+class Reducer:
+    def __init__(self, name):
+        self.name = name
+
+    @staticmethod
+    def mean():
+        return Reducer("mean")
+
+    @staticmethod
+    def sum():
+        return Reducer("sum")
+
+
+class Geometry:
+    """Point or axis-aligned rectangle in lon/lat degrees."""
+
+    def __init__(self, kind, coords):
+        self.kind = kind
+        self.coords = [float(c) for c in coords]
+
+    @staticmethod
+    @_api("Geometry.Point")
+    def Point(coords, lat=None):
+        lon, lat = (coords, lat) if lat is not None else coords
+        return Geometry("Point", [lon, lat])
+
+    @staticmethod
+    @_api("Geometry.Rectangle")
+    def Rectangle(coords, *rest):
+        coords = list(coords) + list(rest) if rest else coords
+        return Geometry("Rectangle", coords)
+
+    @staticmethod
+    def BBox(west, south, east, north):
+        return Geometry.Rectangle([west, south, east, north])
+
+    def centroid(self):
+        if self.kind == "Point":
+            return self
+        x1, y1, x2, y2 = self.coords
+        return Geometry("Point", [(x1 + x2) / 2, (y1 + y2) / 2])
+
+    def area(self):
+        if self.kind == "Point":
+            return 0.0
+        x1, y1, x2, y2 = self.coords
+        lat = math.radians((y1 + y2) / 2)
+        return abs(y2 - y1) * 111320 * abs(x2 - x1) * 111320 * math.cos(lat)
+
+    def samples(self, n=4):
+        """Centres of an ``n`` x ``n`` sub-grid used to approximate region reductions."""
+        if self.kind == "Point":
+            return [(self.coords[1], self.coords[0])]
+        x1, y1, x2, y2 = self.coords
+        return [(y1 + (y2 - y1) * (i + 0.5) / n, x1 + (x2 - x1) * (j + 0.5) / n)
+                for i in range(n) for j in range(n)]
+
+    def toGeoJSON(self):
+        if self.kind == "Point":
+            return {"type": "Point", "coordinates": self.coords}
+        x1, y1, x2, y2 = self.coords
+        ring = [[x1, y1], [x2, y1], [x2, y2], [x1, y2], [x1, y1]]
+        return {"type": "Polygon", "coordinates": [ring]}
+
+
+class Image:
+    """Eager image: each band is a function ``(lat, lon) -> value or None``."""
+
+    def __init__(self, value=None, bands=None, props=None):
+        if bands is None:
+            bands = {} if value is None else {"constant": lambda lat, lon, v=value: v}
+        self.bands = dict(bands)
+        self.props = dict(props or {})
+
+    def _with(self, bands=None, props=None):
+        return Image(bands=self.bands if bands is None else bands,
+                     props=self.props if props is None else props)
+
+    def _map_bands(self, fn):
+        return self._with({name: (lambda lat, lon, f=f: _safe(fn, f(lat, lon)))
+                           for name, f in self.bands.items()})
+
+    def _binary(self, other, fn):
+        if isinstance(other, Image):
+            others = list(other.bands.values())
+            out = {}
+            for i, (name, f) in enumerate(self.bands.items()):
+                g = others[i] if len(others) > 1 else others[0]
+                out[name] = lambda lat, lon, f=f, g=g: _safe2(fn, f(lat, lon), g(lat, lon))
+            return self._with(out)
+        other = _resolve(other)
+        return self._map_bands(lambda a: fn(a, other))
+
+    @staticmethod
+    @_api("Image.pixelArea")
+    def pixelArea():
+        # Region sums multiply the mean value by the geometry area, so the
+        # per-pixel area density is 1 m^2 / m^2.
+        return Image(bands={"area": lambda lat, lon: 1.0})
+
+    @staticmethod
+    def constant(value):
+        return Image(value)
+
+    def add(self, other):
+        return self._binary(other, lambda a, b: a + b)
+
+    def subtract(self, other):
+        return self._binary(other, lambda a, b: a - b)
+
+    def multiply(self, other):
+        return self._binary(other, lambda a, b: a * b)
+
+    def divide(self, other):
+        return self._binary(other, lambda a, b: a / b if b else None)
+
+    def hypot(self, other):
+        return self._binary(other, math.hypot)
+
+    def atan2(self, other):
+        return self._binary(other, math.atan2)
+
+    def eq(self, value):
+        return self._binary(value, lambda a, b: 1 if a == b else 0)
+
+    def selfMask(self):
+        return self._map_bands(lambda a: a if a else None)
+
+    def expression(self, expression, mapping):
+        names = {k: list(v.bands.values())[0] for k, v in mapping.items()}
+        code = compile(expression, "<expression>", "eval")
+
+        def band(lat, lon):
+            env = {k: f(lat, lon) for k, f in names.items()}
+            if any(v is None for v in env.values()):
+                return None
+            return eval(code, {"exp": math.exp, "log": math.log, "sqrt": math.sqrt}, env)
+        return Image(bands={"constant": band}, props=self.props)
+
+    def select(self, names, *rest):
+        if isinstance(names, str):
+            names = [names] + list(rest)
+        return self._with({n: self.bands[n] for n in names})
+
+    def rename(self, *names):
+        names = names[0] if len(names) == 1 and isinstance(names[0], list) else names
+        return self._with(dict(zip(names, self.bands.values())))
+
+    def addBands(self, images):
+        images = images if isinstance(images, list) else [images]
+        bands = dict(self.bands)
+        for image in images:
+            bands.update(image.bands)
+        return self._with(bands)
+
+    def clip(self, geometry):
+        return self
+
+    def unmask(self, value=0):
+        return self._with({name: (lambda lat, lon, f=f: value if f(lat, lon) is None else f(lat, lon))
+                           for name, f in self.bands.items()})
+
+    def set(self, *args):
+        props = dict(self.props)
+        props.update(_resolve(args[0]) if len(args) == 1 else {args[0]: _resolve(args[1])})
+        return self._with(props=props)
+
+    def get(self, name):
+        return self.props.get(name)
+
+    def copyProperties(self, source, properties=None):
+        props = dict(self.props)
+        for key in properties or source.props:
+            props[key] = source.props.get(key)
+        return self._with(props=props)
+
+    def date(self):
+        return Date(self.props["system:time_start"])
+
+    def sample_at(self, lat, lon):
+        return {name: f(lat, lon) for name, f in self.bands.items()}
+
+    @_api("Image.reduceRegions")
+    def reduceRegions(self, collection, reducer, scale=None, tileScale=None, **kwargs):
+        out = []
+        for feature in collection.features:
+            values = _reduce(self, feature.geometry(), reducer)
+            if len(values) == 1:
+                values = {reducer.name: next(iter(values.values()))}
+            props = dict(feature.props)
+            props.update(values)
+            out.append(Feature(feature.geom, props, feature.id))
+        return FeatureCollection(out)
+
+    @_api("Image.reduceRegion")
+    def reduceRegion(self, reducer, geometry, scale=None, maxPixels=None, **kwargs):
+        return Dictionary(_reduce(self, geometry, reducer))
+
+    @_api("Image.getMapId")
+    def getMapId(self, vis_params=None):
+        return {"mapid": "offline", "tile_fetcher": None}
+
+
+def _safe(fn, a):
+    return None if a is None else fn(a)
+
+
+def _safe2(fn, a, b):
+    return None if a is None or b is None else fn(a, b)
+
+
+def _reduce(image, geometry, reducer):
+    """Approximate a region reduction by sampling the geometry."""
+    samples = geometry.samples()
+    values = {}
+    for name in image.bands:
+        vals = [v for v in (image.bands[name](lat, lon) for lat, lon in samples) if v is not None]
+        if not vals:
+            values[name] = None
+        elif reducer.name == "sum":
+            values[name] = sum(vals) / len(samples) * geometry.area()
+        else:
+            values[name] = sum(vals) / len(vals)
+    return values
+
+
+class ImageCollection:
+    """Eager image collection backed by the synthetic ``DATASETS``."""
+
+    @_api("ImageCollection")
+    def __init__(self, source):
+        if isinstance(source, str):
+            self.dataset_id = source
+            self.images = None  # materialised by filterDate / first
+        else:
+            self.dataset_id = None
+            self.images = list(source)
+
+    def _materialise(self, start, end):
+        if self.dataset_id == "ESA/WorldCover/v100":
+            props = {"system:time_start": 1577836800000, "system:index": "2020"}
+            return [Image(bands={"Map": _worldcover}, props=props)]
+        spec = DATASETS[self.dataset_id]
+        # Multi-day composites restart on fixed day-of-year offsets every year
+        days = [datetime(year, 1, 1) + timedelta(days=offset)
+                for year in range(start.year, end.year + 1)
+                for offset in range(0, 366, spec["cadence"])
+                if (datetime(year, 1, 1) + timedelta(days=offset)).year == year]
+        images = []
+        for day in days:
+            if not start <= day < end:
+                continue
+            ms = int(day.replace(tzinfo=timezone.utc).timestamp() * 1000)
+            props = {"system:time_start": ms, "system:index": day.strftime(spec["id_format"])}
+            bands = {b: (lambda lat, lon, b=b, d=day: spec["value"](b, d, lat, lon)) for b in spec["bands"]}
+            images.append(Image(bands=bands, props=props))
+        return images
+
+    def _list(self):
+        if self.images is None:
+            self.images = self._materialise(datetime(2020, 1, 1), datetime(2020, 1, 2))
+        return self.images
+
+    def filterDate(self, start, end=None):
+        start = _parse_date(start)
+        end = _parse_date(end) if end is not None else start + timedelta(days=1)
+        if self.images is None:
+            return ImageCollection(self._materialise(start, end))
+        return ImageCollection(i for i in self.images
+                               if start <= _parse_date(i.props["system:time_start"]) < end)
+
+    def select(self, names, *rest):
+        return ImageCollection(i.select(names, *rest) for i in self._list())
+
+    @_api("ImageCollection.map")
+    def map(self, fn):
+        out = []
+        for image in self._list():
+            result = fn(image)
+            if isinstance(result, FeatureCollection):
+                result.parent_index = image.props.get("system:index")
+            elif isinstance(result, Image) and "system:index" not in result.props:
+                result.props["system:index"] = image.props.get("system:index")
+            out.append(result)
+        return ImageCollection(out)
+
+    def flatten(self):
+        features = []
+        for fc in self._list():
+            for feature in fc.features:
+                features.append(Feature(feature.geom, feature.props, f"{fc.parent_index}_{feature.id}"))
+        return FeatureCollection(features)
+
+    def first(self):
+        return self._list()[0]
+
+    def _aggregate(self, fn):
+        images = self._list()
+        names = list(images[0].bands) if images else []
+
+        def band(name):
+            def f(lat, lon):
+                vals = [v for v in (i.bands[name](lat, lon) for i in images) if v is not None]
+                return fn(vals) if vals else None
+            return f
+        return Image(bands={n: band(n) for n in names})
+
+    def mean(self):
+        return self._aggregate(lambda v: sum(v) / len(v))
+
+    def sum(self):
+        return self._aggregate(sum)
+
+    def size(self):
+        return Number(len(self._list()))
+
+
+class Feature:
+    @_api("Feature")
+    def __init__(self, geom, props=None, feature_id=None):
+        self.geom = geom
+        self.props = _resolve(dict(props or {}))
+        self.id = feature_id
+
+    def set(self, *args):
+        props = dict(self.props)
+        props.update(_resolve(args[0]) if len(args) == 1 else {args[0]: _resolve(args[1])})
+        return Feature(self.geom, props, self.id)
+
+    def get(self, name):
+        return self.props.get(_resolve(name))
+
+    def geometry(self):
+        return self.geom
+
+
+class FeatureCollection:
+    @_api("FeatureCollection")
+    def __init__(self, features):
+        if isinstance(features, FeatureCollection):
+            features = features.features
+        self.features = [f if f.id is not None else Feature(f.geom, f.props, str(i))
+                         for i, f in enumerate(features)]
+        self.parent_index = None
+
+    @_api("FeatureCollection.map")
+    def map(self, fn):
+        return FeatureCollection([fn(f) for f in self.features])
+
+    def select(self, properties):
+        return FeatureCollection([Feature(f.geom, {k: f.props.get(k) for k in properties}, f.id)
+                                  for f in self.features])
+
+    def style(self, **kwargs):
+        return self
+
+    def size(self):
+        return Number(len(self.features))
+
+    @_api("FeatureCollection.getInfo")
+    def getInfo(self):
+        return {
+            "type": "FeatureCollection",
+            "features": [{"type": "Feature", "id": f.id, "geometry": f.geom.toGeoJSON(),
+                          "properties": _resolve(f.props)} for f in self.features],
+        }
+
+
+class Task:
+    _ids = itertools.count(1)
+
+    def __init__(self, description, write):
+        self.description = description
+        self._write = write
+        self.state = "UNSUBMITTED"
+        self.id = f"FAKE{next(Task._ids):08d}"
+        self.error_message = None
+
+    def _should_fail(self):
+        patterns = [p for p in os.environ.get("UHI_FAKE_FAIL_TASKS", "").split(",") if p]
+        if self.description in _failed_once or not any(p in self.description for p in patterns):
+            return False
+        _failed_once.add(self.description)
+        return True
+
+    @_api("Task.start")
+    def start(self):
+        self.state = "RUNNING"
+        if self._should_fail():
+            self.state = "FAILED"
+            self.error_message = "Computation timed out. (injected)"
+            return
+        self._write()
+        self.state = "COMPLETED"
+
+    @_api("Task.status")
+    def status(self):
+        status = {"state": self.state, "description": self.description, "id": self.id}
+        if self.error_message:
+            status["error_message"] = self.error_message
+        return status
+
+    def active(self):
+        return self.state in ("READY", "RUNNING")
+
+
+class _TableExport:
+    @staticmethod
+    @_api("Export.table.toDrive")
+    def toDrive(collection, description="myExportTableTask", folder=None,
+                fileNamePrefix=None, fileFormat="CSV", **kwargs):
+        path = os.path.join(DRIVE_ROOT, folder or "", f"{fileNamePrefix or description}.csv")
+
+        def write():
+            _write_table(collection, path)
+        return Task(description, write)
+
+
+@_api("data.computePixels")
+def _compute_pixels(params):
+    """Sample an image at the pixel centers of an EPSG:4326 grid, as a structured array."""
+    import numpy as np
+
+    image = params['expression']
+    grid = params['grid']
+    width, height = grid['dimensions']['width'], grid['dimensions']['height']
+    t = grid['affineTransform']
+    bands = params.get('bandIds') or list(image.bands)
+    out = np.zeros((height, width), dtype=[(b, 'f8') for b in bands])
+    for r in range(height):
+        lat = t['translateY'] + (r + 0.5) * t['scaleY']
+        for c in range(width):
+            lon = t['translateX'] + (c + 0.5) * t['scaleX']
+            for b in bands:
+                value = image.bands[b](lat, lon)
+                out[b][r, c] = np.nan if value is None else value
+    return out
+
+
+def _write_table(collection, path):
+    columns = []
+    for feature in collection.features:
+        for key in feature.props:
+            if key not in columns:
+                columns.append(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", newline="") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(["system:index"] + columns + [".geo"])
+        for f in collection.features:
+            row = [f.props.get(c) for c in columns]
+            geo = json.dumps(f.geom.toGeoJSON(), separators=(",", ":"))
+            writer.writerow([f.id] + ["" if v is None else v for v in row] + [geo])
+
+
+def _build_ee_module():
+    ee = types.ModuleType("ee")
+    ee.__doc__ = "Offline fake of the Earth Engine Python API (see fake_backends.py)."
+    ee.Authenticate = _api("Authenticate")(lambda *a, **k: True)
+    ee.Initialize = _api("Initialize")(lambda *a, **k: None)
+    for cls in (Number, String, Date, Dictionary, Algorithms, Reducer, Geometry,
+                Image, ImageCollection, Feature, FeatureCollection):
+        setattr(ee, cls.__name__, cls)
+    ee.data = types.SimpleNamespace(computePixels=_compute_pixels)
+    ee.batch = types.SimpleNamespace(
+        Export=types.SimpleNamespace(table=_TableExport),
+        Task=Task,
+    )
+    return ee
+
+
+# ------------------------- Fake Google Drive ----------------------------
+
+FOLDER_MIME = "application/vnd.google-apps.folder"
+
+
+def _md5(path):
+    h = hashlib.md5()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class DriveFile(dict):
+    """Drive file metadata plus the content methods used by the pipeline."""
+
+    def __init__(self, drive, metadata):
+        super().__init__(metadata)
+        self.drive = drive
+        self.content_path = None
+
+    def _path(self):
+        return os.path.join(self.drive.root, self["id"])
+
+    @_api("DriveFile.GetContentFile")
+    def GetContentFile(self, filename):
+        shutil.copyfile(self._path(), filename)
+
+    def SetContentFile(self, filename):
+        self.content_path = filename
+
+    @_api("DriveFile.Upload")
+    def Upload(self, param=None):
+        if "id" not in self:
+            parents = self.get("parents") or [{"id": ""}]
+            self["id"] = os.path.join(parents[0]["id"], self["title"])
+        os.makedirs(os.path.dirname(self._path()), exist_ok=True)
+        if self.content_path is not None:
+            shutil.copyfile(self.content_path, self._path())
+        self.update(self.drive._metadata(self["id"]))
+
+
+class _FileList:
+    def __init__(self, drive, query):
+        self.drive = drive
+        self.query = query
+
+    @_api("ListFile.GetList")
+    def GetList(self):
+        return [DriveFile(self.drive, m) for m in self.drive._query(self.query)]
+
+
+class GoogleAuth:
+    @_api("GoogleAuth")
+    def __init__(self, *args, **kwargs):
+        pass
+
+    @_api("GoogleAuth.LocalWebserverAuth")
+    def LocalWebserverAuth(self, *args, **kwargs):
+        pass
+
+
+class GoogleDrive:
+    """Drive view over a local directory; file ids are paths relative to it."""
+
+    def __init__(self, auth=None, root=None):
+        self.root = root or DRIVE_ROOT
+        os.makedirs(self.root, exist_ok=True)
+
+    def _metadata(self, file_id):
+        path = os.path.join(self.root, file_id)
+        meta = {"id": file_id, "title": os.path.basename(file_id), "labels": {"trashed": False},
+                "modifiedDate": datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc)
+                .strftime("%Y-%m-%dT%H:%M:%S.%fZ")}
+        if os.path.isdir(path):
+            meta["mimeType"] = FOLDER_MIME
+        else:
+            meta.update(mimeType="text/csv", md5Checksum=_md5(path), fileSize=str(os.path.getsize(path)))
+        return meta
+
+    def _query(self, query):
+        clauses = [c.strip() for c in re.split(r"\band\b", query) if c.strip()]
+        results = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for name in sorted(dirnames) + sorted(filenames):
+                file_id = os.path.relpath(os.path.join(dirpath, name), self.root)
+                meta = self._metadata(file_id)
+                if all(self._match(meta, c) for c in clauses):
+                    results.append(meta)
+        return results
+
+    @staticmethod
+    def _match(meta, clause):
+        m = re.fullmatch(r"(\w+)\s*(=|contains)\s*'(.*)'", clause)
+        if m:
+            field, op, value = m.groups()
+            actual = str(meta.get(field, ""))
+            if field == "title":
+                # Drive title matching is case-insensitive
+                actual, value = actual.lower(), value.lower()
+            return actual == value if op == "=" else value in actual
+        m = re.fullmatch(r"'(.*)' in parents", clause)
+        if m:
+            return os.path.dirname(meta["id"]) == m.group(1)
+        if clause == "trashed=false":
+            return True
+        raise ValueError(f"Unsupported Drive query clause: {clause}")
+
+    def ListFile(self, param=None):
+        return _FileList(self, (param or {}).get("q", ""))
+
+    @_api("GoogleDrive.CreateFile")
+    def CreateFile(self, metadata=None):
+        metadata = dict(metadata or {})
+        if "id" in metadata and os.path.exists(os.path.join(self.root, metadata["id"])):
+            metadata = {**self._metadata(metadata["id"]), **metadata}
+        return DriveFile(self, metadata)
+
+
+def _build_pydrive_modules():
+    pydrive = types.ModuleType("pydrive")
+    auth = types.ModuleType("pydrive.auth")
+    drive = types.ModuleType("pydrive.drive")
+    auth.GoogleAuth = GoogleAuth
+    drive.GoogleDrive = GoogleDrive
+    pydrive.auth, pydrive.drive = auth, drive
+    return {"pydrive": pydrive, "pydrive.auth": auth, "pydrive.drive": drive}
+
+
+# ------------------------- Installation ----------------------------
+
+def install(drive_root=None):
+    """
+    Register the fake ``ee`` and ``pydrive`` modules in ``sys.modules``.
+
+    :param drive_root: Local directory standing in for Google Drive
+    :return: The fake ``ee`` module
+    """
+    global DRIVE_ROOT
+    if drive_root:
+        DRIVE_ROOT = os.path.abspath(drive_root)
+    os.makedirs(os.path.join(DRIVE_ROOT, "EarthEngine"), exist_ok=True)
+    ee = _build_ee_module()
+    sys.modules["ee"] = ee
+    sys.modules.update(_build_pydrive_modules())
+    os.environ["UHI_OFFLINE"] = "1"
+    return ee
+
+
+def run_offline(workdir="offline_run", main_args=()):
+    """
+    Run ``main.py`` end to end against the fake backends inside ``workdir``.
+
+    :param workdir: Scratch directory for local CSVs; Drive lives in ``workdir/drive``
+    :param main_args: Command-line arguments for main.py (e.g. ``["--stage", "clustering_kmeans"]``)
+    :return: Counter of API calls issued
+    """
+    import runpy
+
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    workdir = os.path.abspath(workdir)
+    os.makedirs(workdir, exist_ok=True)
+    install(os.path.join(workdir, "drive"))
+    sys.path.insert(0, os.path.dirname(main_path))
+    os.chdir(workdir)
+    calls.clear()
+    sys.argv = [main_path, *main_args]
+    runpy.run_path(main_path, run_name="__main__")
+    return calls
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the UHI pipeline offline against fake EE/Drive backends.")
+    parser.add_argument("--workdir", default="offline_run")
+    args, main_args = parser.parse_known_args()
+
+    counts = run_offline(args.workdir, main_args)
+    print(json.dumps(dict(sorted(counts.items())), indent=2))
+    print(f"Total fake API calls: {sum(counts.values())}")
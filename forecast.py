@@ -0,0 +1,321 @@
+"""
+Next-7-day LST and UHI-class outlook for every cell.
+
+All cells are fitted at once. Each region's long table is reshaped into dense
+(days, cells) stacks on a complete daily calendar, and every cell gets its own
+linear model per horizon ``h`` (direct multi-step forecasting)::
+
+    LST[t+h] = a + sum_l phi_l LST[t-l] + sum_v beta_v weather_v[t]
+               + sum_k (c_k sin + d_k cos)(2 pi k doy[t+h] / 365.25)
+
+Covariates are observed at the forecast origin ``t``, so no weather forecast
+is needed. The least-squares problems of all cells are solved together. Their
+normal equations ``(X'X + ridge I) b = X'y`` are built with one batched
+matrix product per chunk of cells and solved with one batched
+``np.linalg.solve``. Missing targets get zero weight and missing inputs are
+forward-filled.
+
+Forecast LST is classified with the persisted cluster model
+(``cluster_model.json`` from ``clustering_kmeans``). The other features are
+held at their latest observed values.
+
+Usage:
+    python forecast.py                       # write UHI_Forecast.csv
+    python forecast.py --backtest            # rolling-origin backtest
+    python forecast.py --benchmark --scale 100
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from cadence import read_dataset
+from clustering import CLUSTER_MODEL_PATH, classify, load_cluster_model
+from instrumentation import instrumented, stage
+from pyramid import to_stack
+from regions import CELL_ID_STRIDE, cell_id_from_index, get_region, load_config, region_axes
+
+FORECAST_PATH = "UHI_Forecast.csv"
+HORIZON = 7
+LAGS = 3
+HARMONICS = 2
+WEATHER_COLUMNS = ['Air_Temperature_C', 'Relative_Humidity_%', 'WindSpeed', 'Rainfall_mm']
+CHUNK_BYTES = 128 * 2 ** 20
+
+
+def daily_stacks(df, region, columns):
+    """
+    Dense (days, cells) float32 stacks of a region on a gap-free daily calendar.
+
+    :return: (calendar as datetime64[D] array, {column: stack})
+    """
+    dates, stacks = to_stack(df, region, columns)
+    dates = np.asarray(dates).astype('datetime64[D]')
+    calendar = np.arange(dates[0], dates[-1] + 1)
+    position = (dates - calendar[0]).astype(np.int64)
+    out = {}
+    for column, stack in stacks.items():
+        full = np.full((len(calendar), stack[0].size), np.nan, dtype=np.float32)
+        full[position] = stack.reshape(len(dates), -1)
+        out[column] = full
+    # Rainfall is exported as -999 on dry days (null mean), i.e. no rain
+    if 'Rainfall_mm' in out:
+        out['Rainfall_mm'] = np.nan_to_num(out['Rainfall_mm'])
+    return calendar, out
+
+
+def fill_forward(stack):
+    """Forward-fill NaN along time; leading gaps take the cell mean (0 for empty cells)."""
+    days = np.arange(len(stack))[:, None]
+    last = np.maximum.accumulate(np.where(np.isnan(stack), 0, days), axis=0)
+    filled = np.take_along_axis(stack, last, axis=0)
+    count = (~np.isnan(stack)).sum(axis=0)
+    means = np.nansum(stack, axis=0) / np.maximum(count, 1)
+    return np.where(np.isnan(filled), means, filled)
+
+
+def _season(calendar):
+    """(days, 2 * HARMONICS) sine/cosine of the day of year."""
+    doy = (calendar - calendar.astype('datetime64[Y]')).astype(np.int64) + 1
+    angle = 2 * np.pi * doy[:, None] * np.arange(1, HARMONICS + 1)[None, :] / 365.25
+    return np.concatenate([np.sin(angle), np.cos(angle)], axis=1)
+
+
+class Inputs:
+    """Standardised, gap-filled model inputs of one region, stored cell-major so time windows are contiguous."""
+
+    def __init__(self, calendar, stacks, lags=LAGS, weather=WEATHER_COLUMNS):
+        self.calendar = calendar
+        self.lags = lags
+        self.target = stacks['LST_Celsius']
+        lst = fill_forward(self.target)
+        self.lst_mean, self.lst_std = float(lst.mean()), float(lst.std()) or 1.0
+        series = [(lst - self.lst_mean) / self.lst_std]
+        for column in weather:
+            values = fill_forward(stacks[column])
+            series.append((values - values.mean()) / (values.std() or 1.0))
+        # (cells, 1 + weather, days)
+        self.series = np.ascontiguousarray(np.stack(series, axis=-1).transpose(1, 2, 0), dtype=np.float32)
+        self.scaled_target = np.ascontiguousarray(((self.target - self.lst_mean) / self.lst_std).T)
+        self.season = np.ascontiguousarray(_season(np.arange(calendar[0], calendar[-1] + HORIZON + 1)).T,
+                                           dtype=np.float32)
+        self.cells = self.target.shape[1]
+        self.width = 1 + lags + len(weather) + self.season.shape[0]
+
+    def design(self, first, stop, horizon, cells):
+        """
+        (cells, width, origins) float32 design matrices, transposed, for forecasts made
+        at origins ``first..stop-1`` for ``horizon`` days ahead.
+
+        :param cells: Slice of cells
+        """
+        block = self.series[cells]
+        x = np.empty((block.shape[0], self.width, stop - first), dtype=np.float32)
+        x[:, 0] = 1
+        for lag in range(self.lags):
+            x[:, 1 + lag] = block[:, 0, first - lag:stop - lag]
+        n_weather = block.shape[1] - 1
+        x[:, 1 + self.lags:1 + self.lags + n_weather] = block[:, 1:, first:stop]
+        x[:, 1 + self.lags + n_weather:] = self.season[:, first + horizon:stop + horizon]
+        return x
+
+
+def _chunks(inputs, n_origins):
+    size = max(1, CHUNK_BYTES // max(1, n_origins * inputs.width * 4))
+    for start in range(0, inputs.cells, size):
+        yield slice(start, min(start + size, inputs.cells))
+
+
+def fit(inputs, train_end=None, horizon=HORIZON, ridge=1.0):
+    """
+    Fit every cell's model for horizons 1..``horizon`` in batches.
+
+    :param train_end: Index of the last day whose value may be used (default: last day)
+    :return: (horizon, cells, width) coefficients on the standardised scale
+    """
+    train_end = len(inputs.calendar) - 1 if train_end is None else train_end
+    penalty = ridge * np.eye(inputs.width)
+    penalty[0, 0] = 1e-6  # barely penalise the intercept
+    coef = np.zeros((horizon, inputs.cells, inputs.width))
+    first = inputs.lags - 1
+    for h in range(1, horizon + 1):
+        stop = train_end - h + 1
+        for cells in _chunks(inputs, stop - first):
+            xt = inputs.design(first, stop, h, cells)
+            y = inputs.scaled_target[cells, first + h:stop + h]
+            weight = ~np.isnan(y)
+            # Rows with a missing target are zeroed: X'WX = (WX)'(WX) for 0/1 weights
+            xt *= weight[:, None, :]
+            lhs = np.matmul(xt, xt.transpose(0, 2, 1)).astype(np.float64) + penalty
+            rhs = np.matmul(xt, np.where(weight, y, 0)[..., None].astype(np.float32)).astype(np.float64)
+            coef[h - 1, cells] = np.linalg.solve(lhs, rhs)[..., 0]
+    return coef
+
+
+def predict(inputs, coef, origin=None):
+    """(horizon, cells) LST forecasts (°C) from the day at index ``origin`` (default: last day)."""
+    origin = len(inputs.calendar) - 1 if origin is None else origin
+    out = np.empty(coef.shape[:2])
+    for h in range(1, len(coef) + 1):
+        x = inputs.design(origin, origin + 1, h, slice(None))[..., 0]
+        out[h - 1] = (x * coef[h - 1]).sum(axis=1)
+    return out * inputs.lst_std + inputs.lst_mean
+
+
+def _classify_stack(model, stacks, day, lst):
+    """Cluster labels of every cell on ``day`` with LST replaced by ``lst``."""
+    features = {c: fill_forward(stacks[c][:day + 1])[-1] for c in model["columns"]}
+    features['LST_Celsius'] = lst
+    return classify(features, model)
+
+
+def region_forecast(df, region, model, horizon=HORIZON):
+    """Forecast table of one region: one row per cell and horizon day."""
+    columns = sorted(set(model["columns"]) | set(WEATHER_COLUMNS))
+    calendar, stacks = daily_stacks(df, region, columns)
+    inputs = Inputs(calendar, stacks)
+    forecast = predict(inputs, fit(inputs, horizon=horizon))
+
+    observed = ~np.isnan(inputs.target).all(axis=0)
+    lat_values, lon_values, _ = region_axes(region)
+    cols = len(lon_values)
+    grid_number = np.flatnonzero(observed)
+    tables = []
+    for h in range(1, horizon + 1):
+        cluster, label = _classify_stack(model, stacks, len(calendar) - 1, forecast[h - 1])
+        tables.append(pd.DataFrame({
+            'Date': str(calendar[-1] + h),
+            'horizon': h,
+            'cell_id': region['id'] * CELL_ID_STRIDE + grid_number,
+            'Latitude': lat_values[grid_number // cols] + region['lat_step'] / 2,
+            'Longitude': lon_values[grid_number % cols] + region['lon_step'] / 2,
+            'Region': region['name'],
+            'LST_forecast': forecast[h - 1, observed].round(3),
+            'Cluster': cluster[observed],
+            'UHI_Label': label[observed],
+        }))
+    return pd.concat(tables, ignore_index=True)
+
+
+def _regions(df):
+    if 'cell_id' not in df.columns:
+        df = df.assign(cell_id=cell_id_from_index(df['system:index'].astype(str)))
+    if 'Region' not in df.columns:
+        df = df.assign(Region=load_config()['default'])
+    for name, region_df in df.groupby('Region'):
+        yield get_region(name), region_df
+
+
+@instrumented("forecast_uhi", inputs=["Final_Merged_Dataset_with_UHI_Labels.csv", CLUSTER_MODEL_PATH],
+              outputs=[FORECAST_PATH])
+def forecast_uhi(source="Final_Merged_Dataset_with_UHI_Labels.csv", output=FORECAST_PATH, horizon=HORIZON):
+    """
+    Write the next ``horizon`` days of LST and UHI class for every cell.
+
+    :return: The forecast table
+    """
+    model = load_cluster_model()
+    df = read_dataset(source)
+    tables = []
+    for region, region_df in _regions(df):
+        with stage(f"forecast_uhi.{region['name']}") as rec:
+            tables.append(region_forecast(region_df, region, model, horizon))
+            rec["rows_in"], rec["rows_out"] = len(region_df), len(tables[-1])
+    result = pd.concat(tables, ignore_index=True)
+    result.to_csv(output, index=False)
+    print(f"Forecast {horizon} days for {result['cell_id'].nunique()} cells saved to {output}")
+    return result
+
+
+def backtest(df, region, model=None, origins=8, step=7, horizon=HORIZON):
+    """
+    Rolling-origin backtest: refit at each origin on earlier data only, forecast, compare.
+
+    :param origins: Number of forecast origins, ``step`` days apart, ending ``horizon`` days before the last day
+    :return: Per-horizon MAE of the model and of persistence, and UHI class hit rate when a model is given
+    """
+    columns = sorted(set(model["columns"] if model else []) | set(WEATHER_COLUMNS) | {'LST_Celsius'})
+    calendar, stacks = daily_stacks(df, region, columns)
+    inputs = Inputs(calendar, stacks)
+    last_value = fill_forward(inputs.target)
+    rows = []
+    for origin in range(len(calendar) - 1 - horizon - step * (origins - 1), len(calendar) - horizon, step):
+        forecast = predict(inputs, fit(inputs, train_end=origin, horizon=horizon), origin)
+        for h in range(1, horizon + 1):
+            actual = inputs.target[origin + h]
+            valid = ~np.isnan(actual)
+            row = {'origin': str(calendar[origin]), 'horizon': h, 'cells': int(valid.sum()),
+                   'mae': np.abs(forecast[h - 1] - actual)[valid].mean(),
+                   'mae_persistence': np.abs(last_value[origin] - actual)[valid].mean()}
+            if model:
+                _, predicted = _classify_stack(model, stacks, origin, forecast[h - 1])
+                _, observed = _classify_stack(model, stacks, origin + h, actual)
+                row['class_hit_rate'] = (predicted == observed)[valid].mean()
+            rows.append(row)
+    result = pd.DataFrame(rows)
+    return result.groupby('horizon').mean(numeric_only=True).drop(columns='cells')
+
+
+def synthetic_region(cells, days=365, seed=0):
+    """(calendar, stacks) of ``cells`` synthetic cells with seasonal, autocorrelated LST and weather."""
+    rng = np.random.default_rng(seed)
+    calendar = np.arange(np.datetime64('2025-01-01'), np.datetime64('2025-01-01') + days)
+    season = np.sin(2 * np.pi * np.arange(days) / 365.25)[:, None].astype(np.float32)
+    noise = rng.normal(0, 1, (days, cells)).astype(np.float32)
+    for t in range(1, days):
+        noise[t] += 0.7 * noise[t - 1]
+    lst = 30 + 4 * season + rng.normal(0, 2, cells).astype(np.float32) + noise
+    lst[rng.random(lst.shape) < 0.1] = np.nan
+    stacks = {'LST_Celsius': lst, 'Air_Temperature_C': lst - 2,
+              'Relative_Humidity_%': 70 - 10 * season + rng.normal(0, 5, (days, cells)).astype(np.float32),
+              'WindSpeed': rng.gamma(2, 1.5, (days, cells)).astype(np.float32),
+              'Rainfall_mm': rng.exponential(3, (days, cells)).astype(np.float32)}
+    return calendar, stacks
+
+
+def benchmark(scale=100, base_cells=440, days=365, loop_sample=200):
+    """Time the batched fit at ``scale`` x the base grid against a per-cell lstsq loop (extrapolated)."""
+    cells = base_cells * scale
+    calendar, stacks = synthetic_region(cells, days)
+    started = time.perf_counter()
+    inputs = Inputs(calendar, stacks)
+    coef = fit(inputs)
+    predict(inputs, coef)
+    batched = time.perf_counter() - started
+
+    started = time.perf_counter()
+    first = inputs.lags - 1
+    for cell in range(loop_sample):
+        for h in range(1, HORIZON + 1):
+            stop = len(calendar) - h
+            x = inputs.design(first, stop, h, slice(cell, cell + 1))[0].T
+            y = inputs.scaled_target[cell, first + h:stop + h]
+            valid = ~np.isnan(y)
+            np.linalg.lstsq(x[valid], y[valid], rcond=None)
+    loop = (time.perf_counter() - started) / loop_sample * cells
+    print(f"{cells} cells x {days} days, {HORIZON} horizons: batched fit + forecast {batched:.1f} s, "
+          f"per-cell loop ~{loop:.0f} s (extrapolated from {loop_sample} cells)")
+    return batched, loop
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Batched per-cell LST / UHI class forecasts")
+    parser.add_argument("--data", default="Final_Merged_Dataset_with_UHI_Labels.csv")
+    parser.add_argument("--output", default=FORECAST_PATH)
+    parser.add_argument("--backtest", action="store_true")
+    parser.add_argument("--origins", type=int, default=8)
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--scale", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.scale)
+    elif args.backtest:
+        cluster_model = load_cluster_model()
+        for reg, reg_df in _regions(read_dataset(args.data)):
+            print(f"Backtest {reg['name']} ({args.origins} origins):")
+            print(backtest(reg_df, reg, cluster_model, args.origins).round(3).to_string())
+    else:
+        forecast_uhi(args.data, args.output)
@@ -1,19 +1,33 @@
 import numpy as np
 
-def generate_grid(bottom_left, top_right):
+LAT_KM_PER_DEG = 111  # 1° latitude ≈ 111 km
+LON_KM_PER_DEG = 102  # 1° longitude ≈ 102 km at ~19°N
+
+
+def grid_steps(cell_km=5, lon_km_per_deg=LON_KM_PER_DEG):
+    """
+    Cell size in degrees for square cells of ``cell_km`` kilometres.
+
+    :return: (lat_step, lon_step) tuple
+    """
+    return cell_km / LAT_KM_PER_DEG, cell_km / lon_km_per_deg
+
+
+def generate_grid(bottom_left, top_right, cell_km=5, lon_km_per_deg=LON_KM_PER_DEG):
     """
     Generate a 2D array of grid center points for the study area.
 
     :param bottom_left: (lat_min, lon_min) tuple
     :param top_right: (lat_max, lon_max) tuple
+    :param cell_km: Cell size in kilometres
+    :param lon_km_per_deg: Kilometres per degree of longitude at the study latitude
     :return: NumPy 2D array of grid center points [(lat, lon), ...]
     """
-    
+
     lat_min, lon_min = bottom_left
     lat_max, lon_max = top_right
 
-    lat_step = 5 / 111  # 1° latitude ≈ 111 km
-    lon_step = 5 / 102  # 1° longitude ≈ 102 km at ~19°N
+    lat_step, lon_step = grid_steps(cell_km, lon_km_per_deg)
 
     lat_values = np.arange(lat_min, lat_max, lat_step)
     lon_values = np.arange(lon_min, lon_max, lon_step)
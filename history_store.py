@@ -0,0 +1,372 @@
+"""
+Embedded SQLite store of every labelled cell-day, for per-cell histories in the apps.
+
+The pipeline keeps only a one-year window in ``Final_Merged_Dataset_with_UHI_Labels.csv``;
+scanning it on every click is far too slow for the apps. ``load_history``
+upserts each new version of that file into ``uhi_history.sqlite``, so the
+store accumulates the history of every run:
+
+- ``daily``: one row per (cell_id, date), a ``WITHOUT ROWID`` table clustered
+  on that primary key, so a cell's history is one contiguous range;
+- ``daily_date``: index on (date, cell_id, uhi_label) for whole-day and
+  label-frequency queries;
+- ``label_months``: days per (cell, month, label), refreshed for the months a
+  load touches, so label frequencies over long ranges read whole months from
+  it and only the partial months at either end from ``daily``;
+- ``cells``: region and centre of every cell;
+- ``sources``: the file versions already loaded (an unchanged file is skipped).
+
+-999 placeholders are stored as NULL. Region filters are cell-id ranges
+(``regions.CELL_ID_STRIDE``), so they need no join.
+
+Query API (``HistoryStore``): ``cell_history``, ``compare_cells``,
+``label_frequencies``, ``day`` and ``dates``. Each returns a DataFrame with the
+dataset's column names.
+
+Usage:
+    python history_store.py                          # load the labelled dataset
+    python history_store.py --bench --years 5        # query timings on a 5-year copy of it
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from cadence import layers_version, read_dataset
+from instrumentation import instrumented, stage
+from land_mask import keep_active
+from regions import CELL_ID_STRIDE, cell_id_from_index, load_config
+from shared_data import dataset_version
+
+STORE_PATH = "uhi_history.sqlite"
+DATA_PATH = "Final_Merged_Dataset_with_UHI_Labels.csv"
+# Dataset column -> store column
+COLUMNS = {
+    'LST_Celsius': 'lst',
+    'NDVI': 'ndvi',
+    'Air_Temperature_C': 'air_temperature',
+    'Dew_Point_Temperature_C': 'dew_point',
+    'Relative_Humidity_%': 'humidity',
+    'WindDirection': 'wind_direction',
+    'WindSpeed': 'wind_speed',
+    'Rainfall_mm': 'rainfall',
+    'impervious_percentage': 'isa',
+    'Cluster': 'cluster',
+    'UHI_Label': 'uhi_label',
+}
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS daily (
+    cell_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    {", ".join(f"{c} {'TEXT' if c == 'uhi_label' else 'INTEGER' if c == 'cluster' else 'REAL'}" for c in COLUMNS.values())},
+    PRIMARY KEY (cell_id, date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS daily_date ON daily (date, cell_id, uhi_label);
+CREATE TABLE IF NOT EXISTS label_months (
+    cell_id INTEGER NOT NULL,
+    month TEXT NOT NULL,
+    uhi_label TEXT NOT NULL,
+    days INTEGER,
+    PRIMARY KEY (cell_id, month, uhi_label)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS label_months_month ON label_months (month, cell_id, uhi_label, days);
+CREATE TABLE IF NOT EXISTS cells (
+    cell_id INTEGER PRIMARY KEY,
+    region TEXT,
+    latitude REAL,
+    longitude REAL
+);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    version TEXT,
+    rows INTEGER,
+    first_date TEXT,
+    last_date TEXT,
+    loaded_at TEXT
+);
+"""
+
+
+def _region_range(region):
+    """Inclusive cell-id range of a region from regions.json."""
+    region_id = load_config()["regions"][region]["id"]
+    return region_id * CELL_ID_STRIDE, (region_id + 1) * CELL_ID_STRIDE - 1
+
+
+def _next_month(month):
+    year, number = int(month[:4]), int(month[5:7])
+    return f"{year + number // 12}-{number % 12 + 1:02d}"
+
+
+def _previous_month(month):
+    year, number = int(month[:4]), int(month[5:7])
+    return f"{year - (number == 1)}-{(number - 2) % 12 + 1:02d}"
+
+
+def _month_end(month):
+    return pd.Period(month, freq='M').end_time.strftime('%Y-%m-%d')
+
+
+def _next_day(date):
+    return (pd.Timestamp(date) + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+
+
+def _previous_day(date):
+    return (pd.Timestamp(date) - pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+
+
+class HistoryStore:
+    """
+    Per-cell history queries over ``uhi_history.sqlite``.
+
+    Every thread gets its own connection (Streamlit runs sessions on several
+    threads); the apps only read, while ``load`` writes in one transaction.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")  # readers are not blocked by a load
+        return conn
+
+    def query(self, sql, params=()):
+        return pd.read_sql_query(sql, self.connection(), params=list(params))
+
+    # ------------------------------ loading ------------------------------
+
+    def is_loaded(self, source, version):
+        """Whether this version of ``source`` has already been loaded."""
+        known = self.connection().execute("SELECT version FROM sources WHERE path = ?",
+                                          (os.path.abspath(source),)).fetchone()
+        return bool(known) and known[0] == version
+
+    def load(self, df, source=None, version=None):
+        """
+        Upsert labelled rows; rows of other dates stay, so the store grows run after run.
+
+        :param df: Labelled dataset rows (``system:index`` or ``cell_id``, Date, ``COLUMNS``)
+        :param source: File the rows came from; with ``version`` an unchanged file is skipped
+        :return: Number of rows written (0 when skipped)
+        """
+        conn = self.connection()
+        if source is not None and self.is_loaded(source, version):
+            return 0
+        cell_ids = df['cell_id'].to_numpy(np.int64) if 'cell_id' in df.columns \
+            else cell_id_from_index(df['system:index'].astype(str))
+        values = {'cell_id': cell_ids, 'date': df['Date'].astype(str).str[:10].to_numpy()}
+        for column, name in COLUMNS.items():
+            if column not in df.columns:
+                values[name] = np.full(len(df), None)
+            elif name == 'uhi_label':
+                values[name] = df[column].astype(object).where(df[column].notna(), None).to_numpy()
+            else:
+                data = df[column].to_numpy(np.float64)
+                data = np.where(data == -999, np.nan, data)
+                values[name] = pd.Series(data).astype(object).where(~np.isnan(data), None).to_numpy()
+                if name == 'cluster':
+                    values[name] = [None if v is None else int(v) for v in values[name]]
+        names = list(values)
+        rows = zip(*[values[n].tolist() if isinstance(values[n], np.ndarray) else values[n] for n in names])
+
+        cells = pd.DataFrame({'cell_id': cell_ids,
+                              'region': df['Region'] if 'Region' in df.columns else None,
+                              'latitude': df.get('Latitude'), 'longitude': df.get('Longitude')})
+        cells = cells.drop_duplicates('cell_id').astype(object).where(cells.notna(), None)
+        with conn:
+            conn.executemany(f"INSERT OR REPLACE INTO daily ({', '.join(names)}) "
+                             f"VALUES ({', '.join('?' * len(names))})", rows)
+            conn.executemany("INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?)",
+                             cells.itertuples(index=False, name=None))
+            months = sorted({d[:7] for d in pd.unique(values['date'])})
+            for month in months:
+                conn.execute("DELETE FROM label_months WHERE month = ?", (month,))
+                conn.execute("INSERT INTO label_months SELECT cell_id, substr(date, 1, 7), uhi_label, COUNT(*) "
+                             "FROM daily WHERE date BETWEEN ? AND ? AND uhi_label IS NOT NULL "
+                             "GROUP BY cell_id, uhi_label", (f"{month}-01", f"{month}-31"))
+            if source is not None:
+                dates = values['date']
+                conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?)",
+                             (os.path.abspath(source), version, len(df), min(dates, default=None),
+                              max(dates, default=None), datetime.now().isoformat(timespec="seconds")))
+        # Index statistics let the planner pick the date index for short date ranges
+        conn.execute("ANALYZE")
+        return len(df)
+
+    # ------------------------------ queries ------------------------------
+
+    def _where(self, start=None, end=None, region=None, cells=None, table=""):
+        clauses, params = [], []
+        if cells is not None:
+            cells = [int(c) for c in cells]
+            clauses.append(f"{table}cell_id IN ({', '.join('?' * len(cells))})")
+            params += cells
+        if region is not None:
+            # With a date bound the (date, ...) index is far narrower than the region's key range;
+            # the unary + stops SQLite from choosing the primary key for this term
+            unary = "+" if (start or end) and cells is None else ""
+            clauses.append(f"{unary}{table}cell_id BETWEEN ? AND ?")
+            params += _region_range(region)
+        if start:
+            clauses.append("date >= ?")
+            params.append(str(start))
+        if end:
+            clauses.append("date <= ?")
+            params.append(str(end))
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def _select(self, columns, table=""):
+        return ", ".join(f'{table}{COLUMNS[c]} AS "{c}"' for c in columns)
+
+    def dates(self):
+        """(first, last) stored date, or (None, None) for an empty store."""
+        return self.connection().execute("SELECT MIN(date), MAX(date) FROM daily").fetchone()
+
+    def cell_history(self, cell_id, start=None, end=None, columns=('LST_Celsius', 'NDVI', 'UHI_Label')):
+        """One cell's rows in date order (Date column plus ``columns``)."""
+        where, params = self._where(start, end, cells=[cell_id])
+        return self.query(f"SELECT date AS Date, {self._select(columns)} FROM daily{where} ORDER BY date", params)
+
+    def compare_cells(self, cell_ids, column='LST_Celsius', start=None, end=None):
+        """``column`` of several cells side by side: one row per date, one column per cell id."""
+        where, params = self._where(start, end, cells=cell_ids)
+        long = self.query(f"SELECT date AS Date, cell_id, {COLUMNS[column]} AS value FROM daily{where}", params)
+        return long.pivot(index='Date', columns='cell_id', values='value').reindex(columns=list(cell_ids))
+
+    def label_frequencies(self, cell_ids=None, region=None, start=None, end=None, share=False):
+        """
+        Days per UHI label of every cell (or share of its labelled days).
+
+        Whole months inside [start, end] are read from ``label_months``, only the
+        partial months at either end from ``daily``.
+
+        :return: One row per cell, one column per label
+        """
+        start, end = (str(start)[:10] if start else None), (str(end)[:10] if end else None)
+        first = None if not start else start[:7] if start.endswith("-01") else _next_month(start[:7])
+        last = None if not end else end[:7] if end == _month_end(end[:7]) else _previous_month(end[:7])
+        if first and last and first > last:
+            months, days = None, [(start, end)]
+        else:
+            months = (first, last)
+            days = [(start, _previous_day(f"{first}-01")) if start and not start.endswith("-01") else None,
+                    (_next_day(_month_end(last)), end) if end and last != end[:7] else None]
+
+        parts, params = [], []
+        if months:
+            where, p = self._where(region=region, cells=cell_ids)
+            for value, op in zip(months, (">=", "<=")):
+                if value:
+                    where += (" AND " if where else " WHERE ") + f"month {op} ?"
+                    p.append(value)
+            parts.append(f"SELECT cell_id, uhi_label, days FROM label_months{where}")
+            params += p
+        for lo, hi in filter(None, days):
+            where, p = self._where(lo, hi, region, cell_ids)
+            parts.append(f"SELECT cell_id, uhi_label, 1 AS days FROM daily{where} AND uhi_label IS NOT NULL")
+            params += p
+        counts = self.query(f"SELECT cell_id, uhi_label, SUM(days) AS days FROM ({' UNION ALL '.join(parts)}) "
+                            f"GROUP BY cell_id, uhi_label", params)
+        table = counts.pivot(index='cell_id', columns='uhi_label', values='days').fillna(0).astype(int)
+        table.columns.name = None
+        if share:
+            table = table.div(table.sum(axis=1), axis=0)
+        return table
+
+    def day(self, date, region=None, columns=('LST_Celsius', 'UHI_Label')):
+        """Every cell of one date (cell_id, latitude, longitude and ``columns``)."""
+        where, params = self._where(date, date, region, table="d.")
+        return self.query(f"SELECT d.cell_id, c.latitude AS Latitude, c.longitude AS Longitude, "
+                          f"{self._select(columns, 'd.')} FROM daily d LEFT JOIN cells c USING (cell_id)"
+                          f"{where} ORDER BY d.cell_id", params)
+
+    def stats(self):
+        conn = self.connection()
+        rows, cells = conn.execute("SELECT COUNT(*), COUNT(DISTINCT cell_id) FROM daily").fetchone()
+        first, last = self.dates()
+        return {"rows": rows, "cells": cells, "first": first, "last": last,
+                "bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0}
+
+
+@instrumented("history_store", inputs=[DATA_PATH, "NDVI_16day.csv"])
+def load_history(source=DATA_PATH, path=STORE_PATH):
+    """Upsert a new version of the labelled dataset (with NDVI attached) into the history store."""
+    store = HistoryStore(path)
+    version = f"{dataset_version(source)}-{layers_version()}"
+    written = 0
+    if not store.is_loaded(source, version):
+        with stage("history_store.load") as rec:
+            df = keep_active(read_dataset(source))
+            rec["rows_in"] = len(df)
+            rec["rows_out"] = written = store.load(df, source, version)
+    s = store.stats()
+    print(f"History store {path}: {written} rows upserted; {s['rows']} rows of {s['cells']} cells "
+          f"from {s['first']} to {s['last']} ({s['bytes'] / 2 ** 20:.1f} MB)")
+    return store
+
+
+def benchmark(source=DATA_PATH, years=5, repeat=20, seed=0):
+    """Query timings on a scratch store holding ``years`` copies of ``source`` shifted by whole years."""
+    df = keep_active(read_dataset(source))
+    directory = tempfile.mkdtemp()
+    store = HistoryStore(os.path.join(directory, STORE_PATH))
+    dates = pd.to_datetime(df['Date'])
+    started = time.perf_counter()
+    for year in range(years):
+        store.load(df.assign(Date=(dates - pd.DateOffset(years=year)).dt.strftime('%Y-%m-%d')))
+    load_seconds = time.perf_counter() - started
+    s = store.stats()
+    print(f"{s['rows']} rows ({years} years x {s['cells']} cells) loaded in {load_seconds:.1f} s, "
+          f"{s['bytes'] / 2 ** 20:.0f} MB")
+
+    rng = np.random.default_rng(seed)
+    cell_ids = store.query("SELECT cell_id FROM cells")['cell_id'].to_numpy()
+    region = next(iter(load_config()["regions"]))
+    first, last = s['first'], s['last']
+    queries = {
+        "cell_history (all years)": lambda: store.cell_history(rng.choice(cell_ids)),
+        "compare_cells (5 cells, all years)": lambda: store.compare_cells(rng.choice(cell_ids, 5, replace=False)),
+        "label_frequencies (5 cells)": lambda: store.label_frequencies(rng.choice(cell_ids, 5, replace=False)),
+        "label_frequencies (region, 1 month)": lambda: store.label_frequencies(region=region, start=last[:8] + "01"),
+        "label_frequencies (region, all years)": lambda: store.label_frequencies(region=region),
+        "day (region)": lambda: store.day(last, region),
+    }
+    for name, run in queries.items():
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = run()
+            times.append(time.perf_counter() - started)
+        print(f"  {name:<38} median {np.median(times) * 1000:6.1f} ms  max {max(times) * 1000:6.1f} ms  "
+              f"({len(result)} rows)")
+    store.connection().close()
+    os.remove(store.path)
+    return first, last
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="SQLite history store of the labelled cell-days")
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--store", default=STORE_PATH)
+    parser.add_argument("--bench", action="store_true", help="Time the queries on a scratch multi-year store")
+    parser.add_argument("--years", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.bench:
+        benchmark(args.data, args.years)
+    else:
+        load_history(args.data, args.store)
@@ -0,0 +1,218 @@
+"""
+Per-stage timing, memory, row-count and I/O instrumentation for the UHI pipeline.
+
+Wrap a stage with the ``stage`` context manager or the ``instrumented``
+decorator. Each stage records wall time, CPU time, peak RSS (and tracemalloc
+peak when enabled), input/output row counts and bytes read/written. Records
+are collected in the active ``RunReport`` which can be written as a JSON run
+report and as Chrome trace events (open in chrome://tracing or Perfetto).
+
+Example:
+    report = start_run("nightly")
+    with stage("download", inputs=["AREA_LST.csv"], outputs=["Final_Merged_Dataset.csv"]) as rec:
+        ...
+        rec["rows_out"] = len(df)
+    report.write_json("run_report.json")
+"""
+import functools
+import glob
+import gzip
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+
+def _rss_mb():
+    """Peak resident set size of this process so far, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in KB on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _io_counters():
+    """(bytes read, bytes written) by this process, or None where unavailable."""
+    try:
+        with open("/proc/self/io") as fh:
+            fields = dict(line.split(":") for line in fh)
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def count_rows(path):
+    """Number of data rows in a CSV file, plain or gzipped (header excluded), or None if missing."""
+    if not os.path.isfile(path):
+        return None
+    with (gzip.open if path.endswith(".gz") else open)(path, "rb") as fh:
+        lines = sum(chunk.count(b"\n") for chunk in iter(lambda: fh.read(1 << 20), b""))
+    return max(lines - 1, 0)
+
+
+def _expand(paths):
+    """Paths with glob patterns (e.g. ``pyramid/*.csv.gz``) replaced by the matching files."""
+    return [match for path in paths for match in (sorted(glob.glob(path)) if glob.has_magic(path) else [path])]
+
+
+def _files_summary(paths):
+    rows, size = None, 0
+    for path in _expand(paths):
+        if os.path.isfile(path):
+            size += os.path.getsize(path)
+            if path.endswith((".csv", ".csv.gz")):
+                rows = (rows or 0) + count_rows(path)
+    return rows, size
+
+
+class RunReport:
+    """Collects stage records for one pipeline run."""
+
+    def __init__(self, name="uhi_pipeline", trace_memory=False):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self.t0 = time.perf_counter()
+        self.stages = []
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def stage(self, name, inputs=(), outputs=()):
+        """
+        Record one stage. Yields the record dict so the stage can set
+        ``rows_in``/``rows_out`` itself when it knows better than the files.
+
+        :param name: Stage name
+        :param inputs: Local files (or glob patterns) the stage reads
+        :param outputs: Local files (or glob patterns) the stage writes
+        """
+        stack = self._stack()
+        rec = {
+            "name": name,
+            "parent": stack[-1]["name"] if stack else None,
+            "thread": threading.get_ident(),
+            "inputs": list(inputs),
+            "outputs": list(outputs),
+            "rows_in": None,
+            "rows_out": None,
+            "status": "running",
+        }
+        stack.append(rec)
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        io_start = _io_counters()
+        rss_start = _rss_mb()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        try:
+            yield rec
+            rec["status"] = "ok"
+        except BaseException as exc:
+            rec["status"] = "failed"
+            rec["error"] = f"{type(exc).__name__}: {exc}"
+            raise
+        finally:
+            rec["start_s"] = round(wall_start - self.t0, 6)
+            rec["wall_s"] = round(time.perf_counter() - wall_start, 6)
+            rec["cpu_s"] = round(time.process_time() - cpu_start, 6)
+            rec["peak_rss_mb"] = round(_rss_mb(), 1)
+            rec["rss_growth_mb"] = round(_rss_mb() - rss_start, 1)
+            if self.trace_memory:
+                rec["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+            io_end = _io_counters()
+            if io_start and io_end:
+                rec["bytes_read"] = io_end[0] - io_start[0]
+                rec["bytes_written"] = io_end[1] - io_start[1]
+            # Inputs are summarised at the end too: stages may download them first
+            rows_in, rec["input_bytes"] = _files_summary(inputs)
+            rows_out, rec["output_bytes"] = _files_summary(outputs)
+            if rec["rows_in"] is None:
+                rec["rows_in"] = rows_in
+            if rec["rows_out"] is None:
+                rec["rows_out"] = rows_out
+            stack.pop()
+            self.stages.append(rec)
+
+    def summary(self):
+        return {
+            "run": self.name,
+            "started": self.started,
+            "total_wall_s": round(time.perf_counter() - self.t0, 6),
+            "peak_rss_mb": round(_rss_mb(), 1),
+            "stages": sorted(self.stages, key=lambda r: r["start_s"]),
+        }
+
+    def write_json(self, path="run_report.json"):
+        with open(path, "w") as fh:
+            json.dump(self.summary(), fh, indent=2, default=str)
+        return path
+
+    def write_chrome_trace(self, path="run_trace.json"):
+        """Write stages as Chrome trace-event "complete" events."""
+        events = [{
+            "name": rec["name"],
+            "cat": "stage",
+            "ph": "X",
+            "ts": int(rec["start_s"] * 1e6),
+            "dur": int(rec["wall_s"] * 1e6),
+            "pid": os.getpid(),
+            "tid": rec["thread"],
+            "args": {k: v for k, v in rec.items() if k not in ("name", "thread", "start_s", "wall_s")},
+        } for rec in self.stages]
+        with open(path, "w") as fh:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fh, default=str)
+        return path
+
+    def print_table(self):
+        print(f"{'stage':<28}{'wall s':>10}{'cpu s':>10}{'rss MB':>10}{'rows in':>10}{'rows out':>10}  status")
+        for rec in sorted(self.stages, key=lambda r: r["start_s"]):
+            indent = "  " if rec["parent"] else ""
+            print(f"{(indent + rec['name'])[:27]:<28}{rec['wall_s']:>10.2f}{rec['cpu_s']:>10.2f}"
+                  f"{rec['peak_rss_mb']:>10.0f}{str(rec['rows_in']):>10}{str(rec['rows_out']):>10}  {rec['status']}")
+
+
+_active = RunReport()
+
+
+def start_run(name="uhi_pipeline", trace_memory=False):
+    """Make a fresh ``RunReport`` the target of ``stage``/``instrumented``."""
+    global _active
+    _active = RunReport(name, trace_memory=trace_memory)
+    return _active
+
+
+def current_report():
+    return _active
+
+
+def stage(name, inputs=(), outputs=()):
+    """Context manager recording a stage in the active run report."""
+    return _active.stage(name, inputs=inputs, outputs=outputs)
+
+
+def instrumented(name=None, inputs=(), outputs=()):
+    """
+    Decorator recording every call of the wrapped function as a stage.
+
+    :param name: Stage name (defaults to the function name)
+    :param inputs: Local files (or glob patterns) the function reads
+    :param outputs: Local files (or glob patterns) the function writes
+    """
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with stage(name or fn.__name__, inputs=inputs, outputs=outputs):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
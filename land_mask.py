@@ -0,0 +1,195 @@
+"""
+Land/ocean mask of the study grid.
+
+Coastal regions (Mumbai most of all) have grid cells over the sea. ERA5-Land
+and MODIS are masked there, so every extractor reduced them daily only to
+export -999s, and clustering imputed them with column means. The mask is
+computed once per grid from ESA WorldCover: the land fraction of a cell is
+the share of its area that is not permanent water (class 80) and not outside
+WorldCover's land tiles. It is saved to ``land_mask.csv`` (every cell, with
+its ``land_fraction`` and ``active`` flag) and cells below
+``min_land_fraction`` (regions.json) are dropped from the study cells.
+
+Downstream code uses the compact active-cell index: the sorted array of
+active cell ids from ``active_index``. ``cell_positions`` maps cell ids to
+dense positions 0..n_active-1 with ``np.searchsorted`` and ``keep_active``
+filters any table with ``cell_id`` or ``system:index``. Without a mask file
+every cell is active.
+
+Usage:
+    python land_mask.py                 # compute the mask (Earth Engine) and report the savings
+    python land_mask.py --report        # savings of the saved mask only
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented
+from regions import as_cells, cell_id_from_index, load_config, study_cells
+
+LAND_MASK_PATH = "land_mask.csv"
+WATER_CLASS = 80  # ESA WorldCover: permanent water bodies
+# Earth Engine layers reduced per cell (LST, NDVI, rainfall, wind, humidity, ISA) and their images per year
+EE_LAYERS = {"LST": 365, "NDVI": 23, "RAINFALL": 365, "WIND": 365, "HUMIDITY": 365, "ISA": 1}
+# Layers exported as tables, one row per cell and image (ISA is fetched with getInfo)
+EXPORTED_LAYERS = ("LST", "NDVI", "RAINFALL", "WIND", "HUMIDITY")
+
+
+def min_land_fraction():
+    """Cells with a smaller land fraction are inactive (``min_land_fraction`` in regions.json)."""
+    return float(load_config().get("min_land_fraction", 0.0))
+
+
+def land_fraction(cells, scale=100):
+    """
+    Land fraction of every cell from ESA WorldCover (requires an initialised Earth Engine).
+
+    :param cells: Cells table from ``regions.study_cells``
+    :param scale: Reduction scale in metres; 100 m is plenty for a fraction of a 5 km cell
+    :return: float array aligned with ``cells``
+    """
+    import ee
+    from exports import reduce_tiles
+
+    # Water and areas outside WorldCover's land tiles (open sea) count as not land
+    water = ee.ImageCollection('ESA/WorldCover/v100').first().eq(WATER_CLASS).unmask(1)
+    reduced = reduce_tiles(cells, lambda boxes: water.reduceRegions(collection=boxes, reducer=ee.Reducer.mean(),
+                                                                     scale=scale))
+    water_share = {row['cell_id']: row.get('mean') for row in reduced}
+    share = pd.Series(cells['cell_id'].map(water_share), dtype=float).fillna(1.0).to_numpy()
+    return np.clip(1.0 - share, 0.0, 1.0)
+
+
+@instrumented("land_mask", outputs=[LAND_MASK_PATH])
+def build_land_mask(grid_centers=None, path=LAND_MASK_PATH):
+    """
+    Compute the land fraction of every grid cell and save the mask.
+
+    :param grid_centers: Cells table of the whole grid (defaults to the default region)
+    :return: Mask table with cell_id, Region, Latitude, Longitude, land_fraction, active
+    """
+    cells = study_cells() if grid_centers is None else as_cells(grid_centers)
+    mask = cells[['cell_id', 'Region', 'Latitude', 'Longitude']].copy()
+    mask['land_fraction'] = land_fraction(cells).round(4)
+    mask['active'] = mask['land_fraction'] >= min_land_fraction()
+    mask.to_csv(path, index=False)
+    print(f"Land mask saved to {path}")
+    print_savings(mask)
+    return mask
+
+
+def load_land_mask(path=LAND_MASK_PATH):
+    """The saved mask table, or None when no mask has been computed."""
+    return pd.read_csv(path) if os.path.exists(path) else None
+
+
+def flag_cells(cells, mask=None, threshold=None):
+    """
+    ``cells`` with ``land_fraction`` and ``active`` columns.
+
+    The threshold is applied to the stored land fractions, so changing
+    ``min_land_fraction`` needs no new Earth Engine run. Cells missing from the
+    mask (e.g. a newly added region) are active.
+    """
+    mask = load_land_mask() if mask is None else mask
+    threshold = min_land_fraction() if threshold is None else threshold
+    fraction = np.ones(len(cells))
+    if mask is not None:
+        fraction = cells['cell_id'].map(mask.set_index('cell_id')['land_fraction']).fillna(1.0).to_numpy()
+    return cells.assign(land_fraction=fraction, active=fraction >= threshold)
+
+
+def active_cells(cells, mask=None, threshold=None):
+    """Only the active cells of a cells table (see ``flag_cells``)."""
+    flagged = flag_cells(cells, mask, threshold)
+    return cells[flagged['active'].to_numpy()].reset_index(drop=True)
+
+
+def active_index(mask=None, threshold=None):
+    """
+    Compact active-cell index: sorted int64 array of active cell ids.
+
+    :return: The array, or None when there is no mask (every cell active)
+    """
+    mask = load_land_mask() if mask is None else mask
+    if mask is None:
+        return None
+    threshold = min_land_fraction() if threshold is None else threshold
+    return np.sort(mask.loc[mask['land_fraction'] >= threshold, 'cell_id'].to_numpy(np.int64))
+
+
+def cell_positions(index, cell_ids):
+    """Dense positions of ``cell_ids`` in the active index; -1 for inactive cells."""
+    cell_ids = np.asarray(cell_ids, dtype=np.int64)
+    if not len(index):
+        return np.full(cell_ids.shape, -1)
+    position = np.minimum(np.searchsorted(index, cell_ids), len(index) - 1)
+    return np.where(index[position] == cell_ids, position, -1)
+
+
+def keep_active(df, index=None):
+    """
+    Rows of ``df`` (with ``cell_id`` or ``system:index``) that belong to active cells.
+
+    :param index: Active index from ``active_index`` (loaded from the saved mask by default)
+    :return: Filtered frame with a fresh index; ``df`` itself when there is no mask
+    """
+    index = active_index() if index is None else index
+    if index is None:
+        return df
+    cell_ids = df['cell_id'] if 'cell_id' in df.columns else cell_id_from_index(df['system:index'].astype(str))
+    keep = cell_positions(index, cell_ids) >= 0
+    if keep.all():
+        return df
+    return df[keep].reset_index(drop=True)
+
+
+def savings(mask, threshold=None, days=365):
+    """Cells pruned by the mask and the per-year EE reductions and rows they no longer cost."""
+    threshold = min_land_fraction() if threshold is None else threshold
+    pruned = int((mask['land_fraction'] < threshold).sum())
+    return {
+        "cells": len(mask),
+        "active": len(mask) - pruned,
+        "pruned": pruned,
+        "pruned_share": pruned / max(len(mask), 1),
+        "ee_reductions": pruned * sum(EE_LAYERS.values()),
+        "rows_per_layer": {layer: pruned * EE_LAYERS[layer] * days // 365 for layer in EXPORTED_LAYERS},
+        "rows": pruned * sum(EE_LAYERS[layer] for layer in EXPORTED_LAYERS) * days // 365,
+    }
+
+
+def print_savings(mask, threshold=None):
+    s = savings(mask, threshold)
+    print(f"Land mask: {s['active']} of {s['cells']} cells active, {s['pruned']} pruned "
+          f"({s['pruned_share']:.0%}, land fraction < {min_land_fraction() if threshold is None else threshold:.2f})")
+    print(f"  per yearly run: {s['ee_reductions']:,} fewer EE cell reductions, "
+          f"{s['rows']:,} fewer exported rows "
+          f"({', '.join(f'{layer} {rows:,}' for layer, rows in s['rows_per_layer'].items())})")
+    for region, region_mask in mask.groupby('Region'):
+        print(f"  {region}: {savings(region_mask, threshold)['pruned']} of {len(region_mask)} cells pruned")
+    return s
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Land/ocean mask of the grid from ESA WorldCover")
+    parser.add_argument("--regions", default=os.environ.get("UHI_REGIONS", ""),
+                        help="Comma-separated region names (default: the config's default region)")
+    parser.add_argument("--threshold", type=float, help="Report with this min land fraction instead of the config's")
+    parser.add_argument("--report", action="store_true", help="Only report the savings of the saved mask")
+    args = parser.parse_args()
+
+    if args.report:
+        saved = load_land_mask()
+        if saved is None:
+            raise SystemExit(f"No {LAND_MASK_PATH}; run without --report first.")
+        print_savings(saved, args.threshold)
+    else:
+        import ee
+
+        ee.Authenticate()
+        ee.Initialize(project='heat-islands')
+        build_land_mask(study_cells([r for r in args.regions.split(",") if r]))
@@ -1,7 +1,7 @@
-import pandas as pd
+from cadence import read_dataset
 
-# Load the dataset into a DataFrame
-df = pd.read_csv("Final_Merged_Dataset_with_UHI_Labels.csv", index_col=0)
+# Load the dataset into a DataFrame (NDVI attached from its 16-day table)
+df = read_dataset("Final_Merged_Dataset_with_UHI_Labels.csv").set_index('system:index')
 
 # Extract the unique dates from the 'Date' column
 unique_dates = df['Date'].unique()
@@ -9,14 +9,8 @@ unique_dates = df['Date'].unique()
 # Sort the dates and get the latest date
 latest_date = sorted(unique_dates)[-1]
 
-# Convert the latest date to string format 'YYYYMMDD'
-latest_date_str = pd.to_datetime(latest_date).strftime('%Y%m%d')
-
-# Generate expected indices for that date
-expected_indices = [f"{latest_date_str}_{i}" for i in range(440)]
-
-# Filter the DataFrame for these indices
-filtered_df = df.loc[df.index.intersection(expected_indices)]
+# Keep every cell of every region on that date (the cell count depends on the regions run)
+filtered_df = df[df['Date'] == latest_date]
 
 # Save the filtered data to CSV
 filtered_df.to_csv("latest_data.csv", index=True)
@@ -0,0 +1,307 @@
+"""
+The merge -> download_datasets -> clustering_kmeans chain as one lazy polars plan.
+
+The pandas stages run eagerly: the daily layers are read in full, left-merged
+three times on the ``system:index`` strings, ISA is joined, the result is
+written to ``Final_Merged_Dataset.csv``, and clustering reads it back to
+attach NDVI and standardise the features. Here the same steps form one query
+plan (polars is optional and imported lazily):
+
+- every layer is scanned lazily and joined on integer (day, cell) keys
+  parsed once from ``system:index`` (``<YYYY[_]MM[_]DD>_<cell id>``);
+- only the columns the outputs use are read (projection pushdown) and the
+  active-cell filter is applied inside the LST scan (predicate pushdown);
+- NDVI comes from its 16-day table with as-of joins (the step lookup of
+  cadence.py: latest composite on or before the day, else the cell's first);
+- fill values and standardisation are column aggregates in the same plan.
+
+One ``collect`` runs the merged rows and the scaled features as a single
+multi-threaded query, so every layer is scanned once. K-means is
+sklearn's as in clustering.py. The CSV or Parquet outputs are only written
+at the end.
+
+Usage:
+    python lazy_chain.py                        # write the stage outputs from the local exports
+    python lazy_chain.py --check                # equal to the pandas path (merged rows, features, labels)
+    python lazy_chain.py --benchmark --repeat 3
+    python lazy_chain.py --benchmark --scale 4  # on the exports replicated to 4x the cells
+"""
+import os
+import shutil
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from clustering import CLUSTER_MODEL_PATH, FEATURE_COLUMNS, fit_clusters, save_cluster_model
+from download_datsets import LAYER_COLUMNS
+from instrumentation import instrumented, stage
+from land_mask import active_index
+from regions import CELL_ID_STRIDE, load_config
+
+NDVI_TABLE = "NDVI_16day.csv"
+# Column order of Final_Merged_Dataset.csv (download_datasets.merge_layers)
+MERGED_COLUMNS = [c for columns in LAYER_COLUMNS.values() for c in columns if c != 'system:index']
+MERGED_COLUMNS = ['system:index', *MERGED_COLUMNS, 'impervious_percentage', 'Region']
+
+
+def _polars():
+    try:
+        import polars as pl
+    except ImportError as exc:
+        raise SystemExit("lazy_chain.py needs polars (pip install polars)") from exc
+    return pl
+
+
+def _keys(pl):
+    """(day, cell_id) integer key expressions from ``system:index``."""
+    index = pl.col('system:index')
+    image = index.str.replace(r'_\d+$', '').str.replace_all('_', '')
+    return [image.str.to_date('%Y%m%d').cast(pl.Int32).alias('day'),
+            index.str.extract(r'_(\d+)$').cast(pl.Int64).alias('cell_id')]
+
+
+def scan_layer(pl, path, columns):
+    """Lazy frame of a daily layer: its ``columns`` (without system:index) plus day and cell_id keys."""
+    return pl.scan_csv(path).select(*_keys(pl), *[c for c in columns if c != 'system:index'])
+
+
+def merged_plan(directory=".", active=None):
+    """
+    Lazy plan of the daily dataset (``download_datasets.merge_layers``) with day and cell_id keys.
+
+    :param directory: Folder holding the AREA_*.csv exports
+    :param active: Active cell ids (``land_mask.active_index``); None keeps every cell
+    """
+    pl = _polars()
+    path = lambda name: os.path.join(directory, name)
+    lst = pl.scan_csv(path("AREA_LST.csv")).select(*LAYER_COLUMNS["AREA_LST.csv"]).with_columns(_keys(pl))
+    if active is not None:
+        lst = lst.filter(pl.col('cell_id').is_in(pl.Series(active, dtype=pl.Int64).implode()))
+    plan = lst
+    for name in ("AREA_HUMIDITY.csv", "AREA_WIND.csv", "AREA_RAINFALL.csv"):
+        plan = plan.join(scan_layer(pl, path(name), LAYER_COLUMNS[name]), on=['day', 'cell_id'], how='left',
+                         maintain_order='left')
+    isa = (pl.scan_csv(path("AREA_ISA.csv"))
+           .select(pl.col('grid_number').cast(pl.Int64).alias('cell_id'), 'impervious_percentage')
+           .unique('cell_id', keep='first', maintain_order=True))
+    regions = {r["id"]: name for name, r in load_config()["regions"].items()}
+    return (plan.join(isa, on='cell_id', how='left', maintain_order='left')
+            .with_columns((pl.col('cell_id') // CELL_ID_STRIDE).replace_strict(regions, default=None).alias('Region')))
+
+
+def with_ndvi(plan, path=NDVI_TABLE):
+    """``plan`` with NDVI from its native table, aligned like ``cadence.IntervalLookup`` (step mode)."""
+    pl = _polars()
+    table = (pl.scan_csv(path)
+             .select(pl.col('cell_id').cast(pl.Int64), pl.col('Date').str.to_date().cast(pl.Int32).alias('day'), 'NDVI')
+             .sort('day'))
+    rows = plan.with_row_index('row').sort('day')
+    # Both sides are sorted by day above
+    before = rows.join_asof(table, on='day', by='cell_id', strategy='backward', check_sortedness=False)
+    after = before.join_asof(table.rename({'NDVI': 'next_NDVI'}), on='day', by='cell_id', strategy='forward',
+                             check_sortedness=False)
+    return (after.with_columns(pl.coalesce('NDVI', 'next_NDVI').cast(pl.Float64).alias('NDVI'))
+            .drop('next_NDVI').sort('row').drop('row'))
+
+
+def feature_plan(plan):
+    """
+    ``plan`` plus its scaled ``FEATURE_COLUMNS`` (``<column>:scaled``) and their means and scales.
+
+    Same arithmetic as ``clustering.scale_features``: the scaler is fitted on the
+    non-missing values, missing ones become the mean of the scaled column. The
+    aggregates are broadcast in the same frame so the layers are scanned once.
+    """
+    pl = _polars()
+    columns = []
+    for c in FEATURE_COLUMNS:
+        raw = pl.when(pl.col(c) == -999).then(None).otherwise(pl.col(c).fill_nan(None))
+        std = raw.std(ddof=0)
+        scaled = (raw - raw.mean()) / pl.when(std == 0).then(1.0).otherwise(std)
+        columns += [scaled.fill_null(scaled.mean()).alias(f"{c}:scaled"),
+                    raw.mean().alias(f"{c}:mean"), std.alias(f"{c}:std")]
+    return plan.with_columns(columns)
+
+
+def collect_chain(directory=".", ndvi_path=None, active=None):
+    """
+    Run the plan once and return (merged rows, scaled features, fill values, scaler stand-in).
+
+    :return: Merged rows as a polars frame in ``MERGED_COLUMNS`` order, the float64 feature matrix,
+             {column: fill value} and an object with the scaler's ``mean_``/``scale_``
+    """
+    frame = feature_plan(with_ndvi(merged_plan(directory, active), ndvi_path or os.path.join(directory, NDVI_TABLE)))
+    frame = frame.collect()
+    means = np.array([frame[f"{c}:mean"][0] for c in FEATURE_COLUMNS], dtype=np.float64)
+    stds = np.array([frame[f"{c}:std"][0] for c in FEATURE_COLUMNS], dtype=np.float64)
+    scaler = SimpleNamespace(mean_=means, scale_=np.where(stds == 0, 1.0, stds))
+    features = frame.select([f"{c}:scaled" for c in FEATURE_COLUMNS]).to_numpy().astype(np.float64)
+    return frame.select(MERGED_COLUMNS), features, dict(zip(FEATURE_COLUMNS, means)), scaler
+
+
+def _write(frame, path, fmt):
+    if fmt == "parquet":
+        path = os.path.splitext(path)[0] + ".parquet"
+        frame.write_parquet(path)
+    else:
+        frame.write_csv(path)
+    return path
+
+
+@instrumented("lazy_chain", inputs=["AREA_LST.csv", "AREA_HUMIDITY.csv", "AREA_WIND.csv", "AREA_RAINFALL.csv",
+                                    "AREA_ISA.csv", NDVI_TABLE],
+              outputs=["Final_Merged_Dataset.csv", "Final_Merged_Dataset_with_UHI_Labels.csv",
+                       "Cluster_Summary.csv", CLUSTER_MODEL_PATH])
+def run_chain(directory=".", fmt="csv"):
+    """
+    Local part of download_datasets plus clustering_kmeans from one lazy plan (no Drive upload).
+
+    :param fmt: "csv" (what the other stages read) or "parquet"
+    :return: Paths of the merged and the labelled dataset
+    """
+    pl = _polars()
+    with stage("lazy_chain.collect") as rec:
+        rows, features, fill_values, scaler = collect_chain(directory, active=active_index())
+        rec["rows_out"] = len(rows)
+    labelled, kmeans, cluster_labels = fit_clusters(pd.DataFrame(features, columns=FEATURE_COLUMNS))
+    save_cluster_model(os.path.join(directory, CLUSTER_MODEL_PATH), fill_values, scaler, kmeans, cluster_labels)
+    labelled[['Cluster', 'UHI_Label']].value_counts().to_csv(os.path.join(directory, 'Cluster_Summary.csv'))
+    with stage("lazy_chain.write"):
+        merged_path = _write(rows, os.path.join(directory, "Final_Merged_Dataset.csv"), fmt)
+        labels = rows.with_columns(pl.Series('Cluster', labelled['Cluster'].to_numpy()),
+                                   pl.Series('UHI_Label', labelled['UHI_Label'].to_numpy().astype(str)))
+        labelled_path = _write(labels, os.path.join(directory, "Final_Merged_Dataset_with_UHI_Labels.csv"), fmt)
+    print(f"Lazy chain: {len(rows)} rows saved to {merged_path} and {labelled_path}")
+    return merged_path, labelled_path
+
+# ----------------------------- pandas comparison -----------------------------
+
+def pandas_chain(directory=".", active=None):
+    """The eager stages' local work: merge_layers, CSV round trip, NDVI attach and scale_features."""
+    from cadence import IntervalLookup
+    import cadence
+    from clustering import scale_features
+    from download_datsets import merge_layers
+
+    merged = merge_layers(directory, active)
+    path = os.path.join(tempfile.mkdtemp(), "Final_Merged_Dataset.csv")
+    merged.to_csv(path, index=False)
+    df = pd.read_csv(path)
+    shutil.rmtree(os.path.dirname(path))
+    # cadence caches lookups per registered path; read this directory's table directly
+    lookup = IntervalLookup(pd.read_csv(os.path.join(directory, NDVI_TABLE)), 'NDVI')
+    df['NDVI'] = lookup.align(cadence._cell_ids(df), cadence.day_numbers(df['Date']))
+    scaled, fill_values, scaler = scale_features(df)
+    return merged, scaled[FEATURE_COLUMNS].to_numpy(np.float64), fill_values, scaler
+
+
+def check_chain(directory="."):
+    """Self-test: the lazy plan reproduces the pandas merged rows, scaled features and cluster labels."""
+    pl = _polars()
+    active = active_index()
+    merged, features, fill_values, scaler = pandas_chain(directory, active)
+    rows, lazy_features, lazy_fill, lazy_scaler = collect_chain(directory, active=active)
+
+    assert list(rows.columns) == list(merged.columns) and len(rows) == len(merged)
+    for column in merged.columns:
+        expected, actual = merged[column].to_numpy(), rows[column].to_numpy()
+        if expected.dtype.kind in "fi":
+            assert np.allclose(expected.astype(float), actual.astype(float), equal_nan=True, rtol=1e-12), column
+        else:
+            assert (pd.Series(expected).fillna("").astype(str).to_numpy()
+                    == pd.Series(actual).fillna("").astype(str).to_numpy()).all(), column
+    assert np.allclose(features, lazy_features, rtol=1e-9, atol=1e-12)
+    assert np.allclose(scaler.mean_, lazy_scaler.mean_) and np.allclose(scaler.scale_, lazy_scaler.scale_)
+    assert np.allclose([fill_values[c] for c in FEATURE_COLUMNS], [lazy_fill[c] for c in FEATURE_COLUMNS])
+
+    expected, _, expected_labels = fit_clusters(pd.DataFrame(features, columns=FEATURE_COLUMNS))
+    actual, _, actual_labels = fit_clusters(pd.DataFrame(lazy_features, columns=FEATURE_COLUMNS))
+    assert (expected['UHI_Label'].to_numpy() == actual['UHI_Label'].to_numpy()).all()
+    print(f"Lazy chain check passed: {len(rows)} rows, {len(merged.columns)} columns, {len(FEATURE_COLUMNS)} "
+          f"features and the cluster labels equal the pandas path (polars {pl.__version__})")
+
+
+def scaled_exports(directory, scale, out_dir):
+    """Copies of the exports with every cell replicated ``scale`` times under new cell ids (for benchmarks)."""
+    lst = pd.read_csv(os.path.join(directory, "AREA_LST.csv"), usecols=['system:index'])
+    n_cells = int(lst['system:index'].str.rsplit('_', n=1).str[-1].astype(np.int64).max() % CELL_ID_STRIDE) + 1
+
+    def replicate(df, id_columns):
+        parts = []
+        for copy in range(scale):
+            part = df.copy()
+            for column in id_columns:
+                if column == 'system:index':
+                    split = part[column].str.rsplit('_', n=1)
+                    part[column] = split.str[0] + "_" + (split.str[1].astype(np.int64) + copy * n_cells).astype(str)
+                else:
+                    part[column] = part[column] + copy * n_cells
+            parts.append(part)
+        return pd.concat(parts, ignore_index=True)
+
+    os.makedirs(out_dir, exist_ok=True)
+    for name in LAYER_COLUMNS:
+        df = pd.read_csv(os.path.join(directory, name), usecols=LAYER_COLUMNS[name])
+        replicate(df, ['system:index']).to_csv(os.path.join(out_dir, name), index=False)
+    isa = pd.read_csv(os.path.join(directory, "AREA_ISA.csv"), usecols=['grid_number', 'impervious_percentage'])
+    replicate(isa.drop_duplicates('grid_number'), ['grid_number']).to_csv(os.path.join(out_dir, "AREA_ISA.csv"), index=False)
+    ndvi = pd.read_csv(os.path.join(directory, NDVI_TABLE))
+    replicate(ndvi, ['cell_id']).to_csv(os.path.join(out_dir, NDVI_TABLE), index=False)
+    return out_dir
+
+
+def benchmark(directory=".", repeat=3):
+    """Best-of-``repeat`` wall times of the pandas path and the lazy plan on the same exports."""
+    pl = _polars()
+    active = active_index()
+    if os.path.abspath(directory) != os.getcwd():
+        # Replicated exports (scaled_exports): every cell is active
+        ids = pd.read_csv(os.path.join(directory, "AREA_ISA.csv"), usecols=['grid_number'])['grid_number']
+        active = np.unique(ids.to_numpy(np.int64))
+    timings = {}
+    for name, run in (("pandas", lambda: pandas_chain(directory, active)),
+                      ("polars lazy", lambda: collect_chain(directory, active=active))):
+        best = np.inf
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = run()
+            best = min(best, time.perf_counter() - started)
+        timings[name] = best
+        rows = len(result[0])
+    print(f"{rows} rows, best of {repeat}, polars threads: {pl.thread_pool_size()}")
+    for name, seconds in timings.items():
+        print(f"  {name:<12} {seconds:7.2f} s")
+    print(f"  speed-up     {timings['pandas'] / timings['polars lazy']:7.1f}x")
+    return timings
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Merge and clustering preprocessing as one lazy polars plan")
+    parser.add_argument("--check", action="store_true", help="Compare with the pandas path")
+    parser.add_argument("--benchmark", action="store_true", help="Time the pandas path and the lazy plan")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scale", type=int, default=1, help="Benchmark on the exports replicated this many times")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv", help="Output format of a run")
+    parser.add_argument("--explain", action="store_true", help="Print the optimised plan")
+    args = parser.parse_args()
+
+    if args.explain:
+        print(feature_plan(with_ndvi(merged_plan(active=active_index()))).explain())
+    elif args.check:
+        check_chain()
+    elif args.benchmark:
+        if args.scale > 1:
+            scratch = tempfile.mkdtemp()
+            try:
+                benchmark(scaled_exports(".", args.scale, scratch), args.repeat)
+            finally:
+                shutil.rmtree(scratch)
+        else:
+            benchmark(".", args.repeat)
+    else:
+        run_chain(fmt=args.format)
@@ -0,0 +1,165 @@
+"""
+Load test for the UHI labels API (api.py).
+
+Without ``--url`` a synthetic labelled dataset of ``--cells`` cells x ``--days``
+days is written to a temporary CSV and served in-process. Worker threads keep
+one HTTP/1.1 connection each and replay a mix of ``/latest``, ``/cells`` with
+random dates and bboxes, ``/cell/<id>/history`` and conditional requests
+(``If-None-Match``); latency percentiles are reported per endpoint.
+
+Usage:
+    python loadtest_api.py --cells 44000 --days 14 --requests 4000 --concurrency 8
+    python loadtest_api.py --url http://127.0.0.1:8000 --requests 4000
+    python loadtest_api.py --check   # 404 messages of unknown dates, cells and endpoints
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+
+LABELS = ['High UHI', 'Moderate-High UHI', 'Moderate UHI', 'Low-Moderate UHI', 'Low UHI']
+
+
+def synthetic_dataset(path, cells=44000, days=14, seed=0):
+    """Write a labelled dataset shaped like clustering_kmeans output for a square-ish grid."""
+    rng = np.random.default_rng(seed)
+    cols = int(np.ceil(np.sqrt(cells)))
+    grid = np.arange(cells)
+    dates = [(date(2025, 1, 1) + timedelta(days=d)).isoformat() for d in range(days)]
+    n = cells * days
+    cluster = rng.integers(0, 5, n)
+    df = pd.DataFrame({
+        'system:index': [f"{d.replace('-', '')}_{c}" for d in dates for c in grid],
+        'Date': np.repeat(dates, cells),
+        'Latitude': np.tile(18.0 + (grid // cols) * 0.009, days),
+        'Longitude': np.tile(72.0 + (grid % cols) * 0.0098, days),
+        'LST_Celsius': rng.normal(30, 4, n).round(3),
+        'NDVI': rng.uniform(0, 0.8, n).round(4),
+        'Relative_Humidity_%': rng.uniform(30, 95, n).round(2),
+        'WindSpeed': rng.uniform(0, 8, n).round(3),
+        'Rainfall_mm': rng.exponential(2, n).round(3),
+        'impervious_percentage': rng.uniform(0, 100, n).round(2),
+        'Region': 'synthetic',
+        'Cluster': cluster,
+        'UHI_Label': np.asarray(LABELS)[cluster],
+    })
+    df.to_csv(path, index=False)
+    return dates, cols
+
+
+def start_local_server(cells, days):
+    from http.server import ThreadingHTTPServer
+    from api import LabelService, make_handler
+
+    path = os.path.join(tempfile.mkdtemp(prefix="uhi_api_"), "labels.csv")
+    started = time.perf_counter()
+    dates, cols = synthetic_dataset(path, cells, days)
+    print(f"Synthetic dataset: {cells} cells x {days} days in {time.perf_counter() - started:.1f} s")
+    service = LabelService(path)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(service))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}", dates, cols
+
+
+def request_mix(rng, dates, cells, cols):
+    """(endpoint name, path) for one random request."""
+    pick = rng.random()
+    if pick < 0.2:
+        return "latest", "/latest"
+    if pick < 0.6:
+        rows = max(1, cells // cols)
+        r, c = rng.randrange(rows), rng.randrange(cols)
+        south, west = 18.0 + r * 0.009, 72.0 + c * 0.0098
+        bbox = f"{west:.4f},{south:.4f},{west + 0.2:.4f},{south + 0.2:.4f}"  # about 20 x 20 cells
+        return "cells", f"/cells?date={rng.choice(dates)}&bbox={bbox}"
+    return "history", f"/cell/{rng.randrange(cells)}/history"
+
+
+def worker(url, n, dates, cells, cols, seed, results):
+    rng = random.Random(seed)
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port)
+    etags = {}
+    for _ in range(n):
+        name, path = request_mix(rng, dates, cells, cols)
+        headers = {"Accept-Encoding": "gzip"}
+        if path in etags and rng.random() < 0.5:
+            headers["If-None-Match"] = etags[path]
+            name += " (304)"
+        started = time.perf_counter()
+        conn.request("GET", path, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        results.append((name, time.perf_counter() - started, response.status))
+        if response.getheader("ETag"):
+            etags[path] = response.getheader("ETag")
+
+
+def check_errors(url, cells):
+    """Self-test: unknown dates, cells and endpoints each get a 404 with their own message."""
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port)
+    expected = {"/cells?date=2030-01-01": "no data for date 2030-01-01",
+                f"/cell/{cells + 99}/history": f"unknown cell {cells + 99}",
+                "/nowhere": "unknown endpoint /nowhere"}
+    for path, message in expected.items():
+        conn.request("GET", path)
+        response = conn.getresponse()
+        error = json.loads(response.read())["error"]
+        assert response.status == 404 and error == message, (path, response.status, error)
+        print(f"{path}: {response.status} {error!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the UHI labels API")
+    parser.add_argument("--url")
+    parser.add_argument("--cells", type=int, default=44000)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--check", action="store_true", help="Only check the 404 error messages")
+    args = parser.parse_args()
+
+    if args.url:
+        url = args.url
+        dates = [(date(2025, 1, 1) + timedelta(days=d)).isoformat() for d in range(args.days)]
+        cols = int(np.ceil(np.sqrt(args.cells)))
+    else:
+        url, dates, cols = start_local_server(args.cells, args.days)
+    if args.check:
+        return check_errors(url, args.cells)
+
+    results = []
+    per_worker = args.requests // args.concurrency
+    threads = [threading.Thread(target=worker, args=(url, per_worker, dates, args.cells, cols, i, results))
+               for i in range(args.concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    df = pd.DataFrame(results, columns=["endpoint", "seconds", "status"])
+    errors = df[df["status"] >= 400]
+    summary = df.groupby("endpoint")["seconds"].describe(percentiles=[0.5, 0.95, 0.99])[
+        ["count", "50%", "95%", "99%", "max"]]
+    summary.loc["all"] = df["seconds"].describe(percentiles=[0.5, 0.95, 0.99])[["count", "50%", "95%", "99%", "max"]]
+    summary[["50%", "95%", "99%", "max"]] *= 1000
+    print(f"\n{len(df)} requests in {elapsed:.1f} s ({len(df) / elapsed:.0f} req/s), {len(errors)} errors")
+    print("Latency (ms):")
+    print(summary.round(2).to_string())
+
+
+if __name__ == "__main__":
+    main()
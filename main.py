@@ -1,40 +1,101 @@
-import ee
+"""
+UHI pipeline: Earth Engine extraction -> merge -> clustering -> forecast -> pyramid.
 
-from grids import generate_grid
-from extract_lst import extract_lst
-from extract_ndvi import extract_ndvi
-from extract_rainfall import extract_rainfall
-from extract_wind import extract_wind
-from extract_humidity import extract_humidity
-from extract_isa import extract_isa
-from clustering import clustering_kmeans
+Stages are declared below with their inputs, parameters and outputs (see
+pipeline.py); stages whose key has not changed since their last successful
+run are skipped and their outputs restored from ``.stage_cache/``.
 
+Usage:
+    python main.py                          # every stage, unchanged ones skipped
+    python main.py --stage clustering_kmeans
+    python main.py --from download_datasets --to forecast_uhi
+    python main.py --resume                 # from the stage that failed last time
+    python main.py --list
+"""
+import argparse
+import os
 
-from download_datsets import download_datasets
+from instrumentation import start_run
+from pipeline import CELLS, GRID, Pipeline, define
 
-# Initialize Google Earth Engine (GEE)
-ee.Authenticate()
-ee.Initialize(project='heat-islands')
+STAGES = [
+    # Land fraction of every grid cell (WorldCover), computed once per grid; cells below
+    # min_land_fraction (regions.json) are dropped from CELLS for every later stage
+    define("land_mask", "land_mask:build_land_mask", args=(GRID,),
+           params=["grid"], outputs=["land_mask.csv"], earth_engine=True),
+    # Earth Engine exports to Drive; re-run when the study cells or the one-year window change
+    define("extract_lst", "extract_lst:extract_lst", args=(CELLS, "Area_LST"),
+           params=["cells", "window"], earth_engine=True),
+    define("extract_ndvi", "extract_ndvi:extract_ndvi", args=(CELLS, "Area_NDVI"),
+           params=["cells", "window"], earth_engine=True),
+    # NDVI at its native 16-day cadence; daily rows get it on read (cadence.py)
+    define("ndvi_table", "merge_ndvi:ndvi_table", params=["cells"], after=["extract_lst", "extract_ndvi"],
+           outputs=["NDVI_16day.csv", "AREA_LST.csv", "AREA_NDVI.csv"]),
+    define("extract_rainfall", "extract_rainfall:extract_rainfall", args=(CELLS, "Area_RAINFALL"),
+           params=["cells", "window"], earth_engine=True),
+    define("extract_wind", "extract_wind:extract_wind", args=(CELLS, "Area_WIND"),
+           params=["cells", "window"], earth_engine=True),
+    define("extract_humidity", "extract_humidity:extract_humidity", args=(CELLS, "Area_HUMIDITY"),
+           params=["cells", "window"], earth_engine=True),
+    define("extract_isa", "extract_isa:extract_isa", args=(CELLS,),
+           params=["cells", "window"], outputs=["AREA_ISA.csv"], earth_engine=True),
+    # Local stages
+    define("download_datasets", "download_datsets:download_datasets",
+           inputs=["AREA_LST.csv", "AREA_ISA.csv"],
+           after=["extract_rainfall", "extract_wind", "extract_humidity"],
+           outputs=["Final_Merged_Dataset.csv", "AREA_HUMIDITY.csv", "AREA_WIND.csv", "AREA_RAINFALL.csv"]),
+    define("clustering_kmeans", "clustering:clustering_kmeans", inputs=["Final_Merged_Dataset.csv", "NDVI_16day.csv"],
+           outputs=["Final_Merged_Dataset_with_UHI_Labels.csv", "Cluster_Summary.csv", "cluster_model.json"]),
+    # One stable UHI class per cell from its full-year profile (clustering.py --compare for both modes)
+    define("clustering_profiles", "clustering:clustering_profiles", inputs=["Final_Merged_Dataset.csv", "NDVI_16day.csv"],
+           outputs=["UHI_Profile_Labels.csv"]),
+    # Next-7-day LST / UHI class outlook per cell, labelled with the persisted cluster model
+    define("forecast_uhi", "forecast:forecast_uhi",
+           inputs=["Final_Merged_Dataset_with_UHI_Labels.csv", "cluster_model.json"],
+           outputs=["UHI_Forecast.csv"]),
+    # Every labelled cell-day upserted into the SQLite history store (grows run after run,
+    # so it is never restored from the stage cache)
+    define("history_store", "history_store:load_history",
+           inputs=["Final_Merged_Dataset_with_UHI_Labels.csv", "NDVI_16day.csv"]),
+    # Coarser grid levels derived locally from the base grid
+    define("build_pyramid", "pyramid:build_pyramid", inputs=["Final_Merged_Dataset_with_UHI_Labels.csv", "NDVI_16day.csv"],
+           outputs=["pyramid"]),
+]
 
-# Define study area
-bottom_left = (18.847, 72.744)
-top_right = (19.797, 73.712)
+if __name__ == "__main__":
+    names = [s["name"] for s in STAGES]
+    parser = argparse.ArgumentParser(description="Run the UHI pipeline, skipping unchanged stages.")
+    parser.add_argument("--stage", action="append", choices=names, help="Run only this stage (repeatable)")
+    parser.add_argument("--from", dest="start", choices=names, help="First stage of the range")
+    parser.add_argument("--to", dest="stop", choices=names, help="Last stage of the range")
+    parser.add_argument("--resume", action="store_true", help="Start from the stage that failed last time")
+    parser.add_argument("--force", action="store_true", help="Run the selected stages even if unchanged")
+    parser.add_argument("--list", action="store_true", help="Show the stages and their last status")
+    parser.add_argument("--no-app", action="store_true", help="Do not launch the Streamlit app afterwards")
+    args = parser.parse_args()
 
-# Generate grid centers
-grid_centers = generate_grid(bottom_left, top_right)
-print(f"Generated {grid_centers.shape[0] * grid_centers.shape[1]} grid centers.")
+    # Define study area: comma-separated region names from regions.json (UHI_REGIONS)
+    region_list = [r for r in os.environ.get("UHI_REGIONS", "").split(",") if r]
+    pipeline = Pipeline(STAGES, regions=region_list)
+    if args.list:
+        pipeline.describe()
+        raise SystemExit
 
-# Extract LST data and save to CSV
-extract_lst(grid_centers, "Area_LST")
-extract_ndvi(grid_centers, "Area_NDVI")
-extract_rainfall(grid_centers, "Area_RAINFALL")
-extract_wind(grid_centers, "Area_WIND")
-extract_humidity(grid_centers, "Area_HUMIDITY")
-extract_isa()
+    # Run report: per-stage timings are written to UHI_RUN_REPORT (default run_report.json),
+    # Chrome trace events to UHI_TRACE when set, tracemalloc peaks with UHI_TRACEMALLOC=1
+    report = start_run("main", trace_memory=bool(os.environ.get("UHI_TRACEMALLOC")))
+    selected = pipeline.select(args.stage, args.start, args.stop, args.resume)
+    try:
+        done = pipeline.run(selected, force=args.force)
+    finally:
+        report.print_table()
+        print(f"Run report saved as {report.write_json(os.environ.get('UHI_RUN_REPORT', 'run_report.json'))}")
+        if os.environ.get("UHI_TRACE"):
+            print(f"Chrome trace saved as {report.write_chrome_trace(os.environ['UHI_TRACE'])}")
+    skipped = [name for name, outcome in done.items() if outcome == "cached"]
+    print(f"Ran {len(done) - len(skipped)} stage(s), skipped {len(skipped)} unchanged: {', '.join(skipped) or '-'}")
 
-download_datasets()
-
-clustering_kmeans()
-
-import subprocess
-subprocess.run(["streamlit", "run", "app1.py"])
+    # Offline runs (see fake_backends.py) and partial runs stop before launching the app
+    if not (os.environ.get("UHI_OFFLINE") or args.no_app or selected != names):
+        import subprocess
+        subprocess.run(["streamlit", "run", "app1.py"])
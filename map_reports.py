@@ -0,0 +1,261 @@
+"""
+Headless daily / weekly UHI map reports.
+
+Renders the styled UHI grid of every requested day (or week, by majority
+class) without a browser or the Streamlit apps:
+
+- ``<period>.png``: the grid as an image, one block of pixels per cell with
+  thin cell borders. Because the grid is regular, this is a palette lookup
+  and ``np.repeat`` per map, encoded with zlib; no plotting library is needed.
+- ``<period>.html``: an interactive Leaflet map. The cell polygons are
+  precomputed once per region in ``cells.js`` and shared by every page, so a
+  page only embeds its per-cell class codes (one character per cell).
+- ``index-<day|week>.html``: thumbnails of every map linking to the pages.
+
+Maps are rendered in parallel in a process pool; workers inherit the class
+stack once at start-up and receive only period indices.
+
+Usage:
+    python map_reports.py --period day --start 2025-01-01 --end 2025-12-31
+    python map_reports.py --period week --regions mumbai --workers 4
+"""
+import json
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from pyramid import to_stack
+from regions import CELL_ID_STRIDE, cell_id_from_index, get_region, load_config, region_axes
+
+REPORT_DIR = "reports"
+UHI_CLASSES = ['Low UHI', 'Low-Moderate UHI', 'Moderate UHI', 'Moderate-High UHI', 'High UHI']
+# Same colours as the apps' UHI layers (blue, lightblue, orange, red, yellow); grey = no data
+CLASS_COLORS = ['#0000ff', '#add8e6', '#ffa500', '#ff0000', '#ffff00']
+NO_DATA_COLOR = '#d3d3d3'
+BORDER_COLOR = '#000000'
+
+_worker = {}
+
+
+def _rgb(hex_color):
+    return [int(hex_color[i:i + 2], 16) for i in (1, 3, 5)]
+
+
+PALETTE = np.array([_rgb(c) for c in CLASS_COLORS + [NO_DATA_COLOR]], dtype=np.uint8)
+
+
+def label_stack(df, region):
+    """
+    UHI classes of a region as int8 codes (days, rows, cols); -1 where a cell has no label.
+
+    :return: (dates, codes)
+    """
+    if 'cell_id' not in df.columns:
+        df = df.assign(cell_id=cell_id_from_index(df['system:index'].astype(str)))
+    codes = pd.Categorical(df['UHI_Label'], categories=UHI_CLASSES).codes
+    dates, stacks = to_stack(df.assign(UHI_Code=codes.astype(np.float64)), region, ['UHI_Code'])
+    return np.asarray(dates).astype(str), np.nan_to_num(stacks['UHI_Code'], nan=-1).astype(np.int8)
+
+
+def report_periods(dates, period="day", start=None, end=None):
+    """[(key, day indices)] of each day, or of each ISO week (key = its Monday), within [start, end]."""
+    days = pd.to_datetime(pd.Series(dates))
+    keep = np.ones(len(days), dtype=bool)
+    if start:
+        keep &= (days >= pd.Timestamp(start)).to_numpy()
+    if end:
+        keep &= (days <= pd.Timestamp(end)).to_numpy()
+    if period == "day":
+        return [(dates[i], np.array([i])) for i in np.flatnonzero(keep)]
+    monday = (days - pd.to_timedelta(days.dt.weekday, unit="D")).dt.strftime("%Y-%m-%d").to_numpy()
+    return [(f"week-{key}", np.flatnonzero(keep & (monday == key))) for key in pd.unique(monday[keep])]
+
+
+def majority(codes):
+    """Most frequent class per cell over the first axis, ignoring -1; -1 where no day has a label."""
+    counts = np.stack([(codes == c).sum(axis=0) for c in range(len(UHI_CLASSES))])
+    return np.where(counts.max(axis=0) > 0, counts.argmax(axis=0), -1).astype(np.int8)
+
+
+def encode_png(rgb):
+    """Encode an (height, width, 3) uint8 array as PNG bytes."""
+    height, width, _ = rgb.shape
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8), rgb.reshape(height, -1)], axis=1)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)) + chunk(b"IEND", b""))
+
+
+def render_png(codes, scale=8):
+    """
+    Image of one (rows, cols) class grid, north up, ``scale`` pixels per cell with cell borders.
+    """
+    rgb = PALETTE[np.where(codes < 0, len(CLASS_COLORS), codes)[::-1]]
+    rgb = np.repeat(np.repeat(rgb, scale, axis=0), scale, axis=1)
+    if scale >= 4:
+        rgb[::scale] = rgb[:, ::scale] = _rgb(BORDER_COLOR)
+    return encode_png(rgb)
+
+
+def cells_script(region):
+    """``cells.js``: the region's cell polygons as a GeoJSON variable, in grid-number order."""
+    lat_values, lon_values, _ = region_axes(region)
+    lat_step, lon_step = region['lat_step'], region['lon_step']
+    features = [
+        {"type": "Feature", "properties": {"i": r * len(lon_values) + c,
+                                             "id": int(region['id'] * CELL_ID_STRIDE + r * len(lon_values) + c)},
+         "geometry": {"type": "Polygon", "coordinates": [[
+             [round(lon, 5), round(lat, 5)], [round(lon + lon_step, 5), round(lat, 5)],
+             [round(lon + lon_step, 5), round(lat + lat_step, 5)], [round(lon, 5), round(lat + lat_step, 5)],
+             [round(lon, 5), round(lat, 5)]]]}}
+        for r, lat in enumerate(lat_values) for c, lon in enumerate(lon_values)
+    ]
+    return "var UHI_CELLS = " + json.dumps({"type": "FeatureCollection", "features": features},
+                                           separators=(",", ":")) + ";\n"
+
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title>
+<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.css"/>
+<script src="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.js"></script>
+<script src="cells.js"></script>
+<style>html,body,#map{{height:100%;margin:0}}.legend{{background:#fff;padding:6px;font:12px sans-serif}}</style>
+</head><body><div id="map"></div><script>
+var codes = "{codes}", classes = {classes}, colors = {colors};
+var map = L.map('map').setView({center}, {zoom});
+L.tileLayer('https://{{s}}.tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png', {{attribution: '&copy; OpenStreetMap'}}).addTo(map);
+L.geoJSON(UHI_CELLS, {{
+  style: function (f) {{ var c = codes.charCodeAt(f.properties.i) - 48;
+    return {{color: '#000', weight: 0.5, fillOpacity: c < 0 ? 0 : 0.6, fillColor: colors[c] || '#ccc'}}; }},
+  onEachFeature: function (f, layer) {{ var c = codes.charCodeAt(f.properties.i) - 48;
+    layer.bindTooltip('Cell ' + f.properties.id + ': ' + (classes[c] || 'no data')); }}
+}}).addTo(map);
+var legend = L.control({{position: 'bottomright'}});
+legend.onAdd = function () {{ var d = L.DomUtil.create('div', 'legend'); d.innerHTML = '<b>{title}</b><br>' +
+  classes.map(function (c, i) {{ return '<span style="background:' + colors[i] + '">&nbsp;&nbsp;&nbsp;</span> ' + c; }}).join('<br>');
+  return d; }};
+legend.addTo(map);
+</script></body></html>
+"""
+
+
+def render_page(key, codes, region):
+    """Leaflet page of one period; class codes are '0'..'4', '/' for no data."""
+    return PAGE_TEMPLATE.format(
+        title=f"{region['name']} UHI {key}",
+        codes=(codes.ravel() + 48).astype(np.uint8).tobytes().decode(),
+        classes=json.dumps(UHI_CLASSES), colors=json.dumps(CLASS_COLORS),
+        center=json.dumps(region['center']), zoom=region['zoom'])
+
+
+def _init_worker(codes, region, out_dir, formats, scale):
+    _worker.update(codes=codes, region=region, out_dir=out_dir, formats=formats, scale=scale)
+
+
+def render_period(job):
+    """Write the PNG and/or HTML of one (key, day indices) period; runs in a pool worker."""
+    key, days = job
+    started = time.perf_counter()
+    codes = _worker['codes'][days]
+    grid = codes[0] if len(days) == 1 else majority(codes)
+    written = 0
+    if "png" in _worker['formats']:
+        data = render_png(grid, _worker['scale'])
+        with open(os.path.join(_worker['out_dir'], f"{key}.png"), "wb") as fh:
+            fh.write(data)
+        written += len(data)
+    if "html" in _worker['formats']:
+        page = render_page(key, grid, _worker['region']).encode()
+        with open(os.path.join(_worker['out_dir'], f"{key}.html"), "wb") as fh:
+            fh.write(page)
+        written += len(page)
+    return key, time.perf_counter() - started, written
+
+
+def write_index(out_dir, region, keys, formats, period="day"):
+    """``index-<period>.html`` with a thumbnail (or link) per period."""
+    items = []
+    for key in keys:
+        target = f"{key}.html" if "html" in formats else f"{key}.png"
+        body = f'<img src="{key}.png" alt="{key}">' if "png" in formats else ""
+        items.append(f'<a href="{target}">{body}<span>{key}</span></a>')
+    legend = "".join(f'<li><i style="background:{c}"></i>{name}</li>' for name, c in zip(UHI_CLASSES, CLASS_COLORS))
+    html = f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{region['name']} UHI maps</title>
+<style>body{{font:13px sans-serif;margin:16px}}a{{display:inline-block;margin:4px;text-align:center;color:#333;
+text-decoration:none}}img{{display:block;width:160px;image-rendering:pixelated;border:1px solid #999}}
+ul{{list-style:none;padding:0}}li{{display:inline-block;margin-right:12px}}
+i{{display:inline-block;width:12px;height:12px;margin-right:4px}}</style></head><body>
+<h1>{region['name']} UHI maps ({len(keys)})</h1><ul>{legend}</ul>
+{"".join(items)}
+</body></html>
+"""
+    path = os.path.join(out_dir, f"index-{period}.html")
+    with open(path, "w") as fh:
+        fh.write(html)
+    return path
+
+
+def render_reports(source="Final_Merged_Dataset_with_UHI_Labels.csv", regions=None, period="day", start=None,
+                   end=None, formats=("png", "html"), scale=8, out_dir=REPORT_DIR, max_workers=None):
+    """
+    Render one map per day or week for each region in a process pool.
+
+    :param period: "day" or "week" (majority class of the week)
+    :param formats: Any of "png", "html"
+    :param scale: PNG pixels per cell side
+    :return: {region name: index page path}
+    """
+    df = pd.read_csv(source)
+    if 'Region' not in df.columns:
+        df['Region'] = load_config()['default']
+    indexes = {}
+    for name, region_df in df.groupby('Region'):
+        if regions and name not in regions:
+            continue
+        region = dict(get_region(name), name=name)
+        region_dir = os.path.join(out_dir, name)
+        os.makedirs(region_dir, exist_ok=True)
+        started = time.perf_counter()
+        dates, codes = label_stack(region_df, region)
+        jobs = report_periods(dates, period, start, end)
+        if "html" in formats:
+            with open(os.path.join(region_dir, "cells.js"), "w") as fh:
+                fh.write(cells_script(region))
+
+        total_bytes = 0
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(codes, region, region_dir, formats, scale)) as pool:
+            futures = [pool.submit(render_period, job) for job in jobs]
+            for future in as_completed(futures):
+                total_bytes += future.result()[2]
+        indexes[name] = write_index(region_dir, region, [key for key, _ in jobs], formats, period)
+        print(f"Rendered {len(jobs)} {period} maps of {name} ({total_bytes / 2 ** 20:.1f} MB) "
+              f"in {time.perf_counter() - started:.1f} s -> {indexes[name]}")
+    return indexes
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Render daily or weekly UHI map reports")
+    parser.add_argument("--data", default="Final_Merged_Dataset_with_UHI_Labels.csv")
+    parser.add_argument("--regions", nargs="+")
+    parser.add_argument("--period", choices=["day", "week"], default="day")
+    parser.add_argument("--start")
+    parser.add_argument("--end")
+    parser.add_argument("--formats", nargs="+", choices=["png", "html"], default=["png", "html"])
+    parser.add_argument("--scale", type=int, default=8, help="PNG pixels per cell side")
+    parser.add_argument("--out", default=REPORT_DIR)
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+    render_reports(args.data, args.regions, args.period, args.start, args.end, args.formats, args.scale,
+                   args.out, args.workers)
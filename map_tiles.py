@@ -0,0 +1,309 @@
+"""
+Earth Engine tile URLs requested concurrently and shared by every app session.
+
+Drawing an EE image on a map costs one ``getMapId`` round trip, in which EE
+prepares the computation behind the tiles. The apps used to issue it only
+for the selected layer and again on every rerun, so each layer switch
+blocked on EE, and two sessions opening the same layer ran the same request
+twice. ``MapTiles`` fixes both:
+
+- ``prefetch`` submits the requests of every layer to a small thread pool,
+  so later layer switches find their URLs ready. Both the image (which may
+  start Earth Engine) and ``getMapId`` run in the pool, never in the
+  script thread;
+- requests go through ``SingleFlight``: concurrent calls with the same key
+  (region, layer, period, visualisation) share one in-flight computation
+  and the later callers wait for its result. The result then serves every
+  session until it expires (EE map ids are only valid for a few hours).
+  Failed requests are not kept, so the next call retries.
+
+``getMapId`` only prepares the computation: EE computes the pixels when the
+tiles are requested, and an annual ERA5 layer aggregates 365 daily images per
+tile. For the progressive mode the apps draw a preview first, built by
+``preview_image`` from every ``PREVIEW_EVERY``-th day at ``PREVIEW_SCALE``
+metres, and swap in the exact layer when it is ready. ``MapTiles.render``
+resolves once EE has rendered the tile at the map centre (the first image the
+user sees), so the apps can time both steps; the browser then finds that tile
+in EE's cache.
+
+Usage:
+    python map_tiles.py --check     # coalescing self-test with a slow fake request
+    python map_tiles.py --progressive  # preview/exact timing self-test with fake tiles
+"""
+import json
+import math
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, timedelta
+
+# EE map ids expire; recompute well before that
+MAP_ID_TTL = 2 * 3600
+# Progressive previews: one day in PREVIEW_EVERY, pixels of PREVIEW_SCALE m (ERA5-Land is ~11 km)
+PREVIEW_EVERY = 8
+PREVIEW_SCALE = 25_000
+
+
+class SingleFlight:
+    """Coalesce concurrent calls by key and keep their results for ``ttl`` seconds."""
+
+    def __init__(self, ttl=MAP_ID_TTL, max_entries=128):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (started, Future)
+        self.calls = 0  # computations actually run
+
+    def _live(self, key):
+        entry = self._entries.get(key)
+        if entry and not (entry[1].done() and time.monotonic() - entry[0] > self.ttl):
+            self._entries.move_to_end(key)
+            return entry[1]
+        return None
+
+    def peek(self, key):
+        """The in-flight or cached future for ``key``, or None."""
+        with self._lock:
+            return self._live(key)
+
+    def future(self, key, fn, executor=None):
+        """
+        Future of ``fn()`` for ``key``: the in-flight or cached one when there is one.
+
+        :param executor: Run ``fn`` there (non-blocking); by default it runs in the calling thread
+        """
+        with self._lock:
+            live = self._live(key)
+            if live is not None:
+                return live
+            future = Future()
+            self._entries[key] = (time.monotonic(), future)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.calls += 1
+
+        def run():
+            try:
+                future.set_result(fn())
+            except BaseException as exc:
+                with self._lock:
+                    if self._entries.get(key, (None, None))[1] is future:
+                        del self._entries[key]
+                future.set_exception(exc)
+
+        if executor is None:
+            run()
+        else:
+            executor.submit(run)
+        return future
+
+    def get(self, key, fn, timeout=None):
+        """``fn()`` for ``key``, computed at most once however many threads ask at the same time."""
+        return self.future(key, fn).result(timeout)
+
+
+def tile_url(image, vis_params):
+    """XYZ tile URL of an EE image (one ``getMapId`` round trip)."""
+    return image.getMapId(vis_params)['tile_fetcher'].url_format
+
+
+def tile_xyz(lat, lon, zoom):
+    """Web Mercator (x, y) of the tile covering a point at ``zoom``."""
+    n = 2 ** zoom
+    y = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n
+    return int((lon + 180) / 360 * n), int(y)
+
+
+def fetch_tile(url_format, lat, lon, zoom, timeout=300):
+    """Request the tile covering (lat, lon); EE computes the pixels and caches the tile."""
+    x, y = tile_xyz(lat, lon, zoom)
+    with urllib.request.urlopen(url_format.format(x=x, y=y, z=zoom), timeout=timeout) as response:
+        return response.read()
+
+
+# ------------------------- Progressive previews ----------------------------
+
+def sampled_days(start, end, every=PREVIEW_EVERY):
+    """ERA5 daily image ids ('YYYYMMDD') of every ``every``-th day in [start, end)."""
+    first = date.fromisoformat(start)
+    days = (date.fromisoformat(end) - first).days
+    return [(first + timedelta(days=d)).strftime('%Y%m%d') for d in range(0, days, every)]
+
+
+def preview_image(get_layer, every=PREVIEW_EVERY, scale=PREVIEW_SCALE):
+    """
+    Quick approximation of a layer for the progressive mode.
+
+    :param get_layer: Layer function taking ``every`` (aggregate every n-th day only)
+    :param scale: Pixel size in metres the preview is computed at
+    """
+    return get_layer(every=every).reproject(crs='EPSG:4326', scale=scale)
+
+
+class MapTiles:
+    """Tile URLs of EE layers, prefetched in a thread pool and shared by all sessions of the process."""
+
+    def __init__(self, max_workers=6, ttl=MAP_ID_TTL, fetch=fetch_tile):
+        self.flights = SingleFlight(ttl)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="map-tiles")
+        self.fetch = fetch
+
+    @staticmethod
+    def key(*parts, vis_params=None):
+        return json.dumps([*parts, vis_params], sort_keys=True, default=str)
+
+    def _request(self, key, build_image, vis_params):
+        return self.flights.future(key, lambda: tile_url(build_image(), vis_params), self.pool)
+
+    def prefetch(self, requests):
+        """
+        Start the requests that are neither cached nor in flight; returns at once.
+
+        :param requests: {key: (build_image, vis_params)}; ``build_image`` runs in the pool
+        """
+        for key, (build_image, vis_params) in requests.items():
+            self._request(key, build_image, vis_params)
+
+    def url(self, key, build_image, vis_params, timeout=None):
+        """Tile URL for ``key``, waiting for an in-flight request instead of starting another one."""
+        return self._request(key, build_image, vis_params).result(timeout)
+
+    def render(self, key, build_image, vis_params, at):
+        """
+        Future of the tile URL for ``key`` that resolves once EE has rendered the tile at ``at``.
+
+        Shares the ``getMapId`` request (and a prefetched URL) with ``url``. Rendering the tile
+        is a best-effort warm-up: when it fails the URL is returned anyway.
+
+        :param at: (lat, lon, zoom) of the tile to render, usually the map centre
+        """
+        url_future = self._request(key, build_image, vis_params)
+
+        def run():
+            url = url_future.result()
+            try:
+                self.fetch(url, *at)
+            except OSError as exc:
+                print(f"Tile warm-up failed: {exc}")
+            return url
+
+        return self.flights.future(json.dumps([key, 'tile', list(at)]), run, self.pool)
+
+
+def check_coalescing(threads=20, delay=0.3):
+    """
+    Self-test: identical concurrent requests run once, distinct ones in parallel, images are built
+    in the pool, failures are retried.
+    """
+    tiles = MapTiles()
+
+    class SlowImage:
+        def __init__(self, name):
+            # Building an image may start Earth Engine: never in the calling (script) thread
+            assert threading.current_thread().name.startswith("map-tiles")
+            self.name = name
+
+        def getMapId(self, vis_params):
+            time.sleep(delay)
+            return {'tile_fetcher': type("Fetcher", (), {'url_format': f"https://tiles/{self.name}/{{z}}/{{x}}/{{y}}"})}
+
+    layers = ['lst', 'ndvi', 'rainfall', 'humidity', 'isa', 'wind']
+    started = time.perf_counter()
+    tiles.prefetch({tiles.key('mumbai', name): (lambda n=name: SlowImage(n), {}) for name in layers})
+    results = []
+    workers = [threading.Thread(target=lambda i=i: results.append(
+        tiles.url(tiles.key('mumbai', layers[i % 6]), lambda: SlowImage(layers[i % 6]), {})))
+        for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    calls = tiles.flights.calls
+    assert calls == len(layers) and len(results) == threads
+    assert all(r.startswith("https://tiles/") for r in results)
+
+    switched = time.perf_counter()
+    tiles.url(tiles.key('mumbai', 'ndvi'), lambda: SlowImage('ndvi'), {})
+    switch = time.perf_counter() - switched
+
+    attempts = []
+
+    class FlakyImage(SlowImage):
+        def getMapId(self, vis_params):
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RuntimeError("EE error")
+            return super().getMapId(vis_params)
+
+    flaky = lambda: FlakyImage('retry')
+
+    try:
+        tiles.url(tiles.key('mumbai', 'retry'), flaky, {})
+    except RuntimeError:
+        pass
+    assert tiles.url(tiles.key('mumbai', 'retry'), flaky, {}).endswith("{y}") and len(attempts) == 2
+    print(f"{threads} requests for {len(layers)} layers: {calls} getMapId calls in "
+          f"{elapsed:.2f} s (one call takes {delay:.2f} s); cached layer switch {switch * 1000:.2f} ms")
+
+
+def check_progressive(days=365, day_cost=0.004, map_id_delay=0.1):
+    """
+    Self-test of the progressive mode with fake EE images whose first tile takes ``day_cost``
+    seconds per aggregated day and full-resolution pixel block: the preview's first image must
+    arrive well before the exact layer's, and the exact request must reuse a prefetched map id.
+    """
+    resolution_gain = (PREVIEW_SCALE / 11_000) ** 2  # ERA5-Land pixels per preview pixel
+
+    class FakeImage:
+        def __init__(self, cost):
+            self.cost = cost
+
+        def reproject(self, crs, scale):
+            return FakeImage(self.cost / resolution_gain)
+
+        def getMapId(self, vis_params):
+            time.sleep(map_id_delay)
+            return {'tile_fetcher': type("Fetcher", (), {'url_format': f"https://tiles/{self.cost}/{{z}}/{{x}}/{{y}}"})}
+
+    def fake_fetch(url_format, lat, lon, zoom):
+        time.sleep(float(url_format.split('/')[3]))
+        return b""
+
+    def get_layer(every=1):
+        return FakeImage(len(range(0, days, every)) * day_cost)
+
+    tiles = MapTiles(fetch=fake_fetch)
+    at = (19.07, 72.88, 10)
+    exact_key, preview_key = tiles.key('mumbai', 'lst'), tiles.key('mumbai', 'lst', 'preview')
+    tiles.prefetch({exact_key: (get_layer, {})})
+
+    started = time.perf_counter()
+    exact = tiles.render(exact_key, get_layer, {}, at)
+    tiles.render(preview_key, lambda: preview_image(get_layer), {}, at).result()
+    first_image = time.perf_counter() - started
+    assert not exact.done()
+    exact.result()
+    final = time.perf_counter() - started
+    assert tiles.flights.calls == 4  # two map ids, two rendered tiles
+    rerun = time.perf_counter()
+    assert tiles.render(exact_key, get_layer, {}, at).done()
+    print(f"Preview ({len(range(0, days, PREVIEW_EVERY))} of {days} days at {PREVIEW_SCALE // 1000} km): "
+          f"first image in {first_image:.2f} s; exact composite in {final:.2f} s; "
+          f"cached on rerun in {(time.perf_counter() - rerun) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Shared, prefetched Earth Engine tile URLs")
+    parser.add_argument("--check", action="store_true", help="Run the coalescing self-test")
+    parser.add_argument("--progressive", action="store_true", help="Run the progressive preview self-test")
+    args = parser.parse_args()
+
+    if args.check:
+        check_coalescing()
+    if args.progressive:
+        check_progressive()
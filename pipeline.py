@@ -0,0 +1,271 @@
+"""
+Declared pipeline stages with a content-addressed output cache and resumable runs.
+
+Every stage of ``main.py`` declares what determines its result:
+
+- ``inputs``: local files it reads (hashed by content),
+- ``params``: values such as the study cells and the export date window,
+- ``after``: upstream stages whose results it consumes remotely (their keys
+  are folded in, e.g. Drive exports read by ``ndvi_table``),
+
+and the local ``outputs`` (files or directories) it writes. The stage key is
+a hash of all of these. After a successful run the outputs are copied to
+``.stage_cache/<stage>/<key>/``; when a later run computes the same key the
+stage is skipped and missing or modified outputs are restored from the
+cache. Stages without local outputs (Earth Engine exports) are skipped when
+their last successful run had the same key.
+
+Stage functions are given as ``"module:function"`` and imported only when the
+stage actually runs, and Earth Engine is initialised only before the first
+stage that needs it, so running just ``clustering_kmeans`` starts instantly.
+The last run's status per stage is kept in ``.pipeline_state.json`` so a
+failed run can be resumed from the stage that failed.
+"""
+import hashlib
+import importlib
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+
+from instrumentation import stage
+
+CACHE_DIR = ".stage_cache"
+STATE_PATH = ".pipeline_state.json"
+KEEP_ENTRIES = 3  # cached results kept per stage
+CELLS = object()  # placeholder argument: the active study cells (land mask applied)
+GRID = object()  # placeholder argument: every cell of the study grid
+
+
+def define(name, target, args=(), inputs=(), outputs=(), params=(), after=(), earth_engine=False):
+    """
+    Declare a stage.
+
+    :param target: ``"module:function"`` to call
+    :param args: Positional arguments; ``CELLS`` is replaced by the active study cells, ``GRID`` by all of them
+    :param params: Names of run parameters (see ``Pipeline.param``) that affect the result
+    :param earth_engine: Initialise Earth Engine before running
+    """
+    return {"name": name, "target": target, "args": tuple(args), "inputs": list(inputs),
+            "outputs": list(outputs), "params": list(params), "after": list(after),
+            "earth_engine": earth_engine}
+
+
+def export_window(lag_days=10, days=365):
+    """(start, end) dates of the extractors' one-year window ending ``lag_days`` ago."""
+    end = datetime.utcnow() - timedelta(days=lag_days)
+    return (end - timedelta(days=days)).strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+
+
+class Pipeline:
+    """Runs declared stages in order, skipping the ones whose key has not changed."""
+
+    def __init__(self, stages, regions=(), cache_dir=CACHE_DIR, state_path=STATE_PATH, project='heat-islands'):
+        self.stages = stages
+        self.names = [s["name"] for s in stages]
+        self.regions = list(regions)
+        self.cache_dir = cache_dir
+        self.state_path = state_path
+        self.project = project
+        self._grid = None
+        self._cells = None
+        self._ee_ready = False
+        self.state = {"stages": {}, "hashes": {}}
+        if os.path.exists(state_path):
+            with open(state_path) as fh:
+                self.state = json.load(fh)
+
+    # ---------------------------- Keys ----------------------------
+
+    def grid(self):
+        if self._grid is None:
+            from regions import study_cells
+
+            with stage("generate_grid"):
+                self._grid = study_cells(self.regions)
+            print(f"Generated {len(self._grid)} grid centers.")
+        return self._grid
+
+    def cells(self):
+        """Active cells of the grid; recomputed after any stage ran, as it may have changed the land mask."""
+        if self._cells is None:
+            from land_mask import active_cells
+
+            self._cells = active_cells(self.grid())
+            if len(self._cells) < len(self.grid()):
+                print(f"{len(self._cells)} of {len(self.grid())} grid cells are active (land mask).")
+        return self._cells
+
+    def param(self, name):
+        if name in ("cells", "grid"):
+            cells = self.cells() if name == "cells" else self.grid()
+            return hashlib.md5(cells[['cell_id', 'Latitude', 'Longitude']].to_csv(index=False).encode()).hexdigest()
+        if name == "window":
+            return export_window()
+        raise KeyError(f"unknown stage parameter {name}")
+
+    def file_hash(self, path):
+        """Content hash of a file or directory, reusing the previous hash while size and mtime match."""
+        if os.path.isdir(path):
+            digest = hashlib.sha256()
+            for root, _, files in sorted(os.walk(path)):
+                for file in sorted(files):
+                    full = os.path.join(root, file)
+                    digest.update(f"{os.path.relpath(full, path)}:{self.file_hash(full)}".encode())
+            return digest.hexdigest()
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        known = self.state["hashes"].get(path)
+        if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for block in iter(lambda: fh.read(1 << 20), b""):
+                digest.update(block)
+        self.state["hashes"][path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def key(self, spec):
+        """Hash of the stage's declaration, parameters, input contents and upstream keys."""
+        parts = {
+            "stage": [spec["name"], spec["target"], [a for a in spec["args"] if a is not CELLS and a is not GRID]],
+            "params": {p: self.param(p) for p in spec["params"]},
+            "inputs": {path: self.file_hash(path) for path in spec["inputs"]},
+            "after": {name: self.state["stages"].get(name, {}).get("key") for name in spec["after"]},
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+    # ---------------------------- Cache ----------------------------
+
+    def _entry(self, spec, key):
+        return os.path.join(self.cache_dir, spec["name"], key)
+
+    def _store(self, spec, key):
+        entry = self._entry(spec, key)
+        tmp = entry + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for i, path in enumerate(spec["outputs"]):
+            if os.path.isdir(path):
+                shutil.copytree(path, os.path.join(tmp, str(i)))
+            elif os.path.exists(path):
+                shutil.copy2(path, os.path.join(tmp, str(i)))
+        shutil.rmtree(entry, ignore_errors=True)
+        os.rename(tmp, entry)
+        # Keep only the most recent entries of the stage
+        stage_dir = os.path.dirname(entry)
+        entries = sorted((os.path.join(stage_dir, e) for e in os.listdir(stage_dir)), key=os.path.getmtime)
+        for old in entries[:-KEEP_ENTRIES]:
+            shutil.rmtree(old, ignore_errors=True)
+
+    def _restore(self, spec, key):
+        """Bring outputs back from the cache entry; False when there is no usable entry."""
+        entry = self._entry(spec, key)
+        if not os.path.isdir(entry):
+            return False
+        recorded = self.state["stages"].get(spec["name"], {}).get("outputs", {})
+        for i, path in enumerate(spec["outputs"]):
+            cached = os.path.join(entry, str(i))
+            if not os.path.exists(cached):
+                continue
+            if path in recorded and self.file_hash(path) == recorded[path]:
+                continue  # output still as the cached run left it
+            print(f"  restoring {path} from the stage cache")
+            if os.path.isdir(cached):
+                shutil.rmtree(path, ignore_errors=True)
+                shutil.copytree(cached, path)
+            else:
+                shutil.copy2(cached, path)
+        return True
+
+    def _save_state(self):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as fh:
+            json.dump(self.state, fh, indent=2)
+        os.replace(tmp, self.state_path)
+
+    # ---------------------------- Running ----------------------------
+
+    def _init_earth_engine(self):
+        if self._ee_ready:
+            return
+        with stage("ee_init"):
+            import ee
+
+            ee.Authenticate()
+            ee.Initialize(project=self.project)
+        self._ee_ready = True
+
+    def _call(self, spec):
+        if spec["earth_engine"]:
+            self._init_earth_engine()
+        module, function = spec["target"].split(":")
+        with stage(f"import {module}"):
+            fn = getattr(importlib.import_module(module), function)
+        placeholders = {id(CELLS): self.cells, id(GRID): self.grid}
+        fn(*[placeholders[id(a)]() if id(a) in placeholders else a for a in spec["args"]])
+
+    def select(self, only=None, start=None, stop=None, resume=False):
+        """Names of the stages to consider, in pipeline order."""
+        if only:
+            unknown = set(only) - set(self.names)
+            if unknown:
+                raise SystemExit(f"Unknown stage(s): {', '.join(sorted(unknown))}. Stages: {', '.join(self.names)}")
+            return [n for n in self.names if n in only]
+        if resume:
+            start = self.state.get("last_failed")
+            if start is None:
+                print("No failed stage recorded; running every stage (unchanged ones are skipped).")
+        first = self.names.index(start) if start else 0
+        last = self.names.index(stop) if stop else len(self.names) - 1
+        return self.names[first:last + 1]
+
+    def run(self, names=None, force=False):
+        """
+        Run the named stages in pipeline order.
+
+        :param force: Run even when the key is unchanged
+        :return: {stage name: "ran" | "cached"}
+        """
+        done = {}
+        for spec in self.stages:
+            if names is not None and spec["name"] not in names:
+                continue
+            name = spec["name"]
+            key = self.key(spec)
+            previous = self.state["stages"].get(name, {})
+            unchanged = previous.get("status") == "ok" and previous.get("key") == key
+            if not force and unchanged and (not spec["outputs"] or self._restore(spec, key)):
+                print(f"Skipping {name}: unchanged (key {key})")
+                done[name] = "cached"
+                continue
+            print(f"Running {name} (key {key})")
+            self.state["stages"][name] = {"key": key, "status": "running",
+                                          "started": datetime.now().isoformat(timespec="seconds")}
+            self._save_state()
+            try:
+                self._call(spec)
+            except BaseException as exc:
+                self.state["stages"][name].update(status="failed", error=f"{type(exc).__name__}: {exc}")
+                self.state["last_failed"] = name
+                self._save_state()
+                raise
+            self._cells = None
+            self.state["stages"][name].update(
+                status="ok", outputs={path: self.file_hash(path) for path in spec["outputs"]})
+            if spec["outputs"]:
+                self._store(spec, key)
+            if self.state.get("last_failed") == name:
+                self.state.pop("last_failed")
+            self._save_state()
+            done[name] = "ran"
+        return done
+
+    def describe(self):
+        """One line per stage: name, last status and key."""
+        for spec in self.stages:
+            last = self.state["stages"].get(spec["name"], {})
+            marker = " <- last failure" if self.state.get("last_failed") == spec["name"] else ""
+            print(f"{spec['name']:<20}{last.get('status', '-'):<9}{last.get('key', ''):<18}"
+                  f"outputs: {', '.join(spec['outputs']) or '(remote)'}{marker}")
@@ -1,22 +1,17 @@
 import pandas as pd
-import numpy as np
 from grids import generate_grid
 import streamlit as st
+from regions import get_region, region_axes
 
 df = pd.read_csv("Final_Merged_Dataset_with_UHI_Labels.csv")
 import ee
 import geemap
-import numpy as np
 # Initialize the Earth Engine API
 ee.Initialize(project='heat-islands')
-# --- Define grid parameters and fix bounding box ---
-lat_min, lon_min = 18.847, 72.744
-lat_step = 5 / 111
-lon_step = 5 / 102
-lat_values = np.arange(lat_min, 19.797, lat_step)
-lon_values = np.arange(lon_min, 73.712, lon_step)
-lat_max = lat_values[-1] + lat_step
-lon_max = lon_values[-1] + lon_step
+# --- Grid parameters and bounding box of the default region (regions.json) ---
+region = get_region()
+lat_step, lon_step = region['lat_step'], region['lon_step']
+lat_values, lon_values, (lat_min, lon_min, lat_max, lon_max) = region_axes(region)
 # Grid generation for other layers
 features = []
 for lat in lat_values:
@@ -29,11 +24,14 @@ for lat in lat_values:
         features.append(feature)
 grid_fc = ee.FeatureCollection(features)
 # Create a simple map centered on Mumbai
-map_center = [18.847, 72.744]  # Bottom-left of the grid
+map_center = [lat_min, lon_min]  # Bottom-left of the grid
 mymap = geemap.Map(center=map_center, zoom=12)
 # Add the grid points to the map
 mymap.addLayer(grid_fc.style(color='black', fillColor='00000000', width=1), {}, '5x5 km Grid Boxes')
-df_subset = df.tail(440)[['Latitude', 'Longitude', 'Cluster', 'UHI_Label']].copy()
+latest = df[df['Date'] == df['Date'].max()]
+if 'Region' in latest.columns:
+    latest = latest[latest['Region'] == region['name']]
+df_subset = latest[['Latitude', 'Longitude', 'Cluster', 'UHI_Label']].copy()
 # 2. Convert DataFrame to a list of ee.Features
 features_cluster = []
 for _, row in df_subset.iterrows():
@@ -0,0 +1,248 @@
+"""
+Multi-resolution grid pyramid built from the base extraction grid.
+
+Features are extracted once at the region's base ``cell_km`` (e.g. 1 km). The
+coarser levels listed in ``pyramid_km`` in regions.json (2, 5, 10 km, ...) are
+derived locally by exact area-weighted block aggregation: the base grid is
+padded to a multiple of the level factor, reshaped to
+``(days, rows, f, cols, f)`` and summed over the ``f`` axes. Each level keeps
+the summed cell area of valid base cells, so ``value * area`` totals are
+conserved exactly across levels. Categorical columns (Cluster, UHI_Label) are
+aggregated by area-weighted majority.
+
+Levels are written to ``pyramid/<region>_<km>km.csv.gz`` and the apps pick one
+from the map zoom level without running another Earth Engine job.
+"""
+import glob
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from cadence import read_dataset
+from instrumentation import instrumented, stage
+from regions import CELL_ID_STRIDE, get_region, load_config, region_axes
+
+PYRAMID_DIR = "pyramid"
+EARTH_RADIUS_KM = 6371.0088
+VALUE_COLUMNS = ['LST_Celsius', 'NDVI', 'Air_Temperature_C', 'Dew_Point_Temperature_C',
+                 'Relative_Humidity_%', 'WindDirection', 'WindSpeed', 'Rainfall_mm', 'impervious_percentage']
+CATEGORY_COLUMNS = ['Cluster', 'UHI_Label']
+
+
+def cell_areas(region):
+    """Exact spherical area (km²) of every base cell, shape (rows, cols)."""
+    lat_values, lon_values, _ = region_axes(region)
+    lat_edges = np.radians(np.append(lat_values, lat_values[-1] + region['lat_step']))
+    band = np.diff(np.sin(lat_edges)) * math.radians(region['lon_step']) * EARTH_RADIUS_KM ** 2
+    return np.repeat(band[:, None], len(lon_values), axis=1)
+
+
+def to_stack(df, region, columns):
+    """
+    Reshape a long (Date, cell) table into dense (days, rows, cols) arrays.
+
+    Missing cells and -999 placeholders become NaN.
+
+    :return: (dates, {column: array})
+    """
+    lat_values, lon_values, _ = region_axes(region)
+    rows, cols = len(lat_values), len(lon_values)
+    grid_number = df['cell_id'].to_numpy() % CELL_ID_STRIDE
+    dates, day = np.unique(df['Date'].to_numpy(), return_inverse=True)
+    stacks = {}
+    for column in columns:
+        values = df[column].to_numpy()
+        if column not in CATEGORY_COLUMNS and values.dtype.kind in 'if':
+            stack = np.full((len(dates), rows * cols), np.nan)
+            stack[day, grid_number] = np.where(values == -999, np.nan, values)
+        else:
+            stack = np.full((len(dates), rows * cols), None, dtype=object)
+            stack[day, grid_number] = values
+        stacks[column] = stack.reshape(len(dates), rows, cols)
+    return dates, stacks
+
+
+def _pad(array, factor, fill):
+    rows, cols = array.shape[-2:]
+    pad_rows, pad_cols = -rows % factor, -cols % factor
+    widths = [(0, 0)] * (array.ndim - 2) + [(0, pad_rows), (0, pad_cols)]
+    return np.pad(array, widths, constant_values=fill)
+
+
+def _blocks(array, factor):
+    """View (..., R*f, C*f) as (..., R, f, C, f)."""
+    *lead, rows, cols = array.shape
+    return array.reshape(*lead, rows // factor, factor, cols // factor, factor)
+
+
+def block_aggregate(values, area, factor):
+    """
+    Area-weighted block mean of a (days, rows, cols) stack.
+
+    :param values: Array with NaN for missing cells
+    :param area: Base cell areas (rows, cols)
+    :param factor: Number of base cells per coarse cell side
+    :return: (coarse values, coarse valid area) each (days, rows // f, cols // f)
+    """
+    values = _pad(values, factor, np.nan)
+    area = _pad(area, factor, 0.0)
+    weight = np.where(np.isnan(values), 0.0, area)
+    total = _blocks(np.nan_to_num(values) * weight, factor).sum(axis=(-3, -1))
+    covered = _blocks(weight, factor).sum(axis=(-3, -1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(covered > 0, total / covered, np.nan)
+    return mean, covered
+
+
+def block_majority(labels, area, factor):
+    """Area-weighted majority of a categorical (days, rows, cols) stack."""
+    area = _pad(area, factor, 0.0)
+    labels = _pad(labels, factor, None)
+    categories = pd.unique(labels[pd.notna(labels)])
+    votes = np.stack([_blocks((labels == c) * area, factor).sum(axis=(-3, -1)) for c in categories]
+                     or [_blocks(np.zeros_like(labels, dtype=float), factor).sum(axis=(-3, -1))])
+    winner = np.asarray(categories, dtype=object)[votes.argmax(axis=0)]
+    return np.where(votes.max(axis=0) > 0, winner, None)
+
+
+def aggregate_level(df, region, level_km):
+    """
+    Derive one coarser pyramid level of a region from its base-resolution table.
+
+    :param df: Base table with Date, cell_id and feature columns for one region
+    :param region: Region dict from ``regions.get_region``
+    :param level_km: Target cell size; must be an integer multiple of the base ``cell_km``
+    :return: Long table for the level with cell centers and covered area
+    """
+    factor = level_km / region['cell_km']
+    if factor < 1 or not float(factor).is_integer():
+        raise ValueError(f"{level_km} km is not a multiple of the {region['cell_km']} km base grid")
+    factor = int(factor)
+    values = [c for c in VALUE_COLUMNS if c in df.columns]
+    categories = [c for c in CATEGORY_COLUMNS if c in df.columns]
+    dates, stacks = to_stack(df, region, values + categories)
+    area = cell_areas(region)
+
+    out = {}
+    for column in values:
+        out[column] = block_aggregate(stacks[column], area, factor)[0]
+    for column in categories:
+        out[column] = block_majority(stacks[column], area, factor)
+    # Area of the base cells in the table: blocks of dropped (sea) cells only get no area
+    present = np.full(area.size, np.nan)
+    present[df['cell_id'].to_numpy() % CELL_ID_STRIDE] = 1.0
+    land_area = block_aggregate(present.reshape((1,) + area.shape), area, factor)[1][0]
+
+    days, rows, cols = next(iter(out.values())).shape
+    lat_values, lon_values, _ = region_axes(region)
+    lat_step, lon_step = region['lat_step'] * factor, region['lon_step'] * factor
+    grid_number = np.arange(rows * cols)
+    level = pd.DataFrame({
+        'Date': np.repeat(dates, rows * cols),
+        'cell_id': np.tile(region['id'] * CELL_ID_STRIDE + grid_number, days),
+        'Latitude': np.tile(lat_values[0] + (grid_number // cols + 0.5) * lat_step, days),
+        'Longitude': np.tile(lon_values[0] + (grid_number % cols + 0.5) * lon_step, days),
+        'area_km2': np.tile(land_area.ravel(), days),
+    })
+    for column in values + categories:
+        level[column] = out[column].reshape(-1)
+    level['Region'] = region['name']
+    level['level_km'] = level_km
+    # Drop coarse cells that only contain padding or cells missing from the table
+    return level[level['area_km2'] > 0].reset_index(drop=True)
+
+
+@instrumented("build_pyramid", inputs=["Final_Merged_Dataset_with_UHI_Labels.csv", "NDVI_16day.csv"],
+              outputs=[os.path.join(PYRAMID_DIR, "*.csv.gz")])
+def build_pyramid(source="Final_Merged_Dataset_with_UHI_Labels.csv", out_dir=PYRAMID_DIR):
+    """
+    Build and save every pyramid level for every region in ``source``.
+
+    :return: List of written file paths
+    """
+    df = read_dataset(source)
+    df['cell_id'] = df['system:index'].astype(str).str.rsplit('_', n=1).str[-1].astype(np.int64)
+    if 'Region' not in df.columns:
+        df['Region'] = load_config()['default']
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for name, region_df in df.groupby('Region'):
+        region = get_region(name)
+        for level_km in pyramid_levels(region):
+            path = level_path(name, level_km, out_dir)
+            with stage(f"build_pyramid.{name}_{level_km:g}km") as rec:
+                if level_km == region['cell_km']:
+                    level = region_df.drop(columns=['system:index']).assign(level_km=level_km)
+                else:
+                    level = aggregate_level(region_df, region, level_km)
+                level.to_csv(path, index=False)
+                rec["rows_in"], rec["rows_out"] = len(region_df), len(level)
+            written.append(path)
+            print(f"Pyramid level {name} {level_km} km: {level['cell_id'].nunique()} cells -> {path}")
+    return written
+
+
+def pyramid_levels(region):
+    """Configured levels that nest exactly in the region's base grid."""
+    return [km for km in load_config().get('pyramid_km', [region['cell_km']])
+            if km >= region['cell_km'] and float(km / region['cell_km']).is_integer()]
+
+
+def level_path(region_name, level_km, out_dir=PYRAMID_DIR):
+    return os.path.join(out_dir, f"{region_name}_{level_km:g}km.csv.gz")
+
+
+def available_levels(region_name, out_dir=PYRAMID_DIR):
+    """Base level plus every pyramid level already built for the region."""
+    region = get_region(region_name)
+    return [km for km in pyramid_levels(region)
+            if km == region['cell_km'] or os.path.exists(level_path(region_name, km, out_dir))]
+
+
+def read_latest(region_name, level_km, out_dir=PYRAMID_DIR):
+    """Rows of the latest date of one pyramid level."""
+    level = pd.read_csv(level_path(region_name, level_km, out_dir))
+    return level[level['Date'] == level['Date'].max()].reset_index(drop=True)
+
+
+def level_for_zoom(zoom, levels):
+    """Pick the pyramid level for a web-map zoom: about 10 km cells at zoom 8, 1 km at zoom 11+."""
+    wanted = 10 / 2 ** (zoom - 8)
+    return min(levels, key=lambda km: abs(math.log(km / wanted)))
+
+
+def check_conservation(days=3, rows=23, cols=17, factors=(2, 5, 10), seed=0):
+    """Self-test: area-weighted totals are identical on every level."""
+    rng = np.random.default_rng(seed)
+    values = rng.normal(30, 5, (days, rows, cols))
+    values[rng.random(values.shape) < 0.2] = np.nan
+    area = rng.uniform(0.9, 1.1, (rows, cols))
+    base_total = np.nansum(values * area, axis=(1, 2))
+    for factor in factors:
+        mean, covered = block_aggregate(values, area, factor)
+        level_total = np.nansum(mean * covered, axis=(1, 2))
+        assert np.allclose(level_total, base_total), (factor, level_total, base_total)
+        assert np.isclose(covered.sum(), np.where(np.isnan(values), 0, area).sum())
+    print(f"Conservation check passed for factors {factors}.")
+
+
+def check_levels(out_dir=PYRAMID_DIR):
+    """Self-test: no built level has a cell without a Cluster / UHI label."""
+    paths = sorted(glob.glob(os.path.join(out_dir, "*.csv.gz")))
+    for path in paths:
+        level = pd.read_csv(path)
+        missing = {c: int(level[c].isna().sum()) for c in CATEGORY_COLUMNS if c in level.columns}
+        assert not any(missing.values()), (path, missing)
+    print(f"Label check passed for {len(paths)} built level(s) in {out_dir}/.")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if "--check" in sys.argv:
+        check_conservation()
+        check_levels()
+    else:
+        build_pyramid()
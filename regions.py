@@ -0,0 +1,185 @@
+"""
+Study-area regions loaded from ``regions.json``.
+
+Every region is a regular grid built by ``generate_grid``. Cells get globally
+unique integer ids ``region_id * CELL_ID_STRIDE + grid_number`` where
+``grid_number`` is the row-major index within the region, so the Mumbai
+region (id 0) keeps the original 0..439 grid numbers and ids from different
+regions never collide when their results are stitched together. ``locate``
+maps arbitrary points to these ids arithmetically.
+"""
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from grids import LAT_KM_PER_DEG, generate_grid, grid_steps
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "regions.json")
+CELL_ID_STRIDE = 1_000_000
+NO_CELL = -1  # cell id of points outside every region
+
+
+def load_config(path=CONFIG_PATH):
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def get_region(name=None, path=CONFIG_PATH):
+    """
+    Region definition with its name and derived grid parameters filled in.
+
+    :param name: Region name; defaults to the config's ``default`` region
+    :return: dict with bottom_left, top_right, cell_km, lon_km_per_deg, lat_step, lon_step, ...
+    """
+    config = load_config(path)
+    name = name or config["default"]
+    if name not in config["regions"]:
+        raise KeyError(f"Unknown region '{name}'. Known regions: {', '.join(config['regions'])}")
+    region = dict(config["regions"][name], name=name)
+    if "lon_km_per_deg" not in region:
+        mid_lat = (region["bottom_left"][0] + region["top_right"][0]) / 2
+        region["lon_km_per_deg"] = LAT_KM_PER_DEG * math.cos(math.radians(mid_lat))
+    region["lat_step"], region["lon_step"] = grid_steps(region["cell_km"], region["lon_km_per_deg"])
+    return region
+
+
+def region_names(path=CONFIG_PATH):
+    return list(load_config(path)["regions"])
+
+
+def region_grid(region):
+    """Grid centers (rows, cols, 2) for a region dict or name."""
+    region = get_region(region) if isinstance(region, str) or region is None else region
+    return generate_grid(region["bottom_left"], region["top_right"],
+                         region["cell_km"], region["lon_km_per_deg"])
+
+
+def region_axes(region):
+    """
+    Lower-left corners of the grid rows/columns and the padded bounding box.
+
+    :return: (lat_values, lon_values, (lat_min, lon_min, lat_max, lon_max))
+    """
+    region = get_region(region) if isinstance(region, str) or region is None else region
+    lat_min, lon_min = region["bottom_left"]
+    lat_values = np.arange(lat_min, region["top_right"][0], region["lat_step"])
+    lon_values = np.arange(lon_min, region["top_right"][1], region["lon_step"])
+    bounds = (lat_min, lon_min, lat_values[-1] + region["lat_step"], lon_values[-1] + region["lon_step"])
+    return lat_values, lon_values, bounds
+
+
+def grid_cells(grid_centers, region_name="mumbai", region_id=0):
+    """
+    Flatten a grid-centre array into a cells table.
+
+    :param grid_centers: NumPy array (rows, cols, 2) from ``generate_grid``
+    :return: DataFrame with cell_id, Region, grid_number, row, col, Latitude, Longitude
+    """
+    rows, cols = grid_centers.shape[:2]
+    grid_number = np.arange(rows * cols)
+    return pd.DataFrame({
+        "cell_id": region_id * CELL_ID_STRIDE + grid_number,
+        "Region": region_name,
+        "grid_number": grid_number,
+        "row": grid_number // cols,
+        "col": grid_number % cols,
+        "Latitude": grid_centers[..., 0].ravel(),
+        "Longitude": grid_centers[..., 1].ravel(),
+    })
+
+
+def study_cells(names=None, path=CONFIG_PATH):
+    """
+    Cells of one or more regions with globally unique ids.
+
+    :param names: Region names (defaults to the config's default region)
+    :return: Concatenated cells table, see ``grid_cells``
+    """
+    names = names or [load_config(path)["default"]]
+    tables = []
+    for name in names:
+        region = get_region(name, path)
+        tables.append(grid_cells(region_grid(region), name, region["id"]))
+    return pd.concat(tables, ignore_index=True)
+
+
+def as_cells(grid_centers):
+    """Accept either a cells table or a legacy (rows, cols, 2) grid array."""
+    if isinstance(grid_centers, pd.DataFrame):
+        return grid_centers
+    return grid_cells(np.asarray(grid_centers))
+
+
+def region_of(cell_ids, path=CONFIG_PATH):
+    """Region names for an array of global cell ids."""
+    by_id = {r["id"]: name for name, r in load_config(path)["regions"].items()}
+    return pd.Series(np.asarray(cell_ids) // CELL_ID_STRIDE).map(by_id).to_numpy()
+
+
+def cell_id_from_index(system_index):
+    """Global cell id from ``system:index`` values of the form ``<image id>_<cell id>``."""
+    return pd.Series(system_index).str.rsplit("_", n=1).str[-1].astype(np.int64).to_numpy()
+
+
+def locate(lat, lon, names=None, path=CONFIG_PATH):
+    """
+    Global cell ids of arbitrary points, computed arithmetically from each region's grid.
+
+    Every region is a regular grid from ``bottom_left`` with fixed ``lat_step``/``lon_step``,
+    so a point's row and column are a floor division; no search is needed.
+
+    :param lat: Array-like of latitudes
+    :param lon: Array-like of longitudes
+    :param names: Regions to search (defaults to every configured region)
+    :return: int64 array of cell ids, ``NO_CELL`` for points outside every grid (or NaN)
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    cell_ids = np.full(lat.shape, NO_CELL, dtype=np.int64)
+    for name in names or region_names(path):
+        region = get_region(name, path)
+        lat_values, lon_values, _ = region_axes(region)
+        row = np.floor((lat - lat_values[0]) / region["lat_step"])
+        col = np.floor((lon - lon_values[0]) / region["lon_step"])
+        inside = ((row >= 0) & (row < len(lat_values)) & (col >= 0) & (col < len(lon_values))
+                  & (cell_ids == NO_CELL))
+        cell_ids[inside] = (region["id"] * CELL_ID_STRIDE
+                            + row[inside].astype(np.int64) * len(lon_values) + col[inside].astype(np.int64))
+    return cell_ids
+
+
+def join_cells(points, features, date=None, columns=None, path=CONFIG_PATH):
+    """
+    Attach cell ids and the cells' features/labels to a table of points.
+
+    :param points: DataFrame with Latitude and Longitude (and Date to match each point's own day)
+    :param features: Dataset with Date and cell_id or system:index, e.g. the labelled dataset
+    :param date: Day to join for every point; defaults to each point's Date, or the latest date
+    :param columns: Feature columns to attach (defaults to every non-key column)
+    :return: ``points`` with cell_id and feature columns; features are NaN for points without a cell
+    """
+    cell_ids = locate(points["Latitude"], points["Longitude"], path=path)
+    if "cell_id" not in features.columns:
+        features = features.assign(cell_id=cell_id_from_index(features["system:index"].astype(str)))
+    keys = {"system:index", "cell_id", "Date", "Latitude", "Longitude"}
+    columns = columns or [c for c in features.columns if c not in keys]
+
+    if date is None and "Date" in points.columns:
+        table = features
+        position = pd.MultiIndex.from_arrays([features["Date"], features["cell_id"]]).get_indexer(
+            pd.MultiIndex.from_arrays([points["Date"].to_numpy(), cell_ids]))
+    else:
+        table = features[features["Date"] == (date or features["Date"].max())]
+        position = pd.Index(table["cell_id"]).get_indexer(cell_ids)
+    joined = table[columns].reset_index(drop=True).reindex(position)
+    out = points.reset_index(drop=True).assign(cell_id=cell_ids)
+    return pd.concat([out, joined.set_axis(out.index)], axis=1)
+
+
+# For testing
+if __name__ == "__main__":
+    cells = study_cells(region_names())
+    print(cells.groupby("Region").size())
@@ -0,0 +1,137 @@
+"""
+Read-only datasets shared by every app session, with per-session edits kept as overlays.
+
+``load_table`` reads a CSV once into immutable columnar arrays: numeric
+columns become read-only numpy arrays and text columns (dates, regions,
+labels) become sorted (ordered) categoricals over read-only integer codes. DataFrames handed
+to sessions are views over these arrays, so slicing, renaming or filtering
+them never copies the shared table. Sessions must treat these frames as
+read-only; pandas' copy-on-write keeps the underlying arrays untouched even
+if they do not.
+
+With ``cache_dir`` the arrays are also written once as ``.npy`` files and
+memory-mapped, so several app processes on one machine share the same pages
+through the OS page cache.
+
+What-if edits are stored per session as an overlay ``{row label: {column:
+value}}``; ``apply_overlay`` copies only the edited columns of the (small)
+frame being displayed, so memory grows with the number of edits, not with
+the number of sessions.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def dataset_version(path):
+    """Version key of a file: changes whenever it is rewritten."""
+    stat = os.stat(path)
+    return hashlib.md5(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()[:12]
+
+
+def _columnar(df):
+    """{column: read-only array} plus {column: categories} for the text columns."""
+    arrays, categories = {}, {}
+    for column in df.columns:
+        values = df[column]
+        if values.dtype.kind in "biuf":
+            array = values.to_numpy()
+        else:
+            cat = values.astype("category")
+            array = cat.array.codes
+            categories[column] = [str(c) for c in cat.cat.categories]
+        array = np.ascontiguousarray(array)
+        array.flags.writeable = False
+        arrays[column] = array
+    return arrays, categories
+
+
+def _frame(arrays, categories):
+    columns = {}
+    for column, array in arrays.items():
+        if column in categories:
+            dtype = pd.CategoricalDtype(categories[column], ordered=True)
+            array = pd.Categorical.from_codes(array, dtype=dtype, validate=False)
+        columns[column] = pd.Series(array, copy=False)
+    return pd.DataFrame(columns, copy=False)
+
+
+def _write_npy(directory, arrays, categories):
+    tmp = directory + ".tmp"
+    os.makedirs(tmp, exist_ok=True)
+    for i, (column, array) in enumerate(arrays.items()):
+        np.save(os.path.join(tmp, f"{i}.npy"), array)
+    with open(os.path.join(tmp, "columns.json"), "w") as fh:
+        json.dump({"columns": list(arrays), "categories": categories}, fh)
+    try:
+        os.rename(tmp, directory)
+    except OSError:  # another process won the race
+        pass
+
+
+def _read_npy(directory):
+    with open(os.path.join(directory, "columns.json")) as fh:
+        meta = json.load(fh)
+    arrays = {column: np.load(os.path.join(directory, f"{i}.npy"), mmap_mode="r")
+              for i, column in enumerate(meta["columns"])}
+    return arrays, meta["categories"]
+
+
+def load_table(path, cache_dir=None, read=pd.read_csv, version=None):
+    """
+    Load a CSV as a read-only DataFrame backed by shared columnar arrays.
+
+    :param path: CSV file
+    :param cache_dir: Optional directory for memory-mapped copies shared between processes
+    :param read: Reader of the CSV (e.g. ``cadence.read_dataset`` to attach the 16-day NDVI)
+    :param version: Version key of what ``read`` returns (default: the file's ``dataset_version``)
+    :return: DataFrame whose columns are views over read-only arrays
+    """
+    if cache_dir:
+        version = version or dataset_version(path)
+        directory = os.path.join(cache_dir, f"{os.path.splitext(os.path.basename(path))[0]}-{version}")
+        if not os.path.exists(directory):
+            _write_npy(directory, *_columnar(read(path)))
+        return _frame(*_read_npy(directory))
+    return _frame(*_columnar(read(path)))
+
+
+def frozen(df):
+    """Read-only columnar copy of a (derived) DataFrame, for sharing between sessions."""
+    return _frame(*_columnar(df.reset_index(drop=True)))
+
+
+def table_nbytes(df):
+    """Bytes held by the table's arrays (memory-mapped pages included)."""
+    return int(df.memory_usage(index=False, deep=False).sum())
+
+
+def set_edit(overlay, row, column, value, base_value):
+    """Record an edit in ``overlay``, dropping it again when it equals the shared value."""
+    edits = overlay.setdefault(row, {})
+    if value == base_value or (isinstance(value, float) and np.isclose(value, base_value)):
+        edits.pop(column, None)
+    else:
+        edits[column] = value
+    if not edits:
+        overlay.pop(row)
+    return overlay
+
+
+def apply_overlay(df, overlay):
+    """``df`` with the overlay's edits; only edited columns are copied."""
+    if not overlay:
+        return df
+    edited = {}
+    for row, edits in overlay.items():
+        if row not in df.index:
+            continue
+        for column, value in edits.items():
+            if column not in edited:
+                shared = df[column]
+                edited[column] = shared.astype(object) if shared.dtype == "category" else shared.copy()
+            edited[column].loc[row] = value
+    return df.assign(**edited) if edited else df
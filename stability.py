@@ -0,0 +1,245 @@
+"""
+Bootstrap / reseeded stability of the five UHI clusters.
+
+``clustering_kmeans`` fits k-means once with ``random_state=42``. This
+command refits it many times in a process pool:
+
+- seed runs: the same subsample with a different k-means seed,
+- bootstrap runs: a fresh subsample drawn with replacement and a new seed.
+
+Every run fits on a float32 subsample (``sample_rows`` cell-days, features
+preprocessed exactly like the saved cluster model) and assigns all rows to
+the nearest centre. Labels are aligned across runs by ordering the centres
+by LST, hottest first, which is the rule ``clustering_kmeans`` uses for
+``dynamic_cluster_labels``; run labels are therefore directly comparable with
+the reference labels.
+
+Per cell the run's class is the cell's most frequent class over its days.
+The outputs are:
+
+- ``UHI_Stability.csv``: per cell the reference and consensus labels, the share of runs agreeing with the
+  consensus (all, seed-only and bootstrap-only runs) and the share of cell-days keeping their reference label.
+- ``UHI_Stability_Runs.npz``: the (runs, cells) class of every run. ``coassignment`` turns it into the share of
+  runs in which two cells got the same class; the apps draw it for a selected cell.
+
+The feature matrix is written once to a temporary ``.npy`` that the workers
+memory-map, and workers receive only run numbers, so the work is
+embarrassingly parallel and scales with the number of cores.
+
+Usage:
+    python stability.py --runs 200 --workers 8
+    python stability.py --scaling --runs 32
+"""
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from cadence import read_dataset
+from clustering import CLUSTER_MODEL_PATH, UHI_CLASSES, load_cluster_model
+from land_mask import keep_active
+from regions import cell_id_from_index
+
+STABILITY_PATH = "UHI_Stability.csv"
+RUNS_PATH = "UHI_Stability_Runs.npz"
+SEED, BOOTSTRAP = 0, 1  # run kinds
+
+_worker = {}
+
+
+def feature_matrix(df, model):
+    """Float32 rows preprocessed like ``classify``: -999/NaN -> training means, then standardised."""
+    x = np.column_stack([np.asarray(df[c], dtype=np.float32) for c in model["columns"]])
+    fill = np.asarray(model["fill"], dtype=np.float32)
+    x = np.where((x == -999) | np.isnan(x), fill, x)
+    x -= np.asarray(model["scale_mean"], dtype=np.float32)
+    x /= np.asarray(model["scale_std"], dtype=np.float32)
+    return x
+
+
+def lst_ranks(centers, lst_column=0):
+    """Class of every centre: 0 for the highest LST, as in ``dynamic_cluster_labels``."""
+    ranks = np.empty(len(centers), dtype=np.int8)
+    ranks[np.argsort(-centers[:, lst_column], kind='stable')] = np.arange(len(centers))
+    return ranks
+
+
+def nearest(x, centers, chunk=1 << 20):
+    """Index of the nearest centre of every row, in chunks to bound memory."""
+    centers = centers.astype(np.float32)
+    squared = (centers ** 2).sum(axis=1)
+    out = np.empty(len(x), dtype=np.int8)
+    for start in range(0, len(x), chunk):
+        block = np.asarray(x[start:start + chunk])
+        out[start:start + chunk] = (squared[None, :] - 2 * block @ centers.T).argmin(axis=1)
+    return out
+
+
+def _init_worker(matrix_path, cells_path, n_cells, reference_path, sample_rows, k, base_seed, lst_column):
+    from threadpoolctl import threadpool_limits
+
+    threadpool_limits(1)  # one core per worker; the pool provides the parallelism
+    _worker.update(x=np.load(matrix_path, mmap_mode='r'), cells=np.load(cells_path), n_cells=n_cells,
+                   reference=np.load(reference_path), sample_rows=sample_rows, k=k, base_seed=base_seed,
+                   lst_column=lst_column)
+
+
+def run_batch(runs):
+    """
+    Fit the given (run number, kind) pairs; runs in a pool worker.
+
+    :return: (run numbers, (runs, cells) int8 cell classes, per-row count of runs keeping the reference class, seconds)
+    """
+    from sklearn.cluster import KMeans
+
+    started = time.perf_counter()
+    x, cells, n_cells, k = _worker['x'], _worker['cells'], _worker['n_cells'], _worker['k']
+    sample_rows, base_seed = min(_worker['sample_rows'], len(x)), _worker['base_seed']
+    kept = np.zeros(len(x), dtype=np.uint16)
+    classes = np.empty((len(runs), n_cells), dtype=np.int8)
+    for i, (run, kind) in enumerate(runs):
+        if kind == SEED:  # one fixed subsample shared by every seed run
+            rows = np.random.default_rng(base_seed).choice(len(x), sample_rows, replace=False)
+        else:
+            rows = np.random.default_rng(base_seed + 1 + run).choice(len(x), sample_rows, replace=True)
+        kmeans = KMeans(n_clusters=k, n_init=1, random_state=base_seed + run).fit(x[np.sort(rows)])
+        row_class = lst_ranks(kmeans.cluster_centers_, _worker['lst_column'])[nearest(x, kmeans.cluster_centers_)]
+        kept += row_class == _worker['reference']
+        counts = np.bincount(cells * k + row_class, minlength=n_cells * k).reshape(n_cells, k)
+        classes[i] = counts.argmax(axis=1)
+    return [run for run, _ in runs], classes, kept, time.perf_counter() - started
+
+
+def modal(classes, k, axis=0):
+    """Most frequent class along ``axis`` of an int8 class array."""
+    counts = np.stack([(classes == c).sum(axis=axis) for c in range(k)])
+    return counts.argmax(axis=0).astype(np.int8)
+
+
+def stability(df, model, runs=200, seed_runs=None, sample_rows=50_000, max_workers=None, batch=5, base_seed=42):
+    """
+    Refit the clustering ``runs`` times in a process pool.
+
+    :param df: Labelled dataset (``UHI_Label`` is the reference) with the model's feature columns
+    :param seed_runs: Runs that only change the k-means seed (default: half of ``runs``), the rest are bootstrap runs
+    :param sample_rows: Cell-days each run is fitted on
+    :param batch: Runs per pool task
+    :return: (per-cell table, (runs, cells) class array, run kinds, timing dict)
+    """
+    k = len(model["centers"])
+    seed_runs = runs // 2 if seed_runs is None else seed_runs
+    kinds = np.array([SEED] * seed_runs + [BOOTSTRAP] * (runs - seed_runs), dtype=np.int8)
+    cell_id = df['cell_id'].to_numpy() if 'cell_id' in df.columns else cell_id_from_index(df['system:index'].astype(str))
+    cell_ids, cell_codes = np.unique(cell_id, return_inverse=True)
+    reference = pd.Series(df['UHI_Label']).map({label: i for i, label in enumerate(UHI_CLASSES)}).to_numpy(np.int8)
+
+    jobs = [[(run, int(kinds[run])) for run in range(start, min(start + batch, runs))] for start in range(0, runs, batch)]
+    classes = np.empty((runs, len(cell_ids)), dtype=np.int8)
+    kept = np.zeros(len(df), dtype=np.int64)
+    busy = 0.0
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, name) for name in ("x.npy", "cells.npy", "reference.npy")]
+        np.save(paths[0], feature_matrix(df, model))
+        np.save(paths[1], cell_codes.astype(np.int64))
+        np.save(paths[2], reference)
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(*paths[:2], len(cell_ids), paths[2], sample_rows, k, base_seed,
+                                           model["columns"].index('LST_Celsius'))) as pool:
+            for run_ids, run_classes, run_kept, seconds in pool.map(run_batch, jobs):
+                classes[run_ids] = run_classes
+                kept += run_kept
+                busy += seconds
+    wall = time.perf_counter() - started
+
+    consensus = modal(classes, k)
+    reference_cell = np.bincount(cell_codes * k + reference, minlength=len(cell_ids) * k).reshape(-1, k).argmax(axis=1)
+    agrees = classes == consensus[None, :]
+    keys = ['Region', 'Latitude', 'Longitude'] if 'Region' in df.columns else ['Latitude', 'Longitude']
+    table = df[keys].groupby(cell_codes).first().reset_index(drop=True)
+    table.insert(0, 'cell_id', cell_ids)
+    labels = np.array(UHI_CLASSES, dtype=object)
+    table['Reference_Label'] = labels[reference_cell]
+    table['Consensus_Label'] = labels[consensus]
+    table['Confidence'] = agrees.mean(axis=0).round(3)
+    table['Seed_Confidence'] = agrees[kinds == SEED].mean(axis=0).round(3) if seed_runs else np.nan
+    table['Bootstrap_Confidence'] = agrees[kinds == BOOTSTRAP].mean(axis=0).round(3) if runs > seed_runs else np.nan
+    table['Day_Agreement'] = (np.bincount(cell_codes, weights=kept) / (np.bincount(cell_codes) * runs)).round(3)
+    timing = {"runs": runs, "wall_s": wall, "busy_s": busy, "workers": max_workers or os.cpu_count(),
+              "speedup": busy / wall if wall else 0.0}
+    return table, classes, kinds, timing
+
+
+def coassignment(classes, cell):
+    """Share of runs in which every cell got the same class as cell position ``cell``."""
+    return (classes == classes[:, [cell]]).mean(axis=0)
+
+
+def coassignment_matrix(classes, k=len(UHI_CLASSES)):
+    """(cells, cells) share of runs in which two cells got the same class; for small grids only."""
+    total = np.zeros((classes.shape[1], classes.shape[1]), dtype=np.float32)
+    for c in range(k):
+        one_hot = (classes == c).astype(np.float32)
+        total += one_hot.T @ one_hot
+    return total / len(classes)
+
+
+def load_runs(path=RUNS_PATH):
+    """(cell ids, (runs, cells) classes, run kinds) saved by ``stability``."""
+    with np.load(path) as data:
+        return data['cell_id'], data['classes'], data['kinds']
+
+
+def run_stability(source="Final_Merged_Dataset_with_UHI_Labels.csv", model_path=CLUSTER_MODEL_PATH,
+                  output=STABILITY_PATH, runs_output=RUNS_PATH, **kwargs):
+    """Run ``stability`` on the labelled dataset and save the per-cell table and the run classes."""
+    df = keep_active(read_dataset(source))
+    table, classes, kinds, timing = stability(df, load_cluster_model(model_path), **kwargs)
+    table.to_csv(output, index=False)
+    np.savez_compressed(runs_output, cell_id=table['cell_id'].to_numpy(), classes=classes, kinds=kinds)
+    print(f"{timing['runs']} fits on {timing['workers']} worker(s) in {timing['wall_s']:.1f} s "
+          f"({timing['busy_s']:.1f} s of fitting, {timing['speedup']:.1f}x parallel)")
+    print(f"Mean confidence {table['Confidence'].mean():.1%} (seed runs {table['Seed_Confidence'].mean():.1%}, "
+          f"bootstrap runs {table['Bootstrap_Confidence'].mean():.1%}); "
+          f"{(table['Confidence'] >= 0.9).mean():.0%} of cells keep their class in >= 90 % of the runs")
+    print(f"Consensus equals the reference (random_state=42) class for "
+          f"{(table['Consensus_Label'] == table['Reference_Label']).mean():.0%} of cells; "
+          f"cell-days keep their reference class in {table['Day_Agreement'].mean():.1%} of the runs")
+    print(f"Saved {output} and {runs_output}")
+    return table, timing
+
+
+def scaling(df, model, runs=32, sample_rows=50_000, max_workers=None):
+    """Wall time of the same runs on 1, 2, 4, ... workers up to ``max_workers`` (default: every core)."""
+    max_workers = max_workers or os.cpu_count()
+    workers, results = 1, []
+    while workers <= max_workers:
+        timing = stability(df, model, runs=runs, sample_rows=sample_rows, max_workers=workers)[3]
+        results.append((workers, timing['wall_s']))
+        print(f"{workers:>3} worker(s): {timing['wall_s']:.1f} s, speedup {results[0][1] / timing['wall_s']:.2f}x")
+        workers *= 2
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bootstrap / reseeded stability of the UHI clusters")
+    parser.add_argument("--data", default="Final_Merged_Dataset_with_UHI_Labels.csv")
+    parser.add_argument("--model", default=CLUSTER_MODEL_PATH)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--seed-runs", type=int, help="Runs that only change the seed (default: half)")
+    parser.add_argument("--sample-rows", type=int, default=50_000)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--scaling", action="store_true", help="Time the runs on 1, 2, 4, ... workers")
+    args = parser.parse_args()
+
+    if args.scaling:
+        scaling(keep_active(read_dataset(args.data)), load_cluster_model(args.model), args.runs, args.sample_rows,
+                args.workers)
+    else:
+        run_stability(args.data, args.model, runs=args.runs, seed_runs=args.seed_runs,
+                      sample_rows=args.sample_rows, max_workers=args.workers)
@@ -0,0 +1,255 @@
+"""
+Storage clients for pipeline files kept in the Google Drive ``EarthEngine`` folder.
+
+``DriveStorage`` authenticates once per process, caches folder ids and looks
+files up inside the folder instead of searching the whole Drive. Downloads are
+skipped when the remote ``md5Checksum``/``modifiedDate`` still match the local
+manifest (``.drive_manifest.json``) and the local copy is untouched, and several
+files are fetched concurrently from a thread pool (pydrive >= 1.3 keeps one
+HTTP connection per thread).
+
+``LocalStorage`` has the same interface over a local directory and is used for
+tests and offline runs. Uploads replace an existing file of the same title in
+place and go up as resumable chunked uploads that retry a failed chunk instead
+of restarting the file. ``get_storage()`` picks ``LocalStorage`` when
+``UHI_STORAGE_DIR`` is set.
+"""
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+MANIFEST_PATH = ".drive_manifest.json"
+FOLDER_MIME = "application/vnd.google-apps.folder"
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # resumable upload chunk, multiple of 256 KB
+UPLOAD_MAX_RETRIES = 5
+
+_auth_lock = threading.Lock()
+_drive = None
+_folder_ids = {}
+
+
+def _drive_client():
+    """Authenticated GoogleDrive shared by every DriveStorage in the process."""
+    global _drive
+    with _auth_lock:
+        if _drive is None:
+            from pydrive.auth import GoogleAuth
+            from pydrive.drive import GoogleDrive
+
+            gauth = GoogleAuth()
+            gauth.LocalWebserverAuth()
+            _drive = GoogleDrive(gauth)
+        return _drive
+
+
+def file_md5(path):
+    h = hashlib.md5()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class _Storage:
+    """Manifest bookkeeping and concurrent downloads shared by both backends."""
+
+    def __init__(self, folder="EarthEngine", manifest_path=MANIFEST_PATH, max_workers=4):
+        self.folder = folder
+        self.manifest_path = manifest_path
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self.manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as fh:
+                self.manifest = json.load(fh)
+
+    # Backends implement list(), _fetch() and upload()
+
+    def find(self, title):
+        """Metadata of the file called ``title`` (case-insensitive), or None."""
+        matches = [m for m in self.list(title) if m["title"].lower() == title.lower()]
+        return matches[0] if matches else None
+
+    def _is_current(self, meta, local_path):
+        entry = self.manifest.get(os.path.abspath(local_path))
+        if not entry or not os.path.exists(local_path):
+            return False
+        remote_same = entry["md5"] == meta.get("md5Checksum") and entry["modifiedDate"] == meta.get("modifiedDate")
+        stat = os.stat(local_path)
+        local_same = entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime
+        return remote_same and local_same
+
+    def _record(self, meta, local_path):
+        stat = os.stat(local_path)
+        with self._lock:
+            self.manifest[os.path.abspath(local_path)] = {
+                "id": meta["id"],
+                "title": meta["title"],
+                "md5": meta.get("md5Checksum"),
+                "modifiedDate": meta.get("modifiedDate"),
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+            }
+
+    def save_manifest(self):
+        with self._lock:
+            tmp = self.manifest_path + ".tmp"
+            with open(tmp, "w") as fh:
+                json.dump(self.manifest, fh, indent=2)
+            os.replace(tmp, self.manifest_path)
+
+    def download_meta(self, meta, local_path):
+        """
+        Download one listed file unless the local copy is already current.
+
+        :return: True if the file was transferred, False if skipped
+        """
+        if self._is_current(meta, local_path):
+            return False
+        self._fetch(meta, local_path)
+        self._record(meta, local_path)
+        return True
+
+    def download(self, title, local_path=None):
+        meta = self.find(title)
+        if meta is None:
+            raise FileNotFoundError(f"{title} not found in {self.folder}")
+        changed = self.download_meta(meta, local_path or title)
+        self.save_manifest()
+        print(f"Downloaded: {title}" if changed else f"Up to date: {title}")
+        return changed
+
+    def download_many(self, pairs):
+        """
+        Download several ``(title or metadata, local_path)`` pairs concurrently.
+
+        :return: {local_path: transferred?}
+        """
+        def one(pair):
+            source, local_path = pair
+            meta = self.find(source) if isinstance(source, str) else source
+            if meta is None:
+                raise FileNotFoundError(f"{source} not found in {self.folder}")
+            return local_path, self.download_meta(meta, local_path)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = dict(pool.map(one, pairs))
+        self.save_manifest()
+        return results
+
+
+class DriveStorage(_Storage):
+    """Files in a Google Drive folder."""
+
+    def __init__(self, folder="EarthEngine", manifest_path=MANIFEST_PATH, max_workers=4):
+        super().__init__(folder, manifest_path, max_workers)
+        self.drive = _drive_client()
+
+    def folder_id(self):
+        with _auth_lock:
+            if self.folder not in _folder_ids:
+                found = self.drive.ListFile({'q': f"title='{self.folder}' and mimeType='{FOLDER_MIME}' "
+                                                  f"and trashed=false"}).GetList()
+                if not found:
+                    raise Exception(f" '{self.folder}' folder not found in your Drive!")
+                _folder_ids[self.folder] = found[0]['id']
+            return _folder_ids[self.folder]
+
+    def list(self, title_contains=""):
+        query = f"'{self.folder_id()}' in parents and trashed=false"
+        if title_contains:
+            query = f"title contains '{title_contains}' and " + query
+        return self.drive.ListFile({'q': query}).GetList()
+
+    def _fetch(self, meta, local_path):
+        meta.GetContentFile(local_path)
+
+    def upload(self, local_path, title=None):
+        """Upload ``local_path``, updating the file with the same title in place if there is one."""
+        title = title or os.path.basename(local_path)
+        existing = self.find(title)
+        service = getattr(getattr(self.drive, 'auth', None), 'service', None)
+        if service is not None:
+            return self._upload_resumable(service, local_path, title, existing)
+
+        # Without the API service (e.g. the offline fake) fall back to a plain pydrive upload
+        metadata = {'id': existing['id']} if existing else {'title': title, 'parents': [{'id': self.folder_id()}]}
+        uploaded_file = self.drive.CreateFile(metadata)
+        uploaded_file.SetContentFile(local_path)
+        uploaded_file.Upload()
+        return uploaded_file
+
+    def _upload_resumable(self, service, local_path, title, existing):
+        from googleapiclient.errors import HttpError
+        from googleapiclient.http import MediaFileUpload
+
+        mimetype = mimetypes.guess_type(local_path)[0] or 'application/octet-stream'
+        media = MediaFileUpload(local_path, mimetype=mimetype, chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+        if existing:
+            request = service.files().update(fileId=existing['id'], media_body=media)
+        else:
+            body = {'title': title, 'parents': [{'id': self.folder_id()}]}
+            request = service.files().insert(body=body, media_body=media)
+
+        response, retries = None, 0
+        while response is None:
+            try:
+                _, response = request.next_chunk()
+                retries = 0
+            except (HttpError, OSError) as exc:
+                if isinstance(exc, HttpError) and exc.resp.status < 500:
+                    raise
+                retries += 1
+                if retries > UPLOAD_MAX_RETRIES:
+                    raise
+                # The session resumes from the last byte the server acknowledged
+                time.sleep(2 ** retries)
+        return response
+
+
+class LocalStorage(_Storage):
+    """Files in ``root/<folder>`` on the local filesystem, with Drive-like metadata."""
+
+    def __init__(self, root, folder="EarthEngine", manifest_path=MANIFEST_PATH, max_workers=4):
+        super().__init__(folder, manifest_path, max_workers)
+        self.directory = os.path.join(root, folder)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _meta(self, name):
+        path = os.path.join(self.directory, name)
+        modified = datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc)
+        return {"id": path, "title": name, "md5Checksum": file_md5(path),
+                "modifiedDate": modified.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                "fileSize": str(os.path.getsize(path))}
+
+    def list(self, title_contains=""):
+        return [self._meta(name) for name in sorted(os.listdir(self.directory))
+                if title_contains.lower() in name.lower()]
+
+    def _fetch(self, meta, local_path):
+        shutil.copyfile(meta["id"], local_path)
+
+    def upload(self, local_path, title=None):
+        target = os.path.join(self.directory, title or os.path.basename(local_path))
+        shutil.copyfile(local_path, target)
+        return self._meta(os.path.basename(target))
+
+
+_storages = {}
+
+
+def get_storage(folder="EarthEngine"):
+    """Shared storage client for ``folder``: local when UHI_STORAGE_DIR is set, Google Drive otherwise."""
+    with _auth_lock:
+        if folder not in _storages:
+            root = os.environ.get("UHI_STORAGE_DIR")
+            _storages[folder] = LocalStorage(root, folder) if root else None
+    if _storages[folder] is None:
+        _storages[folder] = DriveStorage(folder)
+    return _storages[folder]